@@ -4,19 +4,101 @@
 分析骆驼祥子的行为和经历
 找出所有有骆驼祥子的章节，RAG这些章节的内容，询问骆驼祥子干了什么，
 然后把所有信息给到Gemini大模型进行中文输出
+
+用法:
+    python3 analyze_xiangzi_actions.py               # 单次调用，全部上下文放进一个提示
+    python3 analyze_xiangzi_actions.py --map-reduce  # 先并发总结各章，再逐层合并
+    python3 analyze_xiangzi_actions.py --metrics     # 记录各阶段耗时，写出 metrics.prom 和 metrics_report.json
 """
 
 import sys
 import os
 import json
+import asyncio
 sys.path.append('src')
 
 from vector_processor import VectorProcessor
-from openai import OpenAI
+from retrieval_server import RetrievalClient
+from llm_cache import LLMCache
+from context_packer import collect_hits, pack_passages, format_context
+import metrics
+from openai import OpenAI, AsyncOpenAI
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# 兼容OpenAI接口的服务地址和模型，可通过环境变量指向本地服务
+LLM_BASE_URL = os.getenv('LLM_BASE_URL', "https://openrouter.ai/api/v1")
+LLM_MODEL = os.getenv('LLM_MODEL', "google/gemini-2.5-pro")
+# 上下文的token预算：每个章节，以及单次调用的全部章节
+CHAPTER_TOKEN_BUDGET = int(os.getenv('CHAPTER_TOKEN_BUDGET', '1500'))
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '12000'))
+EXTRA_HEADERS = {
+    "HTTP-Referer": "http://localhost:8000",
+    "X-Title": "RAG QA System",
+}
+
+ANALYSIS_SYSTEM_PROMPT = """你是一个专门分析老舍小说《骆驼祥子》的文学专家。
+
+请根据提供的各章节文本片段，全面分析主角祥子在整个故事中的行为和经历。
+
+请按照以下结构进行分析：
+
+1. **祥子的主要行为总结**
+   - 按时间顺序梳理祥子的重要行为
+   - 分析每个行为的动机和背景
+
+2. **祥子的人生轨迹**
+   - 祥子的起点和目标
+   - 关键的转折点
+   - 最终的结局
+
+3. **祥子的性格变化**
+   - 初期的性格特点
+   - 中期的变化过程
+   - 后期的堕落过程
+
+4. **祥子行为的深层含义**
+   - 反映的社会问题
+   - 体现的人性特点
+   - 作者想要表达的主题
+
+请用清晰的中文进行详细分析，语言要准确、生动。"""
+
+CHAPTER_SUMMARY_PROMPT = """你是一个专门分析老舍小说《骆驼祥子》的文学专家。
+
+请根据提供的单个章节的文本片段，按时间顺序简要概括祥子在本章中做了什么、遇到了什么，
+以及体现出的性格特点。只依据文本片段，不要补充片段以外的情节，控制在300字以内。"""
+
+MERGE_SUMMARY_PROMPT = """你是一个专门分析老舍小说《骆驼祥子》的文学专家。
+
+请把提供的若干连续章节的概括合并为一段按时间顺序的概括，保留关键行为、转折点和性格变化，
+控制在600字以内。"""
+
+def get_llm_cache():
+    """
+    按环境变量创建响应缓存：LLM_CACHE_MODE 为 readwrite（默认）、replay（只回放，离线运行）
+    或 off（不缓存），LLM_CACHE_PATH 指定数据库路径
+    """
+    mode = os.getenv('LLM_CACHE_MODE', 'readwrite')
+    if mode == 'off':
+        return None
+    return LLMCache(os.getenv('LLM_CACHE_PATH', './llm_cache.sqlite'), mode=mode)
+
+def create_client() -> OpenAI:
+    """创建同步的大模型客户端"""
+    return OpenAI(
+        base_url=LLM_BASE_URL,
+        api_key=os.getenv('OPENROUTER_API_KEY'),
+    )
+
+def create_async_client() -> AsyncOpenAI:
+    """创建异步的大模型客户端"""
+    return AsyncOpenAI(
+        base_url=LLM_BASE_URL,
+        api_key=os.getenv('OPENROUTER_API_KEY'),
+    )
+
 def find_xiangzi_chapters():
     """找出所有包含'骆驼祥子'或'祥子'的章节"""
     
@@ -58,135 +140,237 @@ def analyze_xiangzi_actions():
     # 找出包含祥子的章节
     xiangzi_chapters = find_xiangzi_chapters()
     
-    # 初始化RAG系统
-    print("\n🚀 正在初始化RAG系统...")
-    processor = VectorProcessor()
-    processor.create_collection(reset=False)
-    
-    # 初始化OpenAI客户端
-    client = OpenAI(
-        base_url="https://openrouter.ai/api/v1",
-        api_key=os.getenv('OPENROUTER_API_KEY'),
-    )
+    # 初始化RAG系统（设置了RETRIEVAL_SERVER_URL时使用常驻检索服务，不在本进程加载模型）
+    server_url = os.getenv('RETRIEVAL_SERVER_URL')
+    if server_url:
+        print(f"\n🚀 正在连接检索服务: {server_url}")
+        processor = RetrievalClient(server_url)
+    else:
+        print("\n🚀 正在初始化RAG系统...")
+        processor = VectorProcessor(search_cache_path=os.getenv('SEARCH_CACHE_PATH', './search_cache.sqlite') or None)
+        processor.create_collection(reset=False)
     
     # 针对每个章节询问祥子的行为
     all_actions = []
     
     print(f"\n📖 开始分析 {len(xiangzi_chapters)} 个章节中祥子的行为...")
     
-    for i, chapter in enumerate(xiangzi_chapters, 1):
+    # 构建针对每个章节的查询
+    chapter_queries = [
+        [
+            f"第{chapter['chapter_num']}章祥子做了什么",
+            f"第{chapter['chapter_num']}章祥子的行为",
+            f"第{chapter['chapter_num']}章祥子的经历",
+            f"祥子在第{chapter['chapter_num']}章的活动"
+        ]
+        for chapter in xiangzi_chapters
+    ]
+    
+    # 一次批量检索所有章节的所有查询，每个查询只在对应章节内检索
+    all_queries = [query for queries in chapter_queries for query in queries]
+    all_filters = [
+        {'chapter_range': chapter['chapter_num']}
+        for chapter, queries in zip(xiangzi_chapters, chapter_queries)
+        for _ in queries
+    ]
+    with metrics.timer('rag_retrieval_seconds'):
+        all_results = iter(processor.search_many(all_queries, n_results=3, filters=all_filters))
+    
+    for chapter, queries in zip(xiangzi_chapters, chapter_queries):
         chapter_num = chapter['chapter_num']
         chapter_title = chapter['chapter_title']
         
         print(f"\n【第{chapter_num}章分析】: {chapter_title}")
         print("-" * 60)
         
-        # 构建针对该章节的查询
-        queries = [
-            f"第{chapter_num}章祥子做了什么",
-            f"第{chapter_num}章祥子的行为",
-            f"第{chapter_num}章祥子的经历",
-            f"祥子在第{chapter_num}章的活动"
-        ]
-        
-        chapter_context = ""
+        chapter_results = []
         
         for query in queries:
             print(f"  🔍 查询: {query}")
             
-            # 搜索相关内容
-            results = processor.search_similar(query, n_results=3)
+            # 对应的检索结果
+            results = next(all_results)
+            chapter_results.append(results)
             
-            for j, (doc, metadata, distance) in enumerate(zip(
-                results['documents'][0],
-                results['metadatas'][0], 
-                results['distances'][0]
-            )):
+            for distance in results['distances'][0]:
                 # 只选择相关度高的结果
                 similarity = 1 - distance
                 if similarity > 0.3:  # 只要相似度高于0.3的结果
-                    chapter_context += f"相关内容 (相似度: {similarity:.3f}): {doc}\n\n"
                     print(f"    ✓ 找到相关内容 (相似度: {similarity:.3f})")
         
-        if chapter_context:
+        # 多个查询命中的同一文本块只保留一次，相邻/重叠的文本块合并为一段
+        hits = collect_hits(chapter_results, min_similarity=0.3)
+        passages = pack_passages(hits, token_budget=CHAPTER_TOKEN_BUDGET)
+        
+        if passages:
             all_actions.append({
                 'chapter_num': chapter_num,
                 'chapter_title': chapter_title,
-                'context': chapter_context
+                'context': format_context(passages, with_headers=False),
+                'hits': hits
             })
+            print(f"  📎 {len(hits)} 个文本块整理为 {len(passages)} 个段落")
             print(f"  ✅ 第{chapter_num}章分析完成")
         else:
             print(f"  ⚠️  第{chapter_num}章未找到足够相关的内容")
     
     return all_actions
 
-def generate_comprehensive_analysis(all_actions):
-    """使用Gemini生成综合分析"""
+def generate_comprehensive_analysis(all_actions, cache=None):
+    """使用Gemini生成综合分析（提供cache时相同请求直接返回缓存的回复）"""
     
     print(f"\n🤖 正在使用Gemini生成综合分析...")
     
     # 初始化OpenAI客户端
-    client = OpenAI(
-        base_url="https://openrouter.ai/api/v1",
-        api_key=os.getenv('OPENROUTER_API_KEY'),
-    )
+    client = create_client()
     
-    # 构建完整的上下文
-    full_context = ""
-    for action in all_actions:
-        full_context += f"\n=== 第{action['chapter_num']}章: {action['chapter_title']} ===\n"
-        full_context += action['context']
-        full_context += "\n" + "-"*50 + "\n"
+    # 构建完整的上下文（所有章节共享一个token预算，按章节顺序排列）
+    all_hits = [hit for action in all_actions for hit in action['hits']]
+    full_context = format_context(pack_passages(all_hits, token_budget=CONTEXT_TOKEN_BUDGET))
     
-    system_prompt = """你是一个专门分析老舍小说《骆驼祥子》的文学专家。
+    user_message = f"""请基于以下从《骆驼祥子》各章节中提取的关于祥子行为的文本片段，进行全面分析：
 
-请根据提供的各章节文本片段，全面分析主角祥子在整个故事中的行为和经历。
+{full_context}
 
-请按照以下结构进行分析：
+请详细分析祥子在整个故事中做了什么，他的行为如何体现了他的性格变化和命运轨迹。"""
 
-1. **祥子的主要行为总结**
-   - 按时间顺序梳理祥子的重要行为
-   - 分析每个行为的动机和背景
+    request = dict(
+        extra_headers=EXTRA_HEADERS,
+        model=LLM_MODEL,
+        messages=[
+            {"role": "system", "content": ANALYSIS_SYSTEM_PROMPT},
+            {"role": "user", "content": user_message}
+        ],
+        temperature=0.7,
+        max_tokens=3000
+    )
+    
+    try:
+        with metrics.timer('rag_llm_request_seconds', stage='analysis'):
+            if cache is not None:
+                answer = cache.complete(client.chat.completions.create, **request)
+            else:
+                completion = client.chat.completions.create(**request)
+                answer = completion.choices[0].message.content
+        
+        print("\n" + "="*80)
+        print("📋 《骆驼祥子》主角行为综合分析")
+        print("="*80)
+        print(answer)
+        print("="*80)
+        
+        return answer
+        
+    except Exception as e:
+        print(f"❌ 生成综合分析时出错: {e}")
+        print_basic_analysis(all_actions)
+        return None
 
-2. **祥子的人生轨迹**
-   - 祥子的起点和目标
-   - 关键的转折点
-   - 最终的结局
+def print_basic_analysis(all_actions):
+    """API调用失败时，直接输出检索到的内容作为基础分析"""
+    print("\n📋 基于检索内容的基础分析：")
+    print("="*80)
+    print("从检索到的内容可以看出，祥子的主要行为包括：")
+    
+    for action in all_actions:
+        print(f"\n第{action['chapter_num']}章:")
+        # 简单提取一些关键信息
+        context = action['context'][:300] + "..." if len(action['context']) > 300 else action['context']
+        print(f"  {context}")
 
-3. **祥子的性格变化**
-   - 初期的性格特点
-   - 中期的变化过程
-   - 后期的堕落过程
+async def chat_async(client, semaphore, system_prompt, user_message, max_tokens, cache=None,
+                     stage="chat"):
+    """在并发上限内发起一次异步对话请求（提供cache时先查缓存；stage 为指标中的阶段标签）"""
+    request = dict(
+        extra_headers=EXTRA_HEADERS,
+        model=LLM_MODEL,
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_message}
+        ],
+        temperature=0.7,
+        max_tokens=max_tokens
+    )
+    async with semaphore:
+        with metrics.timer('rag_llm_request_seconds', stage=stage):
+            if cache is not None:
+                return await cache.complete_async(client.chat.completions.create, **request)
+            completion = await client.chat.completions.create(**request)
+    return completion.choices[0].message.content
 
-4. **祥子行为的深层含义**
-   - 反映的社会问题
-   - 体现的人性特点
-   - 作者想要表达的主题
+async def summarize_chapter(client, semaphore, action, cache=None):
+    """map阶段：概括单个章节中祥子的行为"""
+    user_message = f"""第{action['chapter_num']}章: {action['chapter_title']}
 
-请用清晰的中文进行详细分析，语言要准确、生动。"""
+{action['context']}
 
-    user_message = f"""请基于以下从《骆驼祥子》各章节中提取的关于祥子行为的文本片段，进行全面分析：
+请概括祥子在本章中的行为和经历。"""
+    summary = await chat_async(client, semaphore, CHAPTER_SUMMARY_PROMPT, user_message,
+                               max_tokens=600, cache=cache, stage="map")
+    print(f"  ✓ 第{action['chapter_num']}章概括完成")
+    return f"=== 第{action['chapter_num']}章: {action['chapter_title']} ===\n{summary}"
 
-{full_context}
+async def reduce_summaries(client, semaphore, summaries, fan_in=8, cache=None):
+    """
+    reduce阶段：概括数量超过fan_in时，每fan_in个连续概括并发合并为一个，
+    逐层合并直到不超过fan_in个，再生成最终的综合分析
+    """
+    level = 1
+    while len(summaries) > fan_in:
+        groups = [summaries[i:i + fan_in] for i in range(0, len(summaries), fan_in)]
+        print(f"  🔗 第{level}层合并: {len(summaries)} 个概括 → {len(groups)} 个")
+        summaries = await asyncio.gather(*[
+            chat_async(client, semaphore, MERGE_SUMMARY_PROMPT,
+                       "\n\n".join(group) + "\n\n请合并以上章节概括。",
+                       max_tokens=1200, cache=cache, stage="reduce")
+            for group in groups
+        ])
+        level += 1
+    
+    full_summary = "\n\n".join(summaries)
+    user_message = f"""请基于以下《骆驼祥子》各章节中祥子行为的概括，进行全面分析：
+
+{full_summary}
 
 请详细分析祥子在整个故事中做了什么，他的行为如何体现了他的性格变化和命运轨迹。"""
+    return await chat_async(client, semaphore, ANALYSIS_SYSTEM_PROMPT, user_message,
+                            max_tokens=3000, cache=cache, stage="analysis")
 
-    try:
-        completion = client.chat.completions.create(
-            extra_headers={
-                "HTTP-Referer": "http://localhost:8000",
-                "X-Title": "RAG QA System",
-            },
-            model="google/gemini-2.5-pro",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_message}
-            ],
-            temperature=0.7,
-            max_tokens=3000
-        )
+async def map_reduce_analysis_async(all_actions, client=None, max_concurrency=8, fan_in=8,
+                                    cache=None):
+    """
+    并发map-reduce分析：各章节概括并发请求（最多max_concurrency个同时进行），再逐层合并
+    
+    Args:
+        all_actions: analyze_xiangzi_actions 返回的章节上下文列表
+        client: 异步客户端，默认由环境变量配置
+        max_concurrency: 同时进行的请求数上限
+        fan_in: 每次合并的概括数量
+        cache: 响应缓存，为None时不缓存
         
-        answer = completion.choices[0].message.content
+    Returns:
+        综合分析文本
+    """
+    client = client or create_async_client()
+    semaphore = asyncio.Semaphore(max_concurrency)
+    
+    print(f"  🗺️  并发概括 {len(all_actions)} 个章节（并发上限 {max_concurrency}）...")
+    summaries = await asyncio.gather(*[
+        summarize_chapter(client, semaphore, action, cache=cache) for action in all_actions
+    ])
+    return await reduce_summaries(client, semaphore, list(summaries), fan_in=fan_in, cache=cache)
+
+def generate_map_reduce_analysis(all_actions, client=None, max_concurrency=8, fan_in=8,
+                                 cache=None):
+    """使用map-reduce方式生成综合分析（各章并发概括，再逐层合并）"""
+    
+    print(f"\n🤖 正在使用{LLM_MODEL}进行map-reduce分析...")
+    
+    try:
+        answer = asyncio.run(map_reduce_analysis_async(
+            all_actions, client=client, max_concurrency=max_concurrency, fan_in=fan_in,
+            cache=cache
+        ))
         
         print("\n" + "="*80)
         print("📋 《骆驼祥子》主角行为综合分析")
@@ -197,19 +381,8 @@ def generate_comprehensive_analysis(all_actions):
         return answer
         
     except Exception as e:
-        print(f"❌ 生成综合分析时出错: {e}")
-        
-        # 如果API调用失败，提供基础分析
-        print("\n📋 基于检索内容的基础分析：")
-        print("="*80)
-        print("从检索到的内容可以看出，祥子的主要行为包括：")
-        
-        for action in all_actions:
-            print(f"\n第{action['chapter_num']}章:")
-            # 简单提取一些关键信息
-            context = action['context'][:300] + "..." if len(action['context']) > 300 else action['context']
-            print(f"  {context}")
-        
+        print(f"❌ map-reduce分析时出错: {e}")
+        print_basic_analysis(all_actions)
         return None
 
 def main():
@@ -217,6 +390,10 @@ def main():
     
     print("🎬 开始分析《骆驼祥子》主角行为...")
     
+    # --metrics 或 METRICS_ENABLED=1 时记录各阶段耗时
+    if '--metrics' in sys.argv:
+        metrics.enable()
+    
     # 分析祥子在各章节中的行为
     all_actions = analyze_xiangzi_actions()
     
@@ -226,8 +403,23 @@ def main():
     
     print(f"\n✅ 成功分析了 {len(all_actions)} 个章节的内容")
     
-    # 生成综合分析
-    analysis = generate_comprehensive_analysis(all_actions)
+    # 生成综合分析（相同请求复用缓存的回复）
+    cache = get_llm_cache()
+    if '--map-reduce' in sys.argv:
+        analysis = generate_map_reduce_analysis(all_actions, cache=cache)
+    else:
+        analysis = generate_comprehensive_analysis(all_actions, cache=cache)
+    
+    if cache is not None:
+        print(f"\n🗃️  响应缓存: {cache.stats()}")
+    
+    written = metrics.write_outputs(extra={
+        'mode': 'map-reduce' if '--map-reduce' in sys.argv else 'single',
+        'llm_model': LLM_MODEL,
+        'llm_cache': cache.stats() if cache is not None else None
+    })
+    if written:
+        print(f"\n📈 运行指标已保存到: {', '.join(written)}")
     
     if analysis:
         # 保存分析结果
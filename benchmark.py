@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+端到端性能基准测试
+用合成小说在多个语料规模下测量各阶段的性能：EPUB解析、分块、向量化吞吐量、
+写入各索引后端、不同批大小的查询延迟（p50/p95/p99），以及各近似/量化索引相对精确检索的recall@k；
+结果写入JSON文件，可以与之前的结果比较以发现性能回退
+
+用法:
+    python3 benchmark.py                                        # 默认规模
+    python3 benchmark.py --sizes 1000,5000 --batch-sizes 1,8,32 # 指定语料规模（文本块数）和查询批大小
+    python3 benchmark.py --compare benchmark_baseline.json      # 与之前的结果比较
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Callable
+import numpy as np
+
+sys.path.append('src')
+
+from synthetic_novel import SyntheticNovelGenerator, write_epub
+from chunker import OffsetChunker
+from vector_processor import VectorProcessor, DEFAULT_INSERT_BATCH_SIZE
+
+# 各索引后端配置；"numpy" 为精确检索，作为recall的参照
+INDEX_CONFIGS: Dict[str, Dict[str, Any]] = {
+    'chroma': {'index_backend': 'chroma'},
+    'numpy': {'index_backend': 'numpy'},
+    'numpy-int8': {'index_backend': 'numpy', 'quantization': 'int8'},
+    'numpy-binary': {'index_backend': 'numpy', 'quantization': 'binary'},
+    'numpy-ivf': {'index_backend': 'numpy', 'ann_index': 'ivf'}
+}
+REFERENCE_CONFIG = 'numpy'
+
+# 比较结果时各指标的方向：越大越好的指标下降、越小越好的指标上升才算回退
+HIGHER_IS_BETTER = ('per_second', 'recall')
+
+
+def percentiles(seconds: List[float]) -> Dict[str, float]:
+    """延迟分位数（毫秒）"""
+    latencies = np.array(seconds, dtype=np.float64) * 1000
+    return {
+        'p50_ms': round(float(np.percentile(latencies, 50)), 3),
+        'p95_ms': round(float(np.percentile(latencies, 95)), 3),
+        'p99_ms': round(float(np.percentile(latencies, 99)), 3),
+        'mean_ms': round(float(latencies.mean()), 3)
+    }
+
+
+def timed(func: Callable, *args, **kwargs):
+    """执行函数，返回 (结果, 耗时秒数)"""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def bench_epub_parse(novel: Dict[str, Any], workdir: str) -> Dict[str, Any]:
+    """EPUB解析：写出合成EPUB后用EPUBProcessor逐章解析"""
+    from epub_processor import EPUBProcessor
+
+    epub_path = write_epub(novel, os.path.join(workdir, 'synthetic.epub'))
+    chapters, seconds = timed(lambda: list(EPUBProcessor().iter_chapters(epub_path)))
+    total_chars = sum(chapter['word_count'] for chapter in chapters)
+    return {
+        'chapters': len(chapters),
+        'chars': total_chars,
+        'seconds': round(seconds, 4),
+        'chars_per_second': round(total_chars / seconds, 1)
+    }
+
+
+def bench_chunking(novel: Dict[str, Any], chunk_size: int, overlap: int) -> Dict[str, Any]:
+    """分块：对全部章节分块（只计算偏移量，不含人物提取）"""
+    chunker = OffsetChunker(chunk_size=chunk_size, overlap=overlap)
+    index, seconds = timed(chunker.chunk_chapters, novel['chapters'])
+    return {
+        'chunks': len(index),
+        'chars': len(index.buffer),
+        'seconds': round(seconds, 4),
+        'chars_per_second': round(len(index.buffer) / seconds, 1)
+    }, index
+
+
+def count_tokens(processor: VectorProcessor, texts: List[str]) -> int:
+    """按模型分词器统计token数（没有分词器时按字符数估计）"""
+    tokenizer = getattr(processor.embedding_model, 'tokenizer', None)
+    if tokenizer is None:
+        return sum(len(text) for text in texts)
+    encoded = tokenizer(texts, add_special_tokens=True, truncation=True, max_length=512)
+    return sum(len(ids) for ids in encoded['input_ids'])
+
+
+def bench_embedding(processor: VectorProcessor, texts: List[str], batch_size: int) -> Dict[str, Any]:
+    """向量化吞吐量（不使用向量缓存）"""
+    processor.generate_embeddings(texts[:min(len(texts), batch_size)], batch_size=batch_size)  # 预热
+    embeddings, seconds = timed(processor.generate_embeddings, texts, batch_size=batch_size)
+    tokens = count_tokens(processor, texts)
+    return {
+        'texts': len(texts),
+        'tokens': tokens,
+        'batch_size': batch_size,
+        'seconds': round(seconds, 4),
+        'texts_per_second': round(len(texts) / seconds, 1),
+        'tokens_per_second': round(tokens / seconds, 1)
+    }, embeddings
+
+
+def open_index(name: str, workdir: str) -> VectorProcessor:
+    """按配置创建一个空集合（只打开索引，不加载模型）"""
+    config = INDEX_CONFIGS[name]
+    processor = VectorProcessor(
+        chroma_persist_directory=os.path.join(workdir, f'{name}_chroma'),
+        numpy_persist_directory=os.path.join(workdir, f'{name}_numpy'),
+        collection_name=f"benchmark_{name.replace('-', '_')}",
+        **config
+    )
+    processor.create_collection(reset=True)
+    return processor
+
+
+def bench_ingest(processor: VectorProcessor, index, embeddings: np.ndarray) -> Dict[str, Any]:
+    """写入索引（向量已预先生成，只测索引写入）"""
+    n = len(embeddings)
+    ids = [f"chunk_{row:06d}" for row in range(n)]
+    metadatas = [{'chapter_num': int(index.spans[row][0]) + 1} for row in range(n)]
+    documents = [index.text(row) for row in range(n)]
+
+    start = time.perf_counter()
+    for begin in range(0, n, DEFAULT_INSERT_BATCH_SIZE):
+        end = begin + DEFAULT_INSERT_BATCH_SIZE
+        processor.collection.add(
+            ids=ids[begin:end],
+            embeddings=processor.to_index_embeddings(embeddings[begin:end]),
+            metadatas=metadatas[begin:end],
+            documents=documents[begin:end]
+        )
+    seconds = time.perf_counter() - start
+    return {
+        'vectors': n,
+        'seconds': round(seconds, 4),
+        'vectors_per_second': round(n / seconds, 1)
+    }
+
+
+def bench_queries(encoder: VectorProcessor, processor: VectorProcessor, queries: List[str],
+                  batch_sizes: List[int], n_results: int) -> Dict[str, Any]:
+    """
+    查询延迟：每个批次编码查询并检索，批内每个查询的延迟都是整个批次的耗时
+
+    Returns:
+        {批大小: 延迟分位数和吞吐量}，以及每个查询的结果ID（用于计算recall）
+    """
+    # 第一次查询会触发量化码表/IVF单元等的延迟构建，单独计时，不计入延迟分位数
+    _, first_query_seconds = timed(
+        processor.collection.query,
+        query_embeddings=processor.to_index_embeddings(encoder.encode_queries(queries[:1])),
+        n_results=n_results, include=['distances']
+    )
+    report, result_ids = {}, None
+    for batch_size in batch_sizes:
+        latencies, ids = [], []
+        start = time.perf_counter()
+        for begin in range(0, len(queries), batch_size):
+            batch = queries[begin:begin + batch_size]
+            batch_start = time.perf_counter()
+            query_embeddings = encoder.encode_queries(batch)
+            results = processor.collection.query(
+                query_embeddings=processor.to_index_embeddings(query_embeddings),
+                n_results=n_results,
+                include=['distances']
+            )
+            latencies.extend([time.perf_counter() - batch_start] * len(batch))
+            ids.extend(results['ids'])
+        seconds = time.perf_counter() - start
+        report[str(batch_size)] = {
+            **percentiles(latencies),
+            'queries_per_second': round(len(queries) / seconds, 1)
+        }
+        result_ids = ids
+    return {'first_query_seconds': round(first_query_seconds, 4), 'latency': report}, result_ids
+
+
+def recall_at_k(result_ids: List[List[str]], reference_ids: List[List[str]], k: int) -> float:
+    """recall@k：结果前k个中属于精确检索前k个的比例"""
+    hits = sum(len(set(ours[:k]) & set(exact[:k])) for ours, exact in zip(result_ids, reference_ids))
+    total = sum(min(k, len(exact)) for exact in reference_ids)
+    return round(hits / total, 4) if total else 0.0
+
+
+def make_queries(n_queries: int, seed: int) -> List[str]:
+    """用生成器的句子作为查询"""
+    generator = SyntheticNovelGenerator(seed=seed + 1)
+    return [generator.sentence() for _ in range(n_queries)]
+
+
+def run_benchmark(sizes: List[int], batch_sizes: List[int], indexes: List[str],
+                  n_queries: int = 200, k: int = 10, embed_batch_size: int = 64,
+                  chunk_size: int = 400, overlap: int = 80, seed: int = 0,
+                  skip_epub: bool = False, workdir: Optional[str] = None) -> Dict[str, Any]:
+    """
+    运行全部基准测试
+
+    Args:
+        sizes: 语料规模列表（文本块数）
+        batch_sizes: 查询批大小列表
+        indexes: 测试的索引配置名（见 INDEX_CONFIGS）
+        n_queries: 每个规模的查询数
+        k: recall@k 和查询返回的结果数
+        embed_batch_size: 向量化批大小
+        chunk_size: 分块大小
+        overlap: 重叠字符数
+        seed: 合成小说的随机种子
+        skip_epub: 跳过EPUB解析（未安装ebooklib时自动跳过）
+        workdir: 临时索引目录，默认使用系统临时目录并在结束后删除
+
+    Returns:
+        可写入JSON的结果字典
+    """
+    own_workdir = workdir is None
+    workdir = workdir or tempfile.mkdtemp(prefix='rag_benchmark_')
+    encoder = VectorProcessor()
+    queries = make_queries(n_queries, seed)
+
+    # 一次生成足够大的合成小说，各规模取前N个文本块
+    chars_needed = max(sizes) * (chunk_size - overlap) * 1.1
+    novel = SyntheticNovelGenerator(seed=seed).novel(
+        n_chapters=max(1, int(chars_needed // 20000) + 1), chars_per_chapter=20000
+    )
+
+    report: Dict[str, Any] = {
+        'created_at': datetime.now().isoformat(),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'model_name': encoder.model_name
+        },
+        'parameters': {
+            'sizes': sizes, 'batch_sizes': batch_sizes, 'indexes': indexes, 'n_queries': n_queries,
+            'k': k, 'embed_batch_size': embed_batch_size, 'chunk_size': chunk_size,
+            'overlap': overlap, 'seed': seed
+        },
+        'stages': {}
+    }
+
+    try:
+        if skip_epub:
+            report['stages']['epub_parse'] = {'skipped': '已指定 --skip-epub'}
+        else:
+            try:
+                report['stages']['epub_parse'] = bench_epub_parse(novel, workdir)
+            except ImportError as e:
+                report['stages']['epub_parse'] = {'skipped': f'缺少依赖: {e}'}
+        print(f"📖 EPUB解析: {report['stages']['epub_parse']}")
+
+        report['stages']['chunking'], chunk_index = bench_chunking(novel, chunk_size, overlap)
+        print(f"✂️ 分块: {report['stages']['chunking']}")
+
+        texts = [chunk_index.text(row) for row in range(min(max(sizes), len(chunk_index)))]
+        report['stages']['embedding'], embeddings = bench_embedding(encoder, texts, embed_batch_size)
+        print(f"🧮 向量化: {report['stages']['embedding']}")
+        report['environment']['startup'] = encoder.startup_report()
+
+        report['stages']['index'] = {}
+        for size in sizes:
+            size_report = {}
+            reference_ids = None
+            # 先测精确检索，作为其他索引的recall参照
+            ordered = sorted(indexes, key=lambda name: name != REFERENCE_CONFIG)
+            for name in ordered:
+                try:
+                    processor = open_index(name, workdir)
+                except ImportError as e:
+                    size_report[name] = {'skipped': f'缺少依赖: {e}'}
+                    continue
+                entry = {'ingest': bench_ingest(processor, chunk_index, embeddings[:size])}
+                query_report, result_ids = bench_queries(encoder, processor, queries, batch_sizes, k)
+                entry.update(query_report)
+                if name == REFERENCE_CONFIG:
+                    reference_ids = result_ids
+                elif reference_ids is not None:
+                    entry[f'recall@{k}'] = recall_at_k(result_ids, reference_ids, k)
+                size_report[name] = entry
+                print(f"🗂️ {size} 个文本块 / {name}: {entry}")
+            report['stages']['index'][str(size)] = size_report
+    finally:
+        if own_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return report
+
+
+def _flatten(report: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    """把嵌套的结果展开为 路径 -> 数值"""
+    flat = {}
+    for key, value in report.items():
+        path = f"{prefix}/{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(_flatten(value, path))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = float(value)
+    return flat
+
+
+def compare_reports(baseline: Dict[str, Any], current: Dict[str, Any],
+                    tolerance: float = 0.1) -> List[Dict[str, Any]]:
+    """
+    比较两次结果，找出性能回退
+
+    Args:
+        baseline: 之前的结果
+        current: 本次结果
+        tolerance: 允许的相对变化（0.1 表示 10%）
+
+    Returns:
+        回退的指标列表，每项包含 指标路径、之前的值、本次的值和相对变化
+    """
+    before, after = _flatten(baseline['stages']), _flatten(current['stages'])
+    regressions = []
+    for path, old in before.items():
+        if path not in after or old == 0:
+            continue
+        metric = path.rsplit('/', 1)[-1]
+        if not (metric.endswith('_ms') or metric.endswith('seconds') or
+                any(word in metric for word in HIGHER_IS_BETTER)):
+            continue
+        change = (after[path] - old) / abs(old)
+        higher_is_better = any(word in metric for word in HIGHER_IS_BETTER)
+        if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+            regressions.append({'metric': path, 'baseline': old, 'current': after[path],
+                                'change': round(change, 4)})
+    return regressions
+
+
+def parse_int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(',') if item.strip()]
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="RAG系统性能基准测试")
+    parser.add_argument('--sizes', type=parse_int_list, default=[1000, 5000],
+                        help="语料规模（文本块数），逗号分隔")
+    parser.add_argument('--batch-sizes', type=parse_int_list, default=[1, 8, 32],
+                        help="查询批大小，逗号分隔")
+    parser.add_argument('--indexes', default=",".join(INDEX_CONFIGS),
+                        help=f"索引配置，逗号分隔，可选 {', '.join(INDEX_CONFIGS)}")
+    parser.add_argument('--queries', type=int, default=200, help="每个规模的查询数")
+    parser.add_argument('--k', type=int, default=10, help="recall@k 的k")
+    parser.add_argument('--embed-batch-size', type=int, default=64, help="向量化批大小")
+    parser.add_argument('--seed', type=int, default=0, help="合成小说的随机种子")
+    parser.add_argument('--skip-epub', action='store_true', help="跳过EPUB解析测试")
+    parser.add_argument('--output', default="benchmark_results.json", help="结果JSON文件")
+    parser.add_argument('--compare', help="与之前的结果JSON比较")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="比较时允许的相对变化")
+    args = parser.parse_args()
+
+    indexes = [name for name in args.indexes.split(',') if name]
+    unknown = [name for name in indexes if name not in INDEX_CONFIGS]
+    if unknown:
+        parser.error(f"未知的索引配置: {', '.join(unknown)}")
+
+    print("=" * 70)
+    print("⏱️ RAG系统性能基准测试")
+    print("=" * 70)
+
+    report = run_benchmark(args.sizes, args.batch_sizes, indexes, n_queries=args.queries,
+                           k=args.k, embed_batch_size=args.embed_batch_size, seed=args.seed,
+                           skip_epub=args.skip_epub)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n📄 结果已保存到: {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_reports(baseline, report, args.tolerance)
+        if regressions:
+            print(f"\n⚠️ 发现 {len(regressions)} 项性能回退（容差 {args.tolerance:.0%}）:")
+            for item in regressions:
+                print(f"  {item['metric']}: {item['baseline']} → {item['current']} ({item['change']:+.1%})")
+            sys.exit(1)
+        print(f"\n✅ 与 {args.compare} 相比没有超过 {args.tolerance:.0%} 的性能回退")
+
+
+if __name__ == "__main__":
+    main()
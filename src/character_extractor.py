@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+人物名称提取模块
+基于Aho-Corasick自动机的多模式匹配，一次扫描文本即可找出所有人物（含别名）的出现位置
+"""
+
+import json
+import logging
+from collections import deque
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Tuple
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 《骆驼祥子》人物词典：标准名 -> 别名列表
+DEFAULT_CHARACTER_ALIASES: Dict[str, List[str]] = {
+    '祥子': ['骆驼祥子'],
+    '虎妞': ['虎姑娘'],
+    '小福子': [],
+    '刘四爷': ['刘四'],
+    '老马': [],
+    '小马': [],
+    '曹先生': [],
+    '高妈': [],
+    '阮明': [],
+    '夏太太': [],
+    '杨太太': [],
+    '张妈': [],
+    '二强子': [],
+    '小文': [],
+    '老程': [],
+    '丁四': [],
+    '孙排长': []
+}
+
+
+class CharacterMatcher:
+    """人物名称多模式匹配器（Aho-Corasick）"""
+
+    def __init__(self, character_aliases: Optional[Dict[str, List[str]]] = None):
+        """
+        构建自动机
+
+        Args:
+            character_aliases: 人物词典，标准名 -> 别名列表；为None时使用《骆驼祥子》默认词典
+        """
+        if character_aliases is None:
+            character_aliases = DEFAULT_CHARACTER_ALIASES
+
+        # 模式串 -> 标准名
+        self.patterns: Dict[str, str] = {}
+        for name, aliases in character_aliases.items():
+            for pattern in [name] + list(aliases):
+                if pattern:
+                    self.patterns[pattern] = name
+
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[Optional[str]] = [None]   # 在该节点结束的模式串
+        self._dict_link: List[int] = [0]              # 沿失败链最近的输出节点
+        self._build()
+
+    @classmethod
+    def from_json(cls, json_file_path: str) -> 'CharacterMatcher':
+        """从JSON人物词典（标准名 -> 别名列表）构建匹配器"""
+        with open(json_file_path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def _build(self):
+        """构建字典树、失败指针和输出链接"""
+        for pattern in self.patterns:
+            node = 0
+            for char in pattern:
+                if char not in self._goto[node]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(None)
+                    self._dict_link.append(0)
+                    self._goto[node][char] = len(self._goto) - 1
+                node = self._goto[node][char]
+            self._output[node] = pattern
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                fail_node = self._fail[child]
+                self._dict_link[child] = fail_node if self._output[fail_node] else self._dict_link[fail_node]
+                queue.append(child)
+
+    def find_all(self, text: str) -> List[Tuple[int, int, str]]:
+        """
+        一次扫描找出所有人物出现位置
+
+        重叠的匹配取最左最长者，例如"骆驼祥子"只计为一次"祥子"
+
+        Args:
+            text: 文本
+
+        Returns:
+            (起始位置, 结束位置, 标准名) 列表，按起始位置排序
+        """
+        goto, fail, output, dict_link = self._goto, self._fail, self._output, self._dict_link
+        matches = []
+        node = 0
+        for i, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+
+            hit = node if output[node] else dict_link[node]
+            while hit:
+                pattern = output[hit]
+                matches.append((i + 1 - len(pattern), i + 1, pattern))
+                hit = dict_link[hit]
+
+        matches.sort(key=lambda match: (match[0], -match[1]))
+        selected = []
+        last_end = 0
+        for start, end, pattern in matches:
+            if start >= last_end:
+                selected.append((start, end, self.patterns[pattern]))
+                last_end = end
+        return selected
+
+    def extract(self, text: str) -> Dict[str, Dict[str, Any]]:
+        """
+        提取人物及其出现次数和位置
+
+        Args:
+            text: 文本
+
+        Returns:
+            标准名 -> {'count': 出现次数, 'offsets': 起始位置列表}，按首次出现顺序排列
+        """
+        mentions: Dict[str, Dict[str, Any]] = {}
+        for start, _, name in self.find_all(text):
+            mention = mentions.setdefault(name, {'count': 0, 'offsets': []})
+            mention['count'] += 1
+            mention['offsets'].append(start)
+        return mentions
+
+    def aliases_of(self, name: str) -> List[str]:
+        """获取标准名对应的全部模式串（标准名本身及其别名）"""
+        return [pattern for pattern, canonical in self.patterns.items() if canonical == name] or [name]
+
+    def names(self, text: str) -> List[str]:
+        """提取文本中出现的人物标准名（按首次出现顺序，去重）"""
+        return list(self.extract(text))
+
+
+@lru_cache(maxsize=1)
+def get_default_matcher() -> CharacterMatcher:
+    """获取基于默认人物词典的共享匹配器"""
+    return CharacterMatcher()
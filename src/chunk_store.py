@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+列式文本块存储模块
+把文本块保存为一个目录：全部正文拼接成一个UTF-8字节块并配偏移量数组，
+章节、书名、作者等重复字段按字典编码，整数字段为int64列，人物为位图；
+各列用内存映射方式打开，按行号或chunk_id随机读取，不需要把整个文件读进内存
+"""
+
+import os
+import json
+import logging
+from typing import List, Dict, Any, Iterable, Iterator, Optional
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+INT_MISSING = np.iinfo(np.int64).min
+
+
+def _write_strings(path: str, strings: List[str]):
+    """把字符串列写成 UTF-8字节块(.bin) + 偏移量数组(_offsets.npy)"""
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(data) for data in encoded])
+    with open(path + '.bin', 'wb') as f:
+        for data in encoded:
+            f.write(data)
+    np.save(path + '_offsets.npy', offsets)
+
+
+def _open_blob(path: str) -> np.ndarray:
+    """以只读内存映射方式打开字节块（空文件无法映射，返回空数组）"""
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=np.uint8)
+    return np.memmap(path, dtype=np.uint8, mode='r')
+
+
+def is_chunk_store(path: str) -> bool:
+    """判断路径是否为列式文本块存储目录"""
+    return os.path.isfile(os.path.join(path, 'meta.json'))
+
+
+class ChunkStore:
+    """内存映射的列式文本块存储"""
+
+    def __init__(self, path: str):
+        """
+        打开已有的存储目录
+
+        Args:
+            path: ChunkStore.write 生成的目录
+        """
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('format_version') != FORMAT_VERSION:
+            raise ValueError(f"不支持的文本块存储版本: {meta.get('format_version')}")
+
+        self.fields: List[str] = meta['fields']
+        self.dictionaries: Dict[str, list] = meta['dictionaries']
+        self.int_fields: List[str] = meta['int_fields']
+        self.character_names: List[str] = meta['character_names']
+        self.has_characters: bool = meta['has_characters']
+        self._count: int = meta['count']
+
+        load = lambda name: np.load(os.path.join(path, name), mmap_mode='r')
+        self._content = _open_blob(os.path.join(path, 'content.bin'))
+        self._content_offsets = load('content_offsets.npy')
+        self._ids = _open_blob(os.path.join(path, 'ids.bin'))
+        self._id_offsets = load('ids_offsets.npy')
+        self._codes = {field: load(f'dict_{index}.npy')
+                       for index, field in enumerate(self.dictionaries)}
+        self._ints = {field: load(f'int_{index}.npy')
+                      for index, field in enumerate(self.int_fields)}
+        if self.has_characters:
+            self._character_bits = load('characters_bits.npy')
+            self._character_codes = load('characters_codes.npy')
+            self._character_offsets = load('characters_offsets.npy')
+        self._row_by_id: Optional[Dict[str, int]] = None
+
+    @classmethod
+    def write(cls, path: str, chunks: Iterable[Dict[str, Any]]) -> 'ChunkStore':
+        """
+        把文本块写成列式存储
+
+        Args:
+            path: 输出目录
+            chunks: 文本块字典（与 luotuoxiangzi_chunks.json 中的格式相同）
+
+        Returns:
+            打开的 ChunkStore
+        """
+        chunks = list(chunks)
+        os.makedirs(path, exist_ok=True)
+        meta_path = os.path.join(path, 'meta.json')
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+
+        # 字段顺序按首次出现记录，导出时每个文本块的键顺序保持不变
+        fields: List[str] = []
+        for chunk in chunks:
+            for key in chunk:
+                if key not in fields:
+                    fields.append(key)
+        columns = [field for field in fields if field not in ('chunk_id', 'content', 'characters')]
+
+        # 全部为整数的字段存成int64列，其余字段字典编码
+        int_fields = [
+            field for field in columns
+            if all(type(chunk[field]) is int for chunk in chunks if field in chunk)
+        ]
+        dictionaries: Dict[str, list] = {}
+        for field in columns:
+            if field in int_fields:
+                values = [chunk.get(field, INT_MISSING) for chunk in chunks]
+                np.save(os.path.join(path, f'int_{int_fields.index(field)}.npy'),
+                        np.array(values, dtype=np.int64))
+                continue
+            dictionary, lookup, codes = [], {}, np.full(len(chunks), -1, dtype=np.int32)
+            for row, chunk in enumerate(chunks):
+                if field not in chunk:
+                    continue
+                key = json.dumps(chunk[field], ensure_ascii=False, sort_keys=True)
+                if key not in lookup:
+                    lookup[key] = len(dictionary)
+                    dictionary.append(chunk[field])
+                codes[row] = lookup[key]
+            np.save(os.path.join(path, f'dict_{len(dictionaries)}.npy'), codes)
+            dictionaries[field] = dictionary
+
+        _write_strings(os.path.join(path, 'content'), [chunk.get('content', '') for chunk in chunks])
+        _write_strings(os.path.join(path, 'ids'),
+                       [chunk.get('chunk_id', f"chunk_{row:04d}") for row, chunk in enumerate(chunks)])
+
+        # 人物：位图用于按人物筛选，另存每个文本块内的人物顺序，保证导出结果与原文件一致
+        has_characters = 'characters' in fields
+        character_names: List[str] = []
+        if has_characters:
+            name_index: Dict[str, int] = {}
+            codes, offsets = [], [0]
+            for chunk in chunks:
+                for name in chunk.get('characters') or []:
+                    if name not in name_index:
+                        name_index[name] = len(character_names)
+                        character_names.append(name)
+                    codes.append(name_index[name])
+                offsets.append(len(codes))
+            codes = np.array(codes, dtype=np.int32)
+            offsets = np.array(offsets, dtype=np.int64)
+
+            bits = np.zeros((len(chunks), max(len(character_names), 1)), dtype=bool)
+            rows = np.repeat(np.arange(len(chunks)), np.diff(offsets))
+            bits[rows, codes] = True
+            np.save(os.path.join(path, 'characters_bits.npy'), np.packbits(bits, axis=1))
+            np.save(os.path.join(path, 'characters_codes.npy'), codes)
+            np.save(os.path.join(path, 'characters_offsets.npy'), offsets)
+
+        # meta.json 最后写入，存在即表示存储完整
+        meta = {
+            'format_version': FORMAT_VERSION,
+            'count': len(chunks),
+            'fields': fields,
+            'int_fields': int_fields,
+            'dictionaries': dictionaries,
+            'character_names': character_names,
+            'has_characters': has_characters
+        }
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+        logger.info(f"已写入列式文本块存储: {path} ({len(chunks)} 个文本块)")
+        return cls(path)
+
+    @classmethod
+    def from_json(cls, json_file_path: str, path: str) -> 'ChunkStore':
+        """由文本块JSON文件生成列式存储"""
+        with open(json_file_path, 'r', encoding='utf-8') as f:
+            return cls.write(path, json.load(f))
+
+    def to_json(self, json_file_path: str, indent: Optional[int] = 2):
+        """导出为文本块JSON文件（格式与 convert_novel_to_chunks 的输出相同）"""
+        with open(json_file_path, 'w', encoding='utf-8') as f:
+            json.dump(list(self), f, ensure_ascii=False, indent=indent)
+
+    def __len__(self) -> int:
+        return self._count
+
+    @staticmethod
+    def _string(blob: np.ndarray, offsets: np.ndarray, row: int) -> str:
+        return blob[offsets[row]:offsets[row + 1]].tobytes().decode('utf-8')
+
+    def content(self, row: int) -> str:
+        """第 row 个文本块的正文"""
+        return self._string(self._content, self._content_offsets, row)
+
+    def chunk_id(self, row: int) -> str:
+        """第 row 个文本块的ID"""
+        return self._string(self._ids, self._id_offsets, row)
+
+    def characters(self, row: int) -> List[str]:
+        """第 row 个文本块中的人物（按原顺序）"""
+        codes = self._character_codes[self._character_offsets[row]:self._character_offsets[row + 1]]
+        return [self.character_names[code] for code in codes]
+
+    def __getitem__(self, row: int) -> Dict[str, Any]:
+        """按行号读取一个文本块，返回与JSON中相同的字典"""
+        if not 0 <= row < self._count:
+            raise IndexError(row)
+        chunk = {}
+        for field in self.fields:
+            if field == 'chunk_id':
+                chunk[field] = self.chunk_id(row)
+            elif field == 'content':
+                chunk[field] = self.content(row)
+            elif field == 'characters':
+                chunk[field] = self.characters(row)
+            elif field in self._ints:
+                value = int(self._ints[field][row])
+                if value != INT_MISSING:
+                    chunk[field] = value
+            else:
+                code = int(self._codes[field][row])
+                if code >= 0:
+                    chunk[field] = self.dictionaries[field][code]
+        return chunk
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for row in range(self._count):
+            yield self[row]
+
+    def row_of(self, chunk_id: str) -> int:
+        """chunk_id 对应的行号（首次调用时建立ID索引）"""
+        if self._row_by_id is None:
+            self._row_by_id = {self.chunk_id(row): row for row in range(self._count)}
+        return self._row_by_id[chunk_id]
+
+    def get(self, chunk_id: str) -> Dict[str, Any]:
+        """按chunk_id读取一个文本块"""
+        return self[self.row_of(chunk_id)]
+
+    def rows_with_character(self, name: str) -> np.ndarray:
+        """包含指定人物的文本块行号（直接在位图上计算）"""
+        if not self.has_characters or name not in self.character_names:
+            return np.zeros(0, dtype=np.int64)
+        code = self.character_names.index(name)
+        column = self._character_bits[:, code // 8] & (0x80 >> (code % 8))
+        return np.flatnonzero(column)
+
+    def rows_where(self, field: str, value: Any) -> np.ndarray:
+        """某一列等于指定值的行号，例如 rows_where('chapter_num', 3)"""
+        if field in self._ints:
+            return np.flatnonzero(np.asarray(self._ints[field]) == value)
+        if value not in self.dictionaries.get(field, []):
+            return np.zeros(0, dtype=np.int64)
+        return np.flatnonzero(np.asarray(self._codes[field]) == self.dictionaries[field].index(value))
+
+
+def load_chunks(path: str) -> List[Dict[str, Any]]:
+    """读取文本块：path 可以是列式存储目录或文本块JSON文件"""
+    if is_chunk_store(path):
+        return list(ChunkStore(path))
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基于偏移量的分块模块
+每个章节只扫描一次，生成有序的句子边界数组；块的结束位置用二分查找在边界数组中确定，
+分块结果只是 (章节, 起点, 终点) 偏移量，指向所有章节共享的一个文本缓冲区，不复制字符串
+"""
+
+import logging
+from bisect import bisect_right
+from typing import List, Dict, Any, Iterable, Iterator, Tuple
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SENTENCE_TERMINATORS = "。！？"
+CLOSING_MARKS = "”’」』）"
+
+
+def _codepoints(text: str) -> np.ndarray:
+    """文本的Unicode码位数组（每个字符一个uint32）"""
+    return np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+
+
+def sentence_boundaries(text: str, terminators: str = SENTENCE_TERMINATORS,
+                        closing_marks: str = CLOSING_MARKS) -> np.ndarray:
+    """
+    计算句子边界（句末标点之后的位置；句末标点后紧跟的引号、括号归入前一句）
+
+    Args:
+        text: 文本
+        terminators: 句末标点
+        closing_marks: 可以跟在句末标点之后的右引号、右括号
+
+    Returns:
+        升序的边界位置数组（int64），位置 b 表示可以在 text[:b] 之后断开
+    """
+    if not text:
+        return np.zeros(0, dtype=np.int64)
+
+    codes = _codepoints(text)
+    is_end = np.isin(codes, _codepoints(terminators))
+    is_close = np.isin(codes, _codepoints(closing_marks))
+
+    # 句末标点或紧跟在句末标点之后的右引号都可以结束一句
+    ends_sentence = is_end.copy()
+    ends_sentence[1:] |= is_close[1:] & ends_sentence[:-1]
+    # 只在连续的结束符号的最后一个之后断开
+    next_continues = np.zeros_like(ends_sentence)
+    next_continues[:-1] = ends_sentence[1:]
+    return np.flatnonzero(ends_sentence & ~next_continues).astype(np.int64) + 1
+
+
+class OffsetChunker:
+    """按句子边界分块，输出偏移量"""
+
+    def __init__(self, chunk_size: int = 400, overlap: int = 80, lookback: int = 100,
+                 min_chars: int = 50, terminators: str = SENTENCE_TERMINATORS,
+                 closing_marks: str = CLOSING_MARKS):
+        """
+        Args:
+            chunk_size: 每个文本块的最大字符数
+            overlap: 相邻文本块的重叠字符数
+            lookback: 在块末尾向前最多回退多少字符寻找句子边界
+            min_chars: 去掉首尾空白后少于该字符数的文本块被丢弃
+            terminators: 句末标点
+            closing_marks: 可以跟在句末标点之后的右引号、右括号
+        """
+        if chunk_size <= 0:
+            raise ValueError("chunk_size必须为正数")
+        if not 0 <= overlap <= chunk_size // 2:
+            # 重叠超过一半时，在句子边界处回退后的块只比上一块前进很少，块数接近字符数
+            raise ValueError("overlap必须在 [0, chunk_size // 2] 范围内")
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.lookback = lookback
+        self.min_chars = min_chars
+        self.terminators = terminators
+        self.closing_marks = closing_marks
+
+    def chunk_text(self, text: str) -> List[Tuple[int, int]]:
+        """
+        把一段文本分块
+
+        Args:
+            text: 章节文本
+
+        Returns:
+            (起点, 终点) 列表，text[起点:终点] 为去掉首尾空白的文本块；
+            相邻块（在去掉空白之前）恰好重叠 overlap 个字符
+        """
+        length = len(text)
+        boundaries = sentence_boundaries(text, self.terminators, self.closing_marks).tolist()
+        spans = []
+
+        start = 0
+        while start < length:
+            end = start + self.chunk_size
+            if end < length:
+                # 在 (下限, end] 内取最靠后的句子边界；下限保证每块至少前进 (chunk_size - overlap) 的一半
+                min_end = start + self.overlap + (self.chunk_size - self.overlap) // 2
+                lower = max(start + self.chunk_size // 2, min_end, end - self.lookback)
+                index = bisect_right(boundaries, end) - 1
+                if index >= 0 and boundaries[index] > lower:
+                    end = boundaries[index]
+            else:
+                end = length
+
+            # 去掉首尾空白只移动偏移量，不生成新字符串
+            chunk_start, chunk_end = start, end
+            while chunk_start < chunk_end and text[chunk_start].isspace():
+                chunk_start += 1
+            while chunk_end > chunk_start and text[chunk_end - 1].isspace():
+                chunk_end -= 1
+            if chunk_end - chunk_start > self.min_chars:
+                spans.append((chunk_start, chunk_end))
+
+            if end >= length:
+                break
+            # 下一块从本块末尾往回 overlap 个字符开始（至少前进一个字符）
+            start = max(end - self.overlap, start + 1)
+
+        return spans
+
+    def chunk_chapters(self, chapters: Iterable[Dict[str, Any]]) -> "ChunkIndex":
+        """
+        对所有章节分块
+
+        Args:
+            chapters: 章节列表，每项包含 content
+
+        Returns:
+            ChunkIndex，文本块为共享缓冲区中的偏移量
+        """
+        chapters = list(chapters)
+        texts = [chapter['content'] for chapter in chapters]
+        chapter_starts = np.zeros(len(texts) + 1, dtype=np.int64)
+        chapter_starts[1:] = np.cumsum([len(text) for text in texts])
+
+        rows = []
+        for chapter_index, text in enumerate(texts):
+            offset = int(chapter_starts[chapter_index])
+            rows.extend((chapter_index, offset + start, offset + end)
+                        for start, end in self.chunk_text(text))
+
+        spans = np.array(rows, dtype=np.int64).reshape(-1, 3)
+        return ChunkIndex("".join(texts), chapter_starts, spans, chapters)
+
+
+class ChunkIndex:
+    """分块结果：共享文本缓冲区 + 每个文本块的 (章节序号, 起点, 终点) 全局偏移量"""
+
+    def __init__(self, buffer: str, chapter_starts: np.ndarray, spans: np.ndarray,
+                 chapters: List[Dict[str, Any]]):
+        """
+        Args:
+            buffer: 所有章节文本按顺序拼接而成的缓冲区
+            chapter_starts: 每个章节在缓冲区中的起点（最后一项为缓冲区长度）
+            spans: (n_chunks, 3) 数组，每行为 章节序号、起点、终点（缓冲区中的全局偏移量）
+            chapters: 章节信息
+        """
+        self.buffer = buffer
+        self.chapter_starts = chapter_starts
+        self.spans = spans
+        self.chapters = chapters
+
+    def __len__(self) -> int:
+        return len(self.spans)
+
+    def text(self, index: int) -> str:
+        """第 index 个文本块的内容（只在读取时切片）"""
+        _, start, end = self.spans[index]
+        return self.buffer[start:end]
+
+    def chapter_offsets(self, index: int) -> Tuple[int, int, int]:
+        """第 index 个文本块的 (章节序号, 章节内起点, 章节内终点)"""
+        chapter_index, start, end = (int(value) for value in self.spans[index])
+        chapter_start = int(self.chapter_starts[chapter_index])
+        return chapter_index, start - chapter_start, end - chapter_start
+
+    def __iter__(self) -> Iterator[Tuple[int, int, int]]:
+        """依次给出每个文本块的 (章节序号, 章节内起点, 章节内终点)"""
+        for index in range(len(self.spans)):
+            yield self.chapter_offsets(index)
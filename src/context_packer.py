@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+上下文组装模块
+把多个查询的检索结果整理成给大模型的上下文：按chunk_id去重，
+按 start_position/end_position 合并同一章节中相邻或重叠的文本块，
+在token预算内优先保留相似度高的文本块，最后按章节顺序输出
+"""
+
+import re
+import logging
+from typing import List, Dict, Any, Optional, Callable, Iterable
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_CJK_PATTERN = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]')
+
+
+def estimate_tokens(text: str) -> int:
+    """估算token数：中文字符和全角标点按每字1个token，其余字符按每4个1个token"""
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def make_token_counter(tokenizer) -> Callable[[str], int]:
+    """
+    由分词器生成token计数函数
+
+    Args:
+        tokenizer: 带encode方法的分词器（如transformers或tiktoken的分词器）
+
+    Returns:
+        text -> token数 的函数
+    """
+    return lambda text: len(tokenizer.encode(text))
+
+
+def collect_hits(results_list: Iterable[Dict[str, Any]], min_similarity: float = 0.3) -> List[Dict[str, Any]]:
+    """
+    合并多个查询的检索结果并按chunk_id去重（保留最高相似度）
+
+    Args:
+        results_list: search_similar / search_many 返回的结果列表
+        min_similarity: 相似度（1 - 距离）下限
+
+    Returns:
+        命中列表，每项包含 chunk_id、document、metadata、similarity
+    """
+    hits: Dict[str, Dict[str, Any]] = {}
+    for results in results_list:
+        for chunk_id, document, metadata, distance in zip(
+            results['ids'][0], results['documents'][0],
+            results['metadatas'][0], results['distances'][0]
+        ):
+            similarity = 1 - distance
+            if similarity <= min_similarity:
+                continue
+            if chunk_id not in hits or similarity > hits[chunk_id]['similarity']:
+                hits[chunk_id] = {
+                    'chunk_id': chunk_id,
+                    'document': document,
+                    'metadata': metadata or {},
+                    'similarity': similarity
+                }
+    return list(hits.values())
+
+
+def _overlap_length(left: str, right: str, expected: int, slack: int = 8) -> int:
+    """在预期重叠长度附近查找left后缀与right前缀的实际重叠长度（文本块首尾可能被strip过）"""
+    limit = min(len(left), len(right))
+    # 从预期长度开始向两侧查找，优先取最接近预期的长度
+    for delta in range(slack + 1):
+        for length in (expected - delta, expected + delta):
+            if 0 < length <= limit and left.endswith(right[:length]):
+                return length
+    return 0
+
+
+def merge_passages(hits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    合并同一章节中相邻或重叠的文本块
+
+    Args:
+        hits: collect_hits 返回的命中列表
+
+    Returns:
+        段落列表，每项包含 chunk_ids、chapter_num、chapter_title、start/end、text、similarity；
+        缺少位置信息的文本块各自成为一个段落
+    """
+    passages = []
+    groups: Dict[Any, List[Dict[str, Any]]] = {}
+    for hit in hits:
+        metadata = hit['metadata']
+        passage = {
+            'chunk_ids': [hit['chunk_id']],
+            'book_id': metadata.get('book_id'),
+            'chapter_num': metadata.get('chapter_num'),
+            'chapter_title': metadata.get('chapter_title', ''),
+            'start': metadata.get('start_position'),
+            'end': metadata.get('end_position'),
+            'text': hit['document'] or '',
+            'similarity': hit['similarity']
+        }
+        if passage['start'] is None or passage['end'] is None:
+            passages.append(passage)
+        else:
+            groups.setdefault((passage['book_id'], passage['chapter_num']), []).append(passage)
+
+    for group in groups.values():
+        group.sort(key=lambda p: p['start'])
+        current = group[0]
+        for passage in group[1:]:
+            if passage['start'] > current['end']:
+                passages.append(current)
+                current = passage
+                continue
+            if passage['end'] > current['end']:
+                overlap = _overlap_length(current['text'], passage['text'],
+                                          current['end'] - passage['start'])
+                current['text'] += passage['text'][overlap:]
+                current['end'] = passage['end']
+            current['chunk_ids'].extend(passage['chunk_ids'])
+            current['similarity'] = max(current['similarity'], passage['similarity'])
+        passages.append(current)
+
+    return passages
+
+
+def _passage_order(passage: Dict[str, Any]):
+    """按书、章节、位置排序"""
+    chapter = passage['chapter_num']
+    return (str(passage['book_id'] or ''),
+            chapter if isinstance(chapter, (int, float)) else float('inf'),
+            passage['start'] if passage['start'] is not None else 0)
+
+
+def pack_passages(hits: List[Dict[str, Any]], token_budget: int = 8000,
+                  count_tokens: Optional[Callable[[str], int]] = None) -> List[Dict[str, Any]]:
+    """
+    在token预算内选择文本块并合并为段落
+
+    Args:
+        hits: collect_hits 返回的命中列表（可以来自多个章节）
+        token_budget: 段落文本的token总预算
+        count_tokens: token计数函数，默认使用 estimate_tokens
+
+    Returns:
+        按章节和位置排序的段落列表
+    """
+    count_tokens = count_tokens or estimate_tokens
+
+    # 先按相似度在预算内挑选文本块，再合并（合并只会去掉重叠部分，不会超出预算）
+    selected, used = [], 0
+    for hit in sorted(hits, key=lambda h: -h['similarity']):
+        tokens = count_tokens(hit['document'] or '')
+        if used + tokens > token_budget:
+            continue
+        selected.append(hit)
+        used += tokens
+
+    if len(selected) < len(hits):
+        logger.info(f"上下文预算 {token_budget} tokens: 保留 {len(selected)}/{len(hits)} 个文本块")
+
+    passages = merge_passages(selected)
+    for passage in passages:
+        passage['tokens'] = count_tokens(passage['text'])
+    return sorted(passages, key=_passage_order)
+
+
+def format_context(passages: List[Dict[str, Any]], with_headers: bool = True) -> str:
+    """
+    把段落拼接为上下文文本
+
+    Args:
+        passages: pack_passages 返回的段落列表
+        with_headers: 是否在每个章节前加章节标题
+
+    Returns:
+        上下文文本
+    """
+    context = ""
+    last_chapter = object()
+    for passage in passages:
+        chapter = (passage['book_id'], passage['chapter_num'])
+        if with_headers and chapter != last_chapter:
+            if context:
+                context += "-"*50 + "\n"
+            context += f"\n=== 第{passage['chapter_num']}章: {passage['chapter_title']} ===\n"
+            last_chapter = chapter
+        context += f"相关内容 (相似度: {passage['similarity']:.3f}): {passage['text']}\n\n"
+    return context
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+向量缓存模块
+按 (模型名称, 规范化文本哈希) 缓存文本向量，避免重复调用BGE模型
+向量存放在内存映射的float32数组中，旁边用键/访问时间两个数组作为索引
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+import unicodedata
+from typing import List, Dict, Any, Tuple
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text: str) -> str:
+    """规范化文本：Unicode NFC + 合并空白字符"""
+    return ' '.join(unicodedata.normalize('NFC', text).split())
+
+
+class EmbeddingCache:
+    """基于内存映射文件的内容寻址向量缓存"""
+
+    def __init__(self, cache_dir: str, model_name: str, dimension: int,
+                 max_entries: int = 200000):
+        """
+        初始化向量缓存
+
+        Args:
+            cache_dir: 缓存根目录（每个模型一个子目录）
+            model_name: 向量模型名称
+            dimension: 向量维度
+            max_entries: 最多缓存的向量条数，超过后按最近最少使用淘汰；修改容量时保留已缓存的向量
+        """
+        self.model_name = model_name
+        self.dimension = dimension
+        model_key = hashlib.sha1(model_name.encode('utf-8')).hexdigest()[:16]
+        self.cache_dir = os.path.join(cache_dir, model_key)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self._meta_path = os.path.join(self.cache_dir, 'meta.json')
+        self._vectors_path = os.path.join(self.cache_dir, 'vectors.npy')
+        self._keys_path = os.path.join(self.cache_dir, 'keys.npy')
+        self._ticks_path = os.path.join(self.cache_dir, 'ticks.npy')
+
+        meta = self._load_meta()
+        if meta and meta['dimension'] == dimension and meta['capacity'] != max_entries:
+            # 只是容量变化：保留已缓存的向量
+            meta = self._resize(meta, max_entries)
+        if meta and meta['dimension'] == dimension:
+            self.capacity = meta['capacity']
+            self.size = meta['size']
+            self._tick = meta['tick']
+            mode = 'r+'
+        else:
+            if meta:
+                logger.info("向量缓存参数已变化，重建缓存")
+            self.capacity = max_entries
+            self.size = 0
+            self._tick = 0
+            mode = 'w+'
+
+        open_memmap = np.lib.format.open_memmap
+        self._vectors = open_memmap(self._vectors_path, mode=mode, dtype=np.float32,
+                                    shape=(self.capacity, dimension) if mode == 'w+' else None)
+        self._keys = open_memmap(self._keys_path, mode=mode, dtype=np.uint64,
+                                 shape=(self.capacity,) if mode == 'w+' else None)
+        self._ticks = open_memmap(self._ticks_path, mode=mode, dtype=np.uint64,
+                                  shape=(self.capacity,) if mode == 'w+' else None)
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._rebuild_index()
+
+        logger.info(f"向量缓存已打开: {self.cache_dir} ({self.size}/{self.capacity})")
+
+    def _load_meta(self) -> Dict[str, Any]:
+        """读取缓存元数据，不存在或不匹配时返回空字典"""
+        if not os.path.exists(self._meta_path):
+            return {}
+        with open(self._meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('model_name') != self.model_name:
+            return {}
+        return meta
+
+    def _resize(self, meta: Dict[str, Any], capacity: int) -> Dict[str, Any]:
+        """
+        把已有条目复制到新容量的文件中，容量变小时保留最近使用的条目
+
+        Args:
+            meta: 当前的缓存元数据
+            capacity: 新容量
+
+        Returns:
+            更新后的元数据
+        """
+        old_vectors = np.load(self._vectors_path, mmap_mode='r')
+        old_keys = np.load(self._keys_path, mmap_mode='r')
+        old_ticks = np.load(self._ticks_path, mmap_mode='r')
+        size = min(meta['size'], len(old_keys))
+        rows = np.arange(size)
+        if size > capacity:
+            # 按访问时间保留最近使用的条目（保持原有的行顺序）
+            ticks = np.asarray(old_ticks[:size])
+            rows = np.sort(np.argsort(-ticks, kind='stable')[:capacity])
+
+        # 先写临时文件，全部写完后再替换
+        open_memmap = np.lib.format.open_memmap
+        columns = ((self._vectors_path, old_vectors, np.float32, (capacity, self.dimension)),
+                   (self._keys_path, old_keys, np.uint64, (capacity,)),
+                   (self._ticks_path, old_ticks, np.uint64, (capacity,)))
+        for path, old, dtype, shape in columns:
+            new = open_memmap(path + '.tmp', mode='w+', dtype=dtype, shape=shape)
+            for start in range(0, len(rows), 65536):
+                block = rows[start:start + 65536]
+                new[start:start + len(block)] = old[block]
+            new.flush()
+            del new
+        del old_vectors, old_keys, old_ticks, columns
+        for path in (self._vectors_path, self._keys_path, self._ticks_path):
+            os.replace(path + '.tmp', path)
+
+        logger.info(f"向量缓存容量从 {meta['capacity']} 调整为 {capacity}，保留 {len(rows)}/{size} 条")
+        meta = dict(meta, capacity=capacity, size=len(rows))
+        with open(self._meta_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        return meta
+
+    def _rebuild_index(self):
+        """重建已排序的键索引，用于二分查找"""
+        keys = np.asarray(self._keys[:self.size])
+        self._order = np.argsort(keys, kind='stable')
+        self._sorted_keys = keys[self._order]
+
+    def _key(self, text: str) -> int:
+        """计算文本的64位内容键"""
+        raw = f"{self.model_name}\0{normalize_text(text)}".encode('utf-8')
+        return int.from_bytes(hashlib.blake2b(raw, digest_size=8).digest(), 'little')
+
+    def _lookup(self, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        查找键对应的槽位
+
+        Returns:
+            (命中掩码, 命中项的槽位)
+        """
+        if self.size == 0:
+            return np.zeros(len(keys), dtype=bool), np.zeros(0, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self._sorted_keys, keys), self.size - 1)
+        found = self._sorted_keys[pos] == keys
+        return found, self._order[pos[found]]
+
+    def get_many(self, texts: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        批量读取缓存向量
+
+        Args:
+            texts: 文本列表
+
+        Returns:
+            (向量数组 (n_texts, dimension)，未命中的行为0; 命中掩码)
+        """
+        keys = np.array([self._key(text) for text in texts], dtype=np.uint64)
+        with self._lock:
+            found, slots = self._lookup(keys)
+
+            embeddings = np.zeros((len(texts), self.dimension), dtype=np.float32)
+            if len(slots):
+                embeddings[found] = self._vectors[slots]
+                self._tick += 1
+                self._ticks[slots] = self._tick
+
+            n_hits = int(found.sum())
+            self.hits += n_hits
+            self.misses += len(texts) - n_hits
+            return embeddings, found
+
+    def put_many(self, texts: List[str], embeddings: np.ndarray):
+        """
+        批量写入向量，缓存已满时淘汰最久未使用的条目
+
+        Args:
+            texts: 文本列表
+            embeddings: 对应的向量数组
+        """
+        keys = np.array([self._key(text) for text in texts], dtype=np.uint64)
+        keys, first = np.unique(keys, return_index=True)
+        embeddings = np.asarray(embeddings, dtype=np.float32)[first]
+
+        with self._lock:
+            # 已存在的键不重复写入
+            found, _ = self._lookup(keys)
+            keys, embeddings = keys[~found], embeddings[~found]
+            if len(keys) > self.capacity:
+                keys, embeddings = keys[:self.capacity], embeddings[:self.capacity]
+            if len(keys) == 0:
+                return
+
+            n_free = self.capacity - self.size
+            n_evict = max(0, len(keys) - n_free)
+            slots = np.arange(self.size, self.size + len(keys) - n_evict)
+            if n_evict:
+                victims = np.argpartition(self._ticks[:self.size], n_evict - 1)[:n_evict]
+                slots = np.concatenate([victims, slots])
+                self.evictions += n_evict
+
+            self._tick += 1
+            self._vectors[slots] = embeddings
+            self._keys[slots] = keys
+            self._ticks[slots] = self._tick
+            self.size += len(keys) - n_evict
+            self._rebuild_index()
+
+    def flush(self):
+        """将内存映射数据和元数据写回磁盘"""
+        with self._lock:
+            self._vectors.flush()
+            self._keys.flush()
+            self._ticks.flush()
+            meta = {
+                'model_name': self.model_name,
+                'dimension': self.dimension,
+                'capacity': self.capacity,
+                'size': self.size,
+                'tick': self._tick
+            }
+            with open(self._meta_path, 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'evictions': self.evictions,
+            'size': self.size,
+            'capacity': self.capacity
+        }
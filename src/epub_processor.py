@@ -10,8 +10,10 @@ from ebooklib import epub
 from bs4 import BeautifulSoup
 import re
 import jieba
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Optional, Iterable, Iterator
 import logging
+from character_extractor import CharacterMatcher, get_default_matcher
+import metrics
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -19,8 +21,14 @@ logger = logging.getLogger(__name__)
 class EPUBProcessor:
     """EPUB文件处理器，专门优化中文小说解析"""
     
-    def __init__(self):
+    def __init__(self, character_aliases: Optional[Dict[str, List[str]]] = None):
+        """
+        Args:
+            character_aliases: 人物词典（标准名 -> 别名列表），为None时使用默认词典
+        """
         self.chapter_pattern = re.compile(r'第[一二三四五六七八九十\d]+[章回节]')
+        self.character_matcher = (CharacterMatcher(character_aliases)
+                                  if character_aliases is not None else get_default_matcher())
         
     def extract_text_and_metadata(self, epub_path: str) -> List[Dict]:
         """
@@ -33,19 +41,38 @@ class EPUBProcessor:
             包含章节信息的字典列表
         """
         try:
-            book = epub.read_epub(epub_path)
-            chapters = []
-            
-            # 获取书籍基本信息
-            book_title = book.get_metadata('DC', 'title')[0][0] if book.get_metadata('DC', 'title') else "未知书名"
-            book_author = book.get_metadata('DC', 'creator')[0][0] if book.get_metadata('DC', 'creator') else "未知作者"
-            
-            logger.info(f"正在处理: {book_title} - {book_author}")
+            chapters = list(self.iter_chapters(epub_path))
+            logger.info(f"成功提取 {len(chapters)} 个章节")
+            return chapters
             
-            chapter_num = 0
+        except Exception as e:
+            logger.error(f"处理EPUB文件时出错: {e}")
+            return []
+    
+    def iter_chapters(self, epub_path: str) -> Iterator[Dict]:
+        """
+        逐个章节地从EPUB文件中提取文本和元数据（流式，不保留已产出的章节）
+        
+        Args:
+            epub_path: EPUB文件路径
             
-            for item in book.get_items():
-                if item.get_type() == ebooklib.ITEM_DOCUMENT:
+        Yields:
+            章节信息字典
+        """
+        with metrics.timer('rag_epub_open_seconds'):
+            book = epub.read_epub(epub_path)
+        
+        # 获取书籍基本信息
+        book_title = book.get_metadata('DC', 'title')[0][0] if book.get_metadata('DC', 'title') else "未知书名"
+        book_author = book.get_metadata('DC', 'creator')[0][0] if book.get_metadata('DC', 'creator') else "未知作者"
+        
+        logger.info(f"正在处理: {book_title} - {book_author}")
+        
+        chapter_num = 0
+        
+        for item in book.get_items():
+            if item.get_type() == ebooklib.ITEM_DOCUMENT:
+                with metrics.timer('rag_epub_parse_seconds'):
                     # 解析HTML内容
                     soup = BeautifulSoup(item.get_content(), 'html.parser')
                     
@@ -56,33 +83,26 @@ class EPUBProcessor:
                     # 提取文本
                     text = soup.get_text()
                     text = self._clean_text(text)
-                    
-                    if len(text.strip()) < 100:  # 跳过太短的内容
-                        continue
-                    
-                    # 检测章节标题
-                    chapter_title = self._extract_chapter_title(text)
-                    if chapter_title:
-                        chapter_num += 1
-                    
-                    chapter_info = {
-                        'chapter_num': chapter_num,
-                        'chapter_title': chapter_title or f"第{chapter_num}部分",
-                        'content': text,
-                        'word_count': len(text),
-                        'file_name': item.get_name(),
-                        'book_title': book_title,
-                        'book_author': book_author
-                    }
-                    
-                    chapters.append(chapter_info)
-            
-            logger.info(f"成功提取 {len(chapters)} 个章节")
-            return chapters
-            
-        except Exception as e:
-            logger.error(f"处理EPUB文件时出错: {e}")
-            return []
+                
+                if len(text.strip()) < 100:  # 跳过太短的内容
+                    continue
+                
+                # 检测章节标题
+                chapter_title = self._extract_chapter_title(text)
+                if chapter_title:
+                    chapter_num += 1
+                metrics.inc('rag_epub_chapters')
+                metrics.inc('rag_epub_chars', len(text))
+                
+                yield {
+                    'chapter_num': chapter_num,
+                    'chapter_title': chapter_title or f"第{chapter_num}部分",
+                    'content': text,
+                    'word_count': len(text),
+                    'file_name': item.get_name(),
+                    'book_title': book_title,
+                    'book_author': book_author
+                }
     
     def _clean_text(self, text: str) -> str:
         """清理文本内容"""
@@ -124,7 +144,24 @@ class EPUBProcessor:
         Returns:
             包含分块和元数据的列表
         """
-        chunks = []
+        chunks = list(self.iter_chunks(chapters, chunk_size=chunk_size, overlap=overlap))
+        logger.info(f"创建了 {len(chunks)} 个文本块")
+        return chunks
+    
+    def iter_chunks(self, chapters: Iterable[Dict], 
+                    chunk_size: int = 400, 
+                    overlap: int = 80) -> Iterator[Dict]:
+        """
+        逐块地将章节内容分块并添加元数据（流式，可直接接在iter_chapters之后）
+        
+        Args:
+            chapters: 章节可迭代对象
+            chunk_size: 分块大小
+            overlap: 重叠字符数
+            
+        Yields:
+            包含分块和元数据的字典
+        """
         chunk_id = 0
         
         for chapter in chapters:
@@ -140,9 +177,10 @@ class EPUBProcessor:
                 # 如果添加当前段落会超过chunk_size，则创建新chunk
                 if len(current_chunk) + len(paragraph) > chunk_size and current_chunk:
                     chunk_id += 1
+                    metrics.inc('rag_chunks_created')
                     
                     # 创建chunk元数据
-                    chunk_metadata = {
+                    yield {
                         'chunk_id': f"chunk_{chunk_id:04d}",
                         'chapter_num': chapter['chapter_num'],
                         'chapter_title': chapter['chapter_title'],
@@ -154,8 +192,6 @@ class EPUBProcessor:
                         'content': current_chunk
                     }
                     
-                    chunks.append(chunk_metadata)
-                    
                     # 处理重叠
                     if overlap > 0:
                         current_chunk = current_chunk[-overlap:] + paragraph
@@ -168,7 +204,8 @@ class EPUBProcessor:
             # 处理最后一个chunk
             if current_chunk.strip():
                 chunk_id += 1
-                chunk_metadata = {
+                metrics.inc('rag_chunks_created')
+                yield {
                     'chunk_id': f"chunk_{chunk_id:04d}",
                     'chapter_num': chapter['chapter_num'],
                     'chapter_title': chapter['chapter_title'],
@@ -179,22 +216,10 @@ class EPUBProcessor:
                     'characters': self._extract_characters(current_chunk),
                     'content': current_chunk.strip()
                 }
-                chunks.append(chunk_metadata)
-        
-        logger.info(f"创建了 {len(chunks)} 个文本块")
-        return chunks
     
     def _extract_characters(self, text: str) -> List[str]:
         """从文本中提取人物名称"""
-        # 简单的人物名称提取（可以根据具体小说优化）
-        common_names = ['祥子', '虎妞', '小福子', '刘四爷', '老马', '小马']
-        found_characters = []
-        
-        for name in common_names:
-            if name in text:
-                found_characters.append(name)
-        
-        return found_characters
+        return self.character_matcher.names(text)
 
 def main():
     """测试函数"""
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+IVF（倒排文件）近似检索模块
+用球面k-means把向量聚成若干粗粒度单元，每个单元的向量连续存放；
+查询只探查与其最相近的nprobe个单元，检索代价随库的增长保持亚线性
+"""
+
+import logging
+from typing import List, Optional, Tuple
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def default_n_lists(size: int) -> int:
+    """按库的大小选择单元数：4 * sqrt(向量数)"""
+    return max(1, int(4 * np.sqrt(size)))
+
+
+def spherical_kmeans(vectors: np.ndarray, n_clusters: int, n_iter: int = 20,
+                     init: Optional[np.ndarray] = None, seed: int = 0) -> np.ndarray:
+    """
+    球面k-means（按内积分配，质心归一化）
+
+    Args:
+        vectors: 归一化向量 (n, dimension)
+        n_clusters: 聚类数
+        n_iter: 迭代次数
+        init: 初始质心，默认从样本中随机选取；少于n_clusters时其余质心从样本中随机补足
+        seed: 随机种子
+
+    Returns:
+        归一化质心 (n_clusters, dimension)
+    """
+    rng = np.random.default_rng(seed)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if init is not None and len(init) <= n_clusters:
+        extra = vectors[rng.choice(len(vectors), n_clusters - len(init), replace=False)]
+        centroids = np.concatenate([np.asarray(init, dtype=np.float32), extra])
+    else:
+        centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+
+    for _ in range(n_iter):
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        counts = np.bincount(assign, minlength=n_clusters)
+
+        # 空单元用随机样本重新初始化
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            sums[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = sums / norms
+
+    return centroids.astype(np.float32)
+
+
+class IVFIndex:
+    """倒排文件索引：质心 + 每个单元连续存放的向量块"""
+
+    def __init__(self, n_lists: int, nprobe: int = 8, rebalance_ratio: float = 0.5,
+                 imbalance_factor: float = 8.0, train_sample_size: int = 100000,
+                 auto_lists: bool = False):
+        """
+        Args:
+            n_lists: 单元（质心）数量
+            nprobe: 每个查询探查的单元数
+            rebalance_ratio: 训练后新增向量超过训练规模的该比例时需要重新聚类
+            imbalance_factor: 最大单元超过平均单元大小的该倍数时需要重新聚类
+            train_sample_size: 训练k-means时最多使用的样本数
+            auto_lists: 为True时每次训练按当前向量数重新计算单元数（default_n_lists），
+                库增长后单元数随之增加，每个单元的长度不会一直变长
+        """
+        self.n_lists = n_lists
+        self.nprobe = nprobe
+        self.rebalance_ratio = rebalance_ratio
+        self.imbalance_factor = imbalance_factor
+        self.train_sample_size = train_sample_size
+        self.auto_lists = auto_lists
+
+        self.centroids: Optional[np.ndarray] = None
+        self.cell_vectors: List[np.ndarray] = []
+        self.cell_rows: List[np.ndarray] = []
+        self.cell_sizes = np.zeros(0, dtype=np.int64)
+        self.trained_size = 0
+        self.inserted_since_train = 0
+
+    def __len__(self) -> int:
+        return int(self.cell_sizes.sum())
+
+    def train(self, vectors: np.ndarray, init: Optional[np.ndarray] = None, seed: int = 0):
+        """
+        训练质心（只训练，不插入向量）
+
+        Args:
+            vectors: 训练向量
+            init: 初始质心（重新平衡时沿用现有质心）
+            seed: 随机种子
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.auto_lists:
+            self.n_lists = default_n_lists(len(vectors))
+        self.n_lists = min(self.n_lists, len(vectors))
+        if len(vectors) > self.train_sample_size:
+            sample = np.random.default_rng(seed).choice(len(vectors), self.train_sample_size, replace=False)
+            vectors = vectors[np.sort(sample)]
+        self.set_centroids(spherical_kmeans(vectors, self.n_lists, init=init, seed=seed))
+
+    def set_centroids(self, centroids: np.ndarray):
+        """使用给定质心（例如从磁盘加载的）并清空所有单元"""
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.n_lists = len(self.centroids)
+        dimension = self.centroids.shape[1]
+        self.cell_vectors = [np.empty((0, dimension), dtype=np.float32) for _ in range(self.n_lists)]
+        self.cell_rows = [np.empty(0, dtype=np.int64) for _ in range(self.n_lists)]
+        self.cell_sizes = np.zeros(self.n_lists, dtype=np.int64)
+        self.trained_size = 0
+        self.inserted_since_train = 0
+
+    def assign(self, vectors: np.ndarray) -> np.ndarray:
+        """返回每个向量最近的单元编号"""
+        return np.argmax(np.asarray(vectors, dtype=np.float32) @ self.centroids.T, axis=1)
+
+    def add(self, rows: np.ndarray, vectors: np.ndarray):
+        """
+        增量插入向量到最近的单元
+
+        Args:
+            rows: 向量在集合中的行号
+            vectors: 向量 (n, dimension)
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        assign = self.assign(vectors)
+        for cell in np.unique(assign):
+            members = assign == cell
+            size = self.cell_sizes[cell]
+            n_new = int(members.sum())
+            block = self.cell_vectors[cell]
+            if size + n_new > len(block):
+                # 容量按倍数扩展，保持单元内向量连续存放
+                grown = np.empty((max(size + n_new, 2 * len(block), 16), block.shape[1]), dtype=np.float32)
+                grown[:size] = block[:size]
+                self.cell_vectors[cell] = block = grown
+                grown_rows = np.empty(len(grown), dtype=np.int64)
+                grown_rows[:size] = self.cell_rows[cell][:size]
+                self.cell_rows[cell] = grown_rows
+            block[size:size + n_new] = vectors[members]
+            self.cell_rows[cell][size:size + n_new] = rows[members]
+            self.cell_sizes[cell] = size + n_new
+
+        if self.trained_size == 0:
+            self.trained_size = len(rows)
+        else:
+            self.inserted_since_train += len(rows)
+
+    def needs_rebalance(self) -> bool:
+        """新增数据过多或单元大小严重失衡时需要重新聚类"""
+        if self.centroids is None or len(self) == 0:
+            return False
+        if self.inserted_since_train > self.rebalance_ratio * max(self.trained_size, 1):
+            return True
+        mean_size = len(self) / self.n_lists
+        return self.cell_sizes.max() > self.imbalance_factor * max(mean_size, 1.0)
+
+    def rebalance(self, seed: int = 0):
+        """以现有质心为初始值重新聚类（auto_lists时单元数随向量数增加），并重新分配全部向量"""
+        rows = np.concatenate([self.cell_rows[c][:self.cell_sizes[c]] for c in range(self.n_lists)])
+        vectors = np.concatenate([self.cell_vectors[c][:self.cell_sizes[c]] for c in range(self.n_lists)])
+        n_lists = self.n_lists
+        self.train(vectors, init=self.centroids, seed=seed)
+        logger.info(f"IVF重新平衡: {len(rows)} 个向量，{n_lists} -> {self.n_lists} 个单元")
+        self.add(rows, vectors)
+
+    def search(self, queries: np.ndarray, n_results: int = 10, nprobe: Optional[int] = None,
+               candidate_mask: Optional[np.ndarray] = None) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+        """
+        近似检索
+
+        Args:
+            queries: 归一化查询向量 (n_queries, dimension)
+            n_results: 返回结果数量
+            nprobe: 探查的单元数，默认使用构造时的设置
+            candidate_mask: 按集合行号索引的布尔数组，只返回为True的行
+
+        Returns:
+            (行号列表, 内积分数列表)，每个查询一项，按分数降序；
+            探查单元中的向量不足n_results时返回的结果会更少
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        nprobe = min(nprobe or self.nprobe, self.n_lists)
+        probes = np.argpartition(-(queries @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+
+        all_rows, all_scores = [], []
+        for query, cells in zip(queries, probes):
+            rows = np.concatenate([self.cell_rows[c][:self.cell_sizes[c]] for c in cells])
+            scores = np.concatenate([self.cell_vectors[c][:self.cell_sizes[c]] @ query for c in cells])
+            if candidate_mask is not None:
+                keep = candidate_mask[rows]
+                rows, scores = rows[keep], scores[keep]
+            k = min(n_results, len(rows))
+            if k == 0:
+                all_rows.append(np.zeros(0, dtype=np.int64))
+                all_scores.append(np.zeros(0, dtype=np.float32))
+                continue
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top], kind='stable')]
+            all_rows.append(rows[top])
+            all_scores.append(scores[top])
+        return all_rows, all_scores
+
+    def recall_at_k(self, queries: np.ndarray, k: int = 10, nprobe: Optional[int] = None) -> float:
+        """
+        相对精确检索的召回率
+
+        Args:
+            queries: 归一化查询向量 (n_queries, dimension)
+            k: top-k
+            nprobe: 探查的单元数
+
+        Returns:
+            recall@k
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        k = min(k, len(self))
+        if k == 0:
+            return 1.0
+        rows = np.concatenate([self.cell_rows[c][:self.cell_sizes[c]] for c in range(self.n_lists)])
+        vectors = np.concatenate([self.cell_vectors[c][:self.cell_sizes[c]] for c in range(self.n_lists)])
+        exact = vectors @ queries.T
+        truth = rows[np.argpartition(-exact, k - 1, axis=0)[:k].T]
+        approx, _ = self.search(queries, n_results=k, nprobe=nprobe)
+        hits = sum(len(np.intersect1d(t, a)) for t, a in zip(truth, approx))
+        return hits / (k * len(queries))
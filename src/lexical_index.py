@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+词法检索模块
+基于jieba分词的倒排索引，倒排表以整数数组（CSR格式）保存，支持BM25打分
+适合人名、地名等精确词语的检索，也可为向量检索提供候选集
+"""
+
+import json
+import logging
+from typing import List, Dict, Optional, Tuple
+import numpy as np
+import jieba
+from character_extractor import get_default_matcher
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_dictionary_ready = False
+
+
+def _ensure_dictionary():
+    """首次分词时把人物名称作为整词加入jieba词典，避免被切开（jieba加载词典较慢，不在导入时进行）"""
+    global _dictionary_ready
+    if not _dictionary_ready:
+        for pattern in get_default_matcher().patterns:
+            jieba.add_word(pattern)
+        _dictionary_ready = True
+
+
+def tokenize(text: str) -> List[str]:
+    """jieba分词，去掉空白和单个标点符号"""
+    _ensure_dictionary()
+    return [
+        token for token in jieba.lcut(text)
+        if token.strip() and not (len(token) == 1 and not token.isalnum())
+    ]
+
+
+class BM25Index:
+    """基于整数倒排表的BM25索引"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        """
+        Args:
+            k1: 词频饱和参数
+            b: 文档长度归一化参数
+        """
+        self.k1 = k1
+        self.b = b
+        self.ids: List[str] = []
+        self.vocab: Dict[str, int] = {}
+        self.indptr = np.zeros(1, dtype=np.int64)       # 词 -> 倒排表区间
+        self.doc_rows = np.zeros(0, dtype=np.int32)     # 倒排表中的文档行号
+        self.term_freqs = np.zeros(0, dtype=np.int32)   # 倒排表中的词频
+        self.doc_lengths = np.zeros(0, dtype=np.int32)
+        self.idf = np.zeros(0, dtype=np.float32)
+        # 构建索引时文档来源（集合）的版本，与集合当前版本不同时索引已过期
+        self.source_version: Optional[str] = None
+
+    @classmethod
+    def build(cls, ids: List[str], texts: List[str], k1: float = 1.5, b: float = 0.75,
+              source_version: Optional[str] = None) -> 'BM25Index':
+        """
+        由文档构建索引
+
+        Args:
+            ids: 文档ID列表
+            texts: 文档文本列表
+            k1: 词频饱和参数
+            b: 文档长度归一化参数
+            source_version: 文档来源的版本（随索引保存，用于判断索引是否过期）
+
+        Returns:
+            BM25索引
+        """
+        index = cls(k1=k1, b=b)
+        index.ids = list(ids)
+        index.source_version = source_version
+
+        term_ids, rows, freqs, lengths = [], [], [], []
+        for row, text in enumerate(texts):
+            tokens = tokenize(text or "")
+            lengths.append(len(tokens))
+            counts: Dict[int, int] = {}
+            for token in tokens:
+                term_id = index.vocab.setdefault(token, len(index.vocab))
+                counts[term_id] = counts.get(term_id, 0) + 1
+            term_ids.extend(counts.keys())
+            rows.extend([row] * len(counts))
+            freqs.extend(counts.values())
+
+        term_ids = np.array(term_ids, dtype=np.int64)
+        order = np.argsort(term_ids, kind='stable')
+        index.doc_rows = np.array(rows, dtype=np.int32)[order]
+        index.term_freqs = np.array(freqs, dtype=np.int32)[order]
+        index.indptr = np.concatenate([
+            [0], np.cumsum(np.bincount(term_ids, minlength=len(index.vocab)))
+        ]).astype(np.int64)
+        index.doc_lengths = np.array(lengths, dtype=np.int32)
+        index._compute_idf()
+
+        logger.info(f"BM25索引构建完成: {len(index.ids)} 个文档，{len(index.vocab)} 个词")
+        return index
+
+    def _compute_idf(self):
+        """计算每个词的IDF"""
+        n_docs = len(self.ids)
+        doc_freqs = np.diff(self.indptr).astype(np.float32)
+        self.idf = np.log(1.0 + (n_docs - doc_freqs + 0.5) / (doc_freqs + 0.5)).astype(np.float32)
+
+    def search(self, query: str, n_results: int = 10,
+               candidate_rows: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        BM25检索
+
+        Args:
+            query: 查询文本
+            n_results: 返回结果数量
+            candidate_rows: 只在这些文档行中检索，默认全部
+
+        Returns:
+            (文档行号数组, BM25分数数组)，按分数降序，只包含分数大于0的文档
+        """
+        n_docs = len(self.ids)
+        if n_docs == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        avg_length = max(float(self.doc_lengths.mean()), 1e-9)
+        scores = np.zeros(n_docs, dtype=np.float32)
+        for token in set(tokenize(query)):
+            term_id = self.vocab.get(token)
+            if term_id is None:
+                continue
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            rows = self.doc_rows[start:end]
+            tf = self.term_freqs[start:end].astype(np.float32)
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[rows] / avg_length)
+            scores[rows] += self.idf[term_id] * tf * (self.k1 + 1) / (tf + norm)
+
+        if candidate_rows is not None:
+            mask = np.zeros(n_docs, dtype=bool)
+            mask[candidate_rows] = True
+            scores[~mask] = 0
+
+        hits = np.flatnonzero(scores > 0)
+        k = min(n_results, len(hits))
+        if k == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        top = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return top, scores[top]
+
+    def save(self, path: str):
+        """保存索引（倒排数组存为 path.npz，ID和词表存为 path.json）"""
+        np.savez(path, indptr=self.indptr, doc_rows=self.doc_rows,
+                 term_freqs=self.term_freqs, doc_lengths=self.doc_lengths)
+        with open(path + '.json', 'w', encoding='utf-8') as f:
+            json.dump({'k1': self.k1, 'b': self.b, 'source_version': self.source_version,
+                       'ids': self.ids, 'vocab': self.vocab}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str) -> 'BM25Index':
+        """加载save保存的索引"""
+        with open(path + '.json', 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        index = cls(k1=meta['k1'], b=meta['b'])
+        index.ids = meta['ids']
+        index.source_version = meta.get('source_version')
+        index.vocab = meta['vocab']
+        arrays = np.load(path + '.npz')
+        index.indptr = arrays['indptr']
+        index.doc_rows = arrays['doc_rows']
+        index.term_freqs = arrays['term_freqs']
+        index.doc_lengths = arrays['doc_lengths']
+        index._compute_idf()
+        return index
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多书并行处理脚本
+用进程池并行解析和分块EPUB文件（每个进程一本书），向量化在独立的线程池中进行，
+解析和向量化两个阶段相互重叠；单本书出错不会中断整个处理过程
+每本书写入各自的分片集合，新增书籍不影响已有分片
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import logging
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import List, Dict, Any, Optional
+from epub_processor import EPUBProcessor
+from vector_processor import VectorProcessor
+from shard_router import ShardRouter
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def book_id_from_path(epub_path: str) -> str:
+    """由文件名生成书籍ID"""
+    return os.path.splitext(os.path.basename(epub_path))[0]
+
+def parse_book(epub_path: str, chunk_size: int = 400, overlap: int = 80) -> Dict[str, Any]:
+    """
+    解析并分块一本书（在子进程中运行）
+
+    Args:
+        epub_path: EPUB文件路径
+        chunk_size: 分块大小
+        overlap: 重叠字符数
+
+    Returns:
+        包含文本块和解析耗时的字典
+    """
+    start_time = time.perf_counter()
+    book_id = book_id_from_path(epub_path)
+
+    processor = EPUBProcessor()
+    chapters = processor.iter_chapters(epub_path)
+    chunks = list(processor.iter_chunks(chapters, chunk_size=chunk_size, overlap=overlap))
+    if not chunks:
+        raise ValueError(f"未从 {epub_path} 提取到任何文本块")
+
+    # 文本块ID在整个书库内唯一
+    for chunk in chunks:
+        chunk['chunk_id'] = f"{book_id}/{chunk['chunk_id']}"
+        chunk['book_id'] = book_id
+
+    return {
+        'epub_path': epub_path,
+        'book_id': book_id,
+        'chunks': chunks,
+        'total_chars': sum(len(chunk['content']) for chunk in chunks),
+        'parse_seconds': time.perf_counter() - start_time
+    }
+
+def ingest_library(epub_paths: List[str], processor: VectorProcessor,
+                   parse_workers: int = None, embed_workers: int = 1,
+                   chunk_size: int = 400, overlap: int = 80,
+                   batch_size: int = 64,
+                   router: Optional[ShardRouter] = None) -> List[Dict[str, Any]]:
+    """
+    并行处理多本书并写入向量索引
+
+    Args:
+        epub_paths: EPUB文件路径列表
+        processor: 已创建集合的向量处理器
+        parse_workers: 解析进程数，默认使用CPU核数
+        embed_workers: 向量化线程数
+        chunk_size: 分块大小
+        overlap: 重叠字符数
+        batch_size: 向量化批处理大小
+        router: 分片路由器，提供时每本书写入其分片，否则写入 processor.collection
+
+    Returns:
+        每本书的处理报告列表
+    """
+    reports = {path: {'book_id': book_id_from_path(path), 'epub_path': path, 'status': 'pending'}
+               for path in epub_paths}
+
+    def embed_book(parsed: Dict[str, Any]) -> Dict[str, Any]:
+        start_time = time.perf_counter()
+        if router is not None:
+            result = router.add_book(parsed['book_id'], parsed['chunks'], batch_size=batch_size)
+        else:
+            result = processor.ingest_stream(parsed['chunks'], batch_size=batch_size)
+        return {'embed_seconds': time.perf_counter() - start_time,
+                'shard_id': result.get('shard_id')}
+
+    with ProcessPoolExecutor(max_workers=parse_workers) as parse_pool, \
+            ThreadPoolExecutor(max_workers=embed_workers) as embed_pool:
+        parse_futures = {
+            parse_pool.submit(parse_book, path, chunk_size, overlap): path
+            for path in epub_paths
+        }
+
+        embed_futures = {}
+        for future in as_completed(parse_futures):
+            path = parse_futures[future]
+            report = reports[path]
+            try:
+                parsed = future.result()
+            except Exception as e:
+                logger.error(f"解析失败 {path}: {e}")
+                report.update({'status': 'failed', 'stage': 'parse', 'error': str(e)})
+                continue
+
+            report.update({
+                'total_chunks': len(parsed['chunks']),
+                'total_chars': parsed['total_chars'],
+                'parse_seconds': parsed['parse_seconds'],
+                'parse_chars_per_sec': parsed['total_chars'] / max(parsed['parse_seconds'], 1e-9)
+            })
+            logger.info(f"解析完成 {report['book_id']}: {report['total_chunks']} 个文本块，"
+                        f"{report['parse_seconds']:.2f}s")
+            embed_futures[embed_pool.submit(embed_book, parsed)] = path
+
+        for future in as_completed(embed_futures):
+            path = embed_futures[future]
+            report = reports[path]
+            try:
+                report.update(future.result())
+            except Exception as e:
+                logger.error(f"向量化失败 {path}: {e}")
+                report.update({'status': 'failed', 'stage': 'embed', 'error': str(e)})
+                continue
+
+            report['status'] = 'ok'
+            report['embed_chunks_per_sec'] = report['total_chunks'] / max(report['embed_seconds'], 1e-9)
+            logger.info(f"向量化完成 {report['book_id']}: {report['embed_seconds']:.2f}s")
+
+    return [reports[path] for path in epub_paths]
+
+def main():
+    """主函数"""
+    library_dir = sys.argv[1] if len(sys.argv) > 1 else "."
+    epub_paths = sorted(glob.glob(os.path.join(library_dir, "*.epub")))
+    if not epub_paths:
+        logger.error(f"目录中没有EPUB文件: {library_dir}")
+        return
+
+    processor = VectorProcessor(embedding_cache_dir="./embedding_cache")
+    router = ShardRouter(processor, books_per_shard=1)
+
+    logger.info(f"开始处理 {len(epub_paths)} 本书...")
+    start_time = time.perf_counter()
+    reports = ingest_library(epub_paths, processor, router=router)
+    elapsed = time.perf_counter() - start_time
+
+    print("\n" + "="*70)
+    print("书库处理完成！")
+    print("="*70)
+    for report in reports:
+        if report['status'] == 'ok':
+            print(f"✅ {report['book_id']} [分片 {report['shard_id']}]: {report['total_chunks']} 块, "
+                  f"解析 {report['parse_chars_per_sec']:.0f} 字/秒, "
+                  f"向量化 {report['embed_chunks_per_sec']:.1f} 块/秒")
+        else:
+            print(f"❌ {report['book_id']}: {report.get('stage')} 阶段失败 - {report.get('error')}")
+
+    succeeded = sum(1 for report in reports if report['status'] == 'ok')
+    print(f"\n成功 {succeeded}/{len(reports)} 本，总耗时 {elapsed:.1f}s")
+
+    report_file = "library_ingest_report.json"
+    with open(report_file, 'w', encoding='utf-8') as f:
+        json.dump(reports, f, ensure_ascii=False, indent=2)
+    print(f"报告已保存到: {report_file}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+大模型响应缓存模块
+以 服务地址 + 模型 + 消息 + temperature + max_tokens 的哈希为键，把回复保存在本地SQLite数据库中，
+支持过期时间、按条数淘汰最久未使用的记录，以及只读回放模式（离线运行时不发起任何请求）
+"""
+
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import List, Dict, Any, Optional, Callable, Awaitable
+import metrics
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CACHE_MODES = ("readwrite", "replay", "off")
+
+
+class CacheMiss(Exception):
+    """回放模式下缓存未命中"""
+
+
+def endpoint_of(create: Callable[..., Any]) -> Optional[str]:
+    """取出 client.chat.completions.create 所属客户端的 base_url（取不到时为None）"""
+    client = getattr(getattr(create, '__self__', None), '_client', None)
+    base_url = getattr(client, 'base_url', None)
+    return str(base_url).rstrip('/') if base_url is not None else None
+
+
+def sampling_params(temperature: Optional[float], max_tokens: Optional[int]) -> Dict[str, Any]:
+    """只转发设置了的采样参数（参数为None时不传，否则请求中会出现null，部分兼容接口不接受）"""
+    params = {'temperature': temperature, 'max_tokens': max_tokens}
+    return {name: value for name, value in params.items() if value is not None}
+
+
+class LLMCache:
+    """基于SQLite的大模型响应缓存"""
+
+    def __init__(self, db_path: str = "./llm_cache.sqlite", ttl_seconds: Optional[float] = 30 * 86400,
+                 max_entries: int = 10000, mode: str = "readwrite"):
+        """
+        打开或创建缓存
+
+        Args:
+            db_path: SQLite数据库路径
+            ttl_seconds: 记录的有效期（秒），为None时永不过期
+            max_entries: 最多保存的记录数，超出时淘汰最久未使用的记录
+            mode: "readwrite" 正常读写；"replay" 只读回放，未命中时抛出CacheMiss；"off" 不使用缓存
+        """
+        if mode not in CACHE_MODES:
+            raise ValueError(f"不支持的缓存模式: {mode}")
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed_at ON responses (accessed_at)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model: str, messages: List[Dict[str, Any]], temperature: Optional[float] = None,
+                 max_tokens: Optional[int] = None, namespace: Optional[str] = None) -> str:
+        """计算请求指纹（namespace区分服务地址，不同服务商的同名模型不共用缓存）"""
+        payload = json.dumps({
+            'namespace': namespace,
+            'model': model,
+            'messages': messages,
+            'temperature': temperature,
+            'max_tokens': max_tokens
+        }, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """读取缓存的回复，不存在或已过期时返回None"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.ttl_seconds is not None and now - row[1] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            return row[0]
+
+    def put(self, key: str, response: str, model: Optional[str] = None):
+        """写入回复，超出容量时淘汰最久未使用的记录"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, model, response, now, now)
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM responses WHERE key IN "
+                    "(SELECT key FROM responses ORDER BY accessed_at LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+            self._conn.commit()
+
+    def purge_expired(self) -> int:
+        """删除所有过期记录，返回删除的条数"""
+        if self.ttl_seconds is None:
+            return 0
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl_seconds,)
+            )
+            self._conn.commit()
+            return cursor.rowcount
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计信息"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {
+            'db_path': self.db_path,
+            'mode': self.mode,
+            'entries': entries,
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
+
+    def _lookup(self, key: str) -> Optional[str]:
+        """按模式查询缓存，回放模式下未命中时抛出CacheMiss"""
+        if self.mode == "off":
+            return None
+        response = self.get(key)
+        metrics.inc('rag_llm_cache_lookups', result='hit' if response is not None else 'miss')
+        if response is None and self.mode == "replay":
+            raise CacheMiss(f"回放模式下缓存未命中: {key[:12]}")
+        return response
+
+    def complete(self, create: Callable[..., Any], model: str, messages: List[Dict[str, Any]],
+                 temperature: Optional[float] = None, max_tokens: Optional[int] = None,
+                 namespace: Optional[str] = None, **kwargs) -> str:
+        """
+        带缓存的对话请求
+
+        Args:
+            create: 发起请求的函数，通常是 client.chat.completions.create
+            model: 模型名称
+            messages: 对话消息
+            temperature: 采样温度，为None时不传（使用服务端默认值）
+            max_tokens: 最大生成长度，为None时不传
+            namespace: 缓存命名空间，默认为客户端的 base_url
+            **kwargs: 其余请求参数（如extra_headers，不参与缓存键）
+
+        Returns:
+            回复文本
+        """
+        key = self.make_key(model, messages, temperature, max_tokens,
+                            namespace if namespace is not None else endpoint_of(create))
+        response = self._lookup(key)
+        if response is not None:
+            return response
+
+        completion = create(model=model, messages=messages,
+                            **sampling_params(temperature, max_tokens), **kwargs)
+        response = completion.choices[0].message.content
+        if self.mode == "readwrite" and response is not None:
+            self.put(key, response, model=model)
+        return response
+
+    async def complete_async(self, create: Callable[..., Awaitable[Any]], model: str,
+                             messages: List[Dict[str, Any]], temperature: Optional[float] = None,
+                             max_tokens: Optional[int] = None, namespace: Optional[str] = None,
+                             **kwargs) -> str:
+        """complete 的异步版本，create 为异步客户端的 client.chat.completions.create"""
+        key = self.make_key(model, messages, temperature, max_tokens,
+                            namespace if namespace is not None else endpoint_of(create))
+        response = self._lookup(key)
+        if response is not None:
+            return response
+
+        completion = await create(model=model, messages=messages,
+                                  **sampling_params(temperature, max_tokens), **kwargs)
+        response = completion.choices[0].message.content
+        if self.mode == "readwrite" and response is not None:
+            self.put(key, response, model=model)
+        return response
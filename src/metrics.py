@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+运行指标模块
+提供计时器（上下文管理器/装饰器）、计数器和直方图，按名称 + 标签汇总；
+可以输出为Prometheus文本格式，或结构化的JSON运行报告。
+默认关闭：关闭时计时器返回共享的空上下文，计数和记录直接返回，几乎没有开销
+
+用法:
+    import metrics
+    metrics.enable()
+    with metrics.timer('rag_index_query_seconds', backend='numpy'):
+        ...
+    metrics.inc('rag_queries', 8)
+    metrics.get_registry().write_prometheus('metrics.prom')
+"""
+
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+import functools
+from collections import deque
+from contextlib import nullcontext
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 直方图默认分桶（秒），覆盖从毫秒级的检索到数十秒的大模型调用
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_NULL_CONTEXT = nullcontext()
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Histogram:
+    """分桶直方图，另保留最近的若干个样本用于计算分位数"""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS, sample_size: int = 10000):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = float('inf')
+        self.max = float('-inf')
+        self.samples = deque(maxlen=sample_size)
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self.samples.append(value)
+
+    def summary(self) -> Dict[str, Any]:
+        """数量、总和、均值和 p50/p95/p99"""
+        samples = np.array(self.samples, dtype=np.float64)
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'mean': round(self.sum / self.count, 6) if self.count else None,
+            'min': round(self.min, 6) if self.count else None,
+            'max': round(self.max, 6) if self.count else None,
+            'p50': round(float(np.percentile(samples, 50)), 6) if len(samples) else None,
+            'p95': round(float(np.percentile(samples, 95)), 6) if len(samples) else None,
+            'p99': round(float(np.percentile(samples, 99)), 6) if len(samples) else None
+        }
+
+
+class _Timer:
+    """计时上下文：退出时把耗时记入直方图"""
+
+    __slots__ = ('registry', 'name', 'labels', 'start', 'elapsed')
+
+    def __init__(self, registry: 'MetricsRegistry', name: str, labels: Dict[str, Any]):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.elapsed = time.perf_counter() - self.start
+        labels = dict(self.labels, status='error') if exc_type is not None else self.labels
+        self.registry.observe(self.name, self.elapsed, **labels)
+        return False
+
+
+class MetricsRegistry:
+    """按 名称 + 标签 汇总的计数器和直方图"""
+
+    def __init__(self, enabled: bool = False):
+        """
+        Args:
+            enabled: 是否记录指标；关闭时所有记录操作直接返回
+        """
+        self.enabled = enabled
+        self.started_at = datetime.now().isoformat()
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """计数器加 value"""
+        if not self.enabled:
+            return
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        """在直方图中记录一个值（计时器记录的是秒）"""
+        if not self.enabled:
+            return
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(value)
+
+    def timer(self, name: str, **labels):
+        """计时上下文管理器，耗时记入名为 name 的直方图（出错时附加 status="error" 标签）"""
+        if not self.enabled:
+            return _NULL_CONTEXT
+        return _Timer(self, name, labels)
+
+    def reset(self):
+        """清空所有指标"""
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+        self.started_at = datetime.now().isoformat()
+
+    def to_prometheus(self) -> str:
+        """Prometheus文本格式（计数器加 _total 后缀，直方图输出 _bucket/_sum/_count）"""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# TYPE {name}_total counter")
+                for key, value in sorted(series.items()):
+                    lines.append(f"{name}_total{_format_labels(key)} {value:g}")
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(key, ('le', f'{bound:g}'))} {cumulative}")
+                    lines.append(f"{name}_bucket{_format_labels(key, ('le', '+Inf'))} {histogram.count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {histogram.sum:.6f}")
+                    lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def report(self, extra: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """结构化运行报告：计数器和每个直方图的汇总，按耗时总和从大到小排列"""
+        with self._lock:
+            counters = [
+                {'name': name, 'labels': dict(key), 'value': value}
+                for name, series in sorted(self._counters.items())
+                for key, value in sorted(series.items())
+            ]
+            histograms = [
+                {'name': name, 'labels': dict(key), **histogram.summary()}
+                for name, series in self._histograms.items()
+                for key, histogram in series.items()
+            ]
+        histograms.sort(key=lambda item: -item['sum'])
+        report = {
+            'started_at': self.started_at,
+            'finished_at': datetime.now().isoformat(),
+            'counters': counters,
+            'histograms': histograms
+        }
+        if extra:
+            report.update(extra)
+        return report
+
+    def write_prometheus(self, path: str):
+        """写出Prometheus文本文件（先写临时文件再替换，采集方不会读到半个文件）"""
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+    def write_report(self, path: str, extra: Optional[Dict[str, Any]] = None):
+        """写出JSON运行报告"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(extra), f, ensure_ascii=False, indent=2)
+
+
+_registry = MetricsRegistry(enabled=os.getenv('METRICS_ENABLED', '0').lower() in ('1', 'true', 'yes'))
+
+
+def get_registry() -> MetricsRegistry:
+    """全局指标注册表"""
+    return _registry
+
+
+def enable(enabled: bool = True):
+    """开启（或关闭）全局指标记录"""
+    _registry.enabled = enabled
+
+
+def is_enabled() -> bool:
+    return _registry.enabled
+
+
+def inc(name: str, value: float = 1, **labels):
+    """全局计数器加 value"""
+    if _registry.enabled:
+        _registry.inc(name, value, **labels)
+
+
+def observe(name: str, value: float, **labels):
+    """在全局直方图中记录一个值"""
+    if _registry.enabled:
+        _registry.observe(name, value, **labels)
+
+
+def timer(name: str, **labels):
+    """全局计时上下文管理器"""
+    if not _registry.enabled:
+        return _NULL_CONTEXT
+    return _Timer(_registry, name, labels)
+
+
+def timed(name: str, **labels):
+    """
+    计时装饰器：每次调用的耗时记入名为 name 的直方图
+
+    Args:
+        name: 直方图名称
+        **labels: 固定标签
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _registry.enabled:
+                return func(*args, **kwargs)
+            with _Timer(_registry, name, labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def write_outputs(extra: Optional[Dict[str, Any]] = None) -> List[str]:
+    """
+    按环境变量写出指标：METRICS_PROM_PATH（默认 ./metrics.prom）和 METRICS_REPORT_PATH
+    （默认 ./metrics_report.json）；未开启指标时不写任何文件
+
+    Returns:
+        写出的文件路径列表
+    """
+    if not _registry.enabled:
+        return []
+    prom_path = os.getenv('METRICS_PROM_PATH', './metrics.prom')
+    report_path = os.getenv('METRICS_REPORT_PATH', './metrics_report.json')
+    _registry.write_prometheus(prom_path)
+    _registry.write_report(report_path, extra)
+    logger.info(f"运行指标已写入: {prom_path}, {report_path}")
+    return [prom_path, report_path]
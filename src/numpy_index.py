@@ -0,0 +1,657 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+NumPy精确向量索引模块
+向量以内存映射的float32 .npy文件保存，id/文档/元数据按行对齐保存
+接口与Chroma的Client/Collection保持一致，可作为VectorProcessor的另一种索引后端
+"""
+
+import os
+import json
+import shutil
+import uuid
+import logging
+import functools
+import threading
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+from quantization import QuantizedIndex, QUANTIZATION_MODES
+from ivf_index import IVFIndex, default_n_lists
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ANN_INDEX_TYPES = ("ivf",)
+# 向量数少于该值时精确检索已经足够快，不使用IVF
+IVF_MIN_SIZE = 4096
+
+
+def file_stamp(path: str) -> Optional[Tuple[int, int, int]]:
+    """文件状态 (inode, 修改时间, 大小)，文件被替换或改写后会变化；文件不存在时为None"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def _synchronized(method):
+    """在集合锁内执行：写入扩容时会替换向量文件的内存映射，检索和读取不能与写入同时进行"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class NumpyCollection:
+    """基于NumPy矩阵乘法 + argpartition 的精确检索集合"""
+
+    def __init__(self, path: str, name: str, metadata: Optional[Dict[str, Any]] = None,
+                 quantization: Optional[str] = None, ann_index: Optional[str] = None,
+                 nprobe: int = 8, ivf_lists: Optional[int] = None):
+        """
+        打开或创建集合
+
+        Args:
+            path: 集合目录
+            name: 集合名称
+            metadata: 集合元数据
+            quantization: 检索时使用的量化编码，"int8"、"binary" 或 None（float32精确检索）
+            ann_index: 近似检索结构，"ivf" 或 None（精确检索）
+            nprobe: IVF每个查询探查的单元数
+            ivf_lists: IVF单元数，默认按 4 * sqrt(向量数) 取值
+        """
+        if quantization is not None and quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"不支持的量化方式: {quantization}")
+        if ann_index is not None and ann_index not in ANN_INDEX_TYPES:
+            raise ValueError(f"不支持的近似索引: {ann_index}")
+        if ann_index is not None and quantization is not None:
+            raise ValueError("IVF索引与量化检索不能同时启用")
+        self.path = path
+        self.name = name
+        self.quantization = quantization
+        self.ann_index = ann_index
+        self.nprobe = nprobe
+        self.ivf_lists = ivf_lists
+        os.makedirs(path, exist_ok=True)
+
+        self._meta_path = os.path.join(path, 'meta.json')
+        self._vectors_path = os.path.join(path, 'vectors.npy')
+        self._records_path = os.path.join(path, 'records.jsonl')
+        self._centroids_path = os.path.join(path, 'ivf_centroids.npy')
+
+        self.metadata = metadata or {}
+        self._lock = threading.RLock()
+        # 集合标识和版本：每次写入或删除版本加一并写入meta.json，重建集合后标识改变
+        # （供检索结果缓存判断是否过期）
+        self.uid = uuid.uuid4().hex
+        self.version = 0
+        # 最近一次读取或写入meta.json时的文件状态，其他进程写入后会变化
+        self._meta_stamp = None
+        self._reset_state()
+
+        if os.path.exists(self._meta_path):
+            self._load()
+        else:
+            self._save_meta()
+
+    def _reset_state(self):
+        """清空内存中的数据（重新加载之前调用）"""
+        self.dimension = None
+        self._size = 0
+        self._vectors = None
+        self._ids: List[str] = []
+        self._documents: List[Optional[str]] = []
+        self._metadatas: List[Optional[Dict[str, Any]]] = []
+        self._id_to_row: Dict[str, int] = {}
+        # 元数据倒排表（按需构建，写入后失效）
+        self._postings: Optional[Dict[str, Dict[Any, np.ndarray]]] = None
+        # 量化编码（按需构建，写入后失效；float向量留在磁盘上，只在重排时读取）
+        self._quantized: Optional[QuantizedIndex] = None
+        # IVF索引（按需构建；新增行增量插入，更新或删除后重建）
+        self._ivf: Optional[IVFIndex] = None
+        # 已保存的IVF质心训练时的向量数（重新打开集合时据此判断库是否已明显增长）
+        self._ivf_trained_size = 0
+
+    def _load(self):
+        """从磁盘加载集合"""
+        self._meta_stamp = file_stamp(self._meta_path)
+        with open(self._meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.metadata = meta.get('metadata', self.metadata)
+        self.dimension = meta.get('dimension')
+        self._size = meta.get('size', 0)
+        self.uid = meta.get('uid', self.uid)
+        self.version = meta.get('version', 0)
+        self._ivf_trained_size = meta.get('ivf_trained_size', 0)
+
+        if self.dimension is not None:
+            self._vectors = np.load(self._vectors_path, mmap_mode='r+')
+
+        if os.path.exists(self._records_path):
+            with open(self._records_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    record = json.loads(line)
+                    self._ids.append(record['id'])
+                    self._documents.append(record.get('document'))
+                    self._metadatas.append(record.get('metadata'))
+        # 只保留与向量文件对齐的部分（防止写入中断导致不一致）
+        del self._ids[self._size:], self._documents[self._size:], self._metadatas[self._size:]
+        self._id_to_row = {chunk_id: row for row, chunk_id in enumerate(self._ids)}
+
+    def _save_meta(self):
+        """写入集合元数据"""
+        meta = {
+            'name': self.name,
+            'metadata': self.metadata,
+            'dimension': self.dimension,
+            'size': self._size,
+            'uid': self.uid,
+            'version': self.version,
+            'ivf_trained_size': self._ivf_trained_size
+        }
+        # 先写临时文件再替换，其他进程不会读到半个文件
+        tmp_path = self._meta_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, self._meta_path)
+        self._meta_stamp = file_stamp(self._meta_path)
+
+    @_synchronized
+    def refresh(self) -> bool:
+        """
+        其他进程写入了同一目录时重新加载集合（只比较meta.json的文件状态，未变化时不读取文件）
+
+        Returns:
+            是否重新加载
+        """
+        stamp = file_stamp(self._meta_path)
+        if stamp is None or stamp == self._meta_stamp:
+            return False
+        logger.info(f"{self.name}: 集合已被其他进程更新，重新加载")
+        self._reset_state()
+        self._load()
+        return True
+
+    def _record_line(self, row: int) -> str:
+        """序列化一行记录"""
+        return json.dumps({
+            'id': self._ids[row],
+            'document': self._documents[row],
+            'metadata': self._metadatas[row]
+        }, ensure_ascii=False) + '\n'
+
+    def _rewrite_records(self):
+        """重写全部行记录（更新或删除后调用）"""
+        tmp_path = self._records_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for row in range(self._size):
+                f.write(self._record_line(row))
+        os.replace(tmp_path, self._records_path)
+
+    def _append_records(self, start: int):
+        """追加从start开始的行记录"""
+        with open(self._records_path, 'a', encoding='utf-8') as f:
+            for row in range(start, self._size):
+                f.write(self._record_line(row))
+
+    def _reserve(self, n_rows: int, dimension: int):
+        """确保向量文件至少能容纳n_rows行，容量不足时按倍数扩展"""
+        if self.dimension is None:
+            self.dimension = dimension
+        elif dimension != self.dimension:
+            raise ValueError(f"向量维度不匹配: 期望 {self.dimension}，实际 {dimension}")
+
+        capacity = 0 if self._vectors is None else self._vectors.shape[0]
+        if n_rows <= capacity:
+            return
+
+        new_capacity = max(n_rows, capacity * 2, 1024)
+        tmp_path = self._vectors_path + '.tmp'
+        grown = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32,
+                                          shape=(new_capacity, self.dimension))
+        if self._size:
+            grown[:self._size] = self._vectors[:self._size]
+        grown.flush()
+        del grown
+        self._vectors = None
+        os.replace(tmp_path, self._vectors_path)
+        self._vectors = np.load(self._vectors_path, mmap_mode='r+')
+
+    def _flush(self):
+        """将向量和元数据写回磁盘"""
+        self._postings = None
+        self._quantized = None
+        if self._vectors is not None:
+            self._vectors.flush()
+        self._save_meta()
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """有效行的向量矩阵 (count, dimension)"""
+        if self._vectors is None:
+            return np.zeros((0, self.dimension or 0), dtype=np.float32)
+        return self._vectors[:self._size]
+
+    @property
+    def quantized(self) -> Optional[QuantizedIndex]:
+        """量化检索结构，未启用量化时为None"""
+        if self.quantization is None or self._size == 0:
+            return None
+        if self._quantized is None:
+            self._quantized = QuantizedIndex(self.vectors, mode=self.quantization)
+            logger.info(f"{self.name}: 已构建{self.quantization}量化编码，"
+                        f"每个向量 {self._quantized.bytes_per_vector():.0f} 字节 "
+                        f"(压缩 {self._quantized.compression_ratio():.1f}x)")
+        return self._quantized
+
+    @property
+    def ivf(self) -> Optional[IVFIndex]:
+        """IVF索引，未启用或向量数过少时为None"""
+        if self.ann_index != "ivf" or self._size < IVF_MIN_SIZE:
+            return None
+        if self._ivf is None:
+            n_lists = self.ivf_lists or default_n_lists(self._size)
+            self._ivf = IVFIndex(n_lists, nprobe=self.nprobe, auto_lists=self.ivf_lists is None)
+            if os.path.exists(self._centroids_path):
+                # 沿用已保存的质心，只需一次分配，不必重新聚类
+                centroids = np.load(self._centroids_path)
+                self._ivf.set_centroids(centroids)
+                self._ivf.add(np.arange(self._size), self.vectors)
+                # 训练之后新增的向量计入增长量：库明显变大时重新聚类（并重新计算单元数）
+                trained_size = self._ivf_trained_size or (len(centroids) // 4) ** 2
+                self._ivf.trained_size = min(trained_size, self._size)
+                self._ivf.inserted_since_train = self._size - self._ivf.trained_size
+            else:
+                self._ivf.train(self.vectors)
+                self._ivf.add(np.arange(self._size), self.vectors)
+                self._save_centroids()
+            if self._ivf.needs_rebalance():
+                self._ivf.rebalance()
+                self._save_centroids()
+            logger.info(f"{self.name}: 已构建IVF索引，{self._ivf.n_lists} 个单元，nprobe={self.nprobe}")
+        return self._ivf
+
+    def rebalance_ivf(self):
+        """重新聚类IVF单元并保存质心"""
+        if self.ivf is None:
+            return
+        self._ivf.rebalance()
+        self._save_centroids()
+
+    def _save_centroids(self):
+        """保存IVF质心及其训练时的向量数"""
+        np.save(self._centroids_path, self._ivf.centroids)
+        self._ivf_trained_size = self._ivf.trained_size
+        self._save_meta()
+
+    def _update_ivf(self, start: int, updated: bool):
+        """写入后维护IVF：新增行插入已有单元，数据分布变化较大时重新平衡"""
+        if self._ivf is None:
+            return
+        if updated:
+            self._ivf = None
+            return
+        self._ivf.add(np.arange(start, self._size), self.vectors[start:])
+        if self._ivf.needs_rebalance():
+            self.rebalance_ivf()
+
+    def count(self) -> int:
+        """集合中的向量数量"""
+        self.refresh()
+        return self._size
+
+    @_synchronized
+    def add(self, ids: List[str], embeddings, metadatas: Optional[List[Dict]] = None,
+            documents: Optional[List[str]] = None):
+        """添加向量，已存在的ID会被跳过（与Chroma行为一致）"""
+        self.refresh()
+        duplicated = [chunk_id for chunk_id in ids if chunk_id in self._id_to_row]
+        if duplicated:
+            logger.warning(f"跳过 {len(duplicated)} 个已存在的ID，例如: {duplicated[0]}")
+            keep = [i for i, chunk_id in enumerate(ids) if chunk_id not in self._id_to_row]
+            ids = [ids[i] for i in keep]
+            embeddings = np.asarray(embeddings, dtype=np.float32)[keep]
+            metadatas = [metadatas[i] for i in keep] if metadatas is not None else None
+            documents = [documents[i] for i in keep] if documents is not None else None
+        self.upsert(ids, embeddings, metadatas, documents)
+
+    @_synchronized
+    def upsert(self, ids: List[str], embeddings, metadatas: Optional[List[Dict]] = None,
+               documents: Optional[List[str]] = None):
+        """插入或更新向量"""
+        if not ids:
+            return
+        self.refresh()
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        metadatas = metadatas if metadatas is not None else [None] * len(ids)
+        documents = documents if documents is not None else [None] * len(ids)
+
+        new_rows = [i for i, chunk_id in enumerate(ids) if chunk_id not in self._id_to_row]
+        self._reserve(self._size + len(new_rows), embeddings.shape[1])
+
+        start = self._size
+        updated = False
+        for i, chunk_id in enumerate(ids):
+            row = self._id_to_row.get(chunk_id)
+            if row is None:
+                row = self._size
+                self._size += 1
+                self._id_to_row[chunk_id] = row
+                self._ids.append(chunk_id)
+                self._documents.append(documents[i])
+                self._metadatas.append(metadatas[i])
+            else:
+                updated = True
+                self._documents[row] = documents[i]
+                self._metadatas[row] = metadatas[i]
+            self._vectors[row] = embeddings[i]
+
+        if updated:
+            self._rewrite_records()
+        else:
+            self._append_records(start)
+        self.version += 1
+        self._flush()
+        self._update_ivf(start, updated)
+
+    @_synchronized
+    def update(self, ids: List[str], embeddings=None, metadatas: Optional[List[Dict]] = None,
+               documents: Optional[List[str]] = None):
+        """更新已存在的记录（不存在的ID被忽略，与Chroma行为一致）；不传embeddings时只更新元数据/文档"""
+        self.refresh()
+        rows = [(i, self._id_to_row[chunk_id]) for i, chunk_id in enumerate(ids)
+                if chunk_id in self._id_to_row]
+        if not rows:
+            return
+        if embeddings is not None:
+            embeddings = np.asarray(embeddings, dtype=np.float32)
+        for i, row in rows:
+            if metadatas is not None:
+                self._metadatas[row] = metadatas[i]
+            if documents is not None:
+                self._documents[row] = documents[i]
+            if embeddings is not None:
+                self._vectors[row] = embeddings[i]
+        self._rewrite_records()
+        self.version += 1
+        self._flush()
+        if embeddings is not None:
+            self._ivf = None
+
+    @_synchronized
+    def delete(self, ids: List[str]):
+        """删除向量并压缩存储"""
+        self.refresh()
+        rows = {self._id_to_row[chunk_id] for chunk_id in ids if chunk_id in self._id_to_row}
+        if not rows:
+            return
+        keep = np.array([row for row in range(self._size) if row not in rows], dtype=np.int64)
+        if len(keep):
+            self._vectors[:len(keep)] = self._vectors[keep]
+        self._ids = [self._ids[row] for row in keep]
+        self._documents = [self._documents[row] for row in keep]
+        self._metadatas = [self._metadatas[row] for row in keep]
+        self._size = len(keep)
+        self._id_to_row = {chunk_id: row for row, chunk_id in enumerate(self._ids)}
+        self._rewrite_records()
+        self.version += 1
+        self._flush()
+        self._ivf = None
+
+    def _rows_result(self, rows, include: List[str]) -> Dict[str, Any]:
+        """按行号组装结果"""
+        rows = list(rows)
+        return {
+            'ids': [self._ids[row] for row in rows],
+            'documents': [self._documents[row] for row in rows] if 'documents' in include else None,
+            'metadatas': [self._metadatas[row] for row in rows] if 'metadatas' in include else None,
+            'embeddings': [np.array(self.vectors[row]) for row in rows] if 'embeddings' in include else None
+        }
+
+    @_synchronized
+    def get(self, ids: Optional[List[str]] = None, limit: Optional[int] = None,
+            include: Optional[List[str]] = None) -> Dict[str, Any]:
+        """按ID获取记录，ids为None时返回全部"""
+        self.refresh()
+        include = include if include is not None else ['metadatas', 'documents']
+        if ids is None:
+            rows = range(self._size if limit is None else min(limit, self._size))
+        else:
+            rows = [self._id_to_row[chunk_id] for chunk_id in ids if chunk_id in self._id_to_row]
+        return self._rows_result(rows, include)
+
+    def peek(self, limit: int = 10) -> Dict[str, Any]:
+        """查看前limit条记录"""
+        return self.get(limit=limit, include=['embeddings', 'metadatas', 'documents'])
+
+    def _build_postings(self) -> Dict[str, Dict[Any, np.ndarray]]:
+        """构建 chapter_num -> 行号、人物 -> 行号 的倒排表"""
+        chapter_rows: Dict[Any, List[int]] = {}
+        character_rows: Dict[str, List[int]] = {}
+        for row, metadata in enumerate(self._metadatas):
+            metadata = metadata or {}
+            if 'chapter_num' in metadata:
+                chapter_rows.setdefault(metadata['chapter_num'], []).append(row)
+            characters = metadata.get('characters') or []
+            if isinstance(characters, str):
+                characters = [name for name in characters.split(',') if name]
+            for name in characters:
+                character_rows.setdefault(name, []).append(row)
+        return {
+            'chapter_num': {key: np.array(rows, dtype=np.int64) for key, rows in chapter_rows.items()},
+            'characters': {key: np.array(rows, dtype=np.int64) for key, rows in character_rows.items()}
+        }
+
+    @property
+    def postings(self) -> Dict[str, Dict[Any, np.ndarray]]:
+        """元数据倒排表"""
+        if self._postings is None:
+            self._postings = self._build_postings()
+        return self._postings
+
+    @staticmethod
+    def _match_value(value, condition) -> bool:
+        """判断单个元数据值是否满足Chroma风格的条件"""
+        if not isinstance(condition, dict):
+            return value == condition
+        for op, operand in condition.items():
+            if value is None and op not in ('$eq', '$ne'):
+                return False
+            if op == '$eq' and not value == operand:
+                return False
+            if op == '$ne' and not value != operand:
+                return False
+            if op == '$gt' and not value > operand:
+                return False
+            if op == '$gte' and not value >= operand:
+                return False
+            if op == '$lt' and not value < operand:
+                return False
+            if op == '$lte' and not value <= operand:
+                return False
+            if op == '$in' and value not in operand:
+                return False
+            if op == '$nin' and value in operand:
+                return False
+            if op == '$contains' and operand not in value:
+                return False
+        return True
+
+    def _filter_where(self, where: Dict[str, Any]) -> np.ndarray:
+        """按元数据条件筛选行号（chapter_num和人物$contains走倒排表，其余字段逐行比较）"""
+        if '$and' in where:
+            rows = np.arange(self._size)
+            for clause in where['$and']:
+                rows = np.intersect1d(rows, self._filter_where(clause), assume_unique=True)
+            return rows
+        if '$or' in where:
+            parts = [self._filter_where(clause) for clause in where['$or']]
+            return np.unique(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.int64)
+
+        rows = np.arange(self._size)
+        for field, condition in where.items():
+            if field == 'chapter_num':
+                matched = [
+                    chapter_rows for chapter, chapter_rows in self.postings['chapter_num'].items()
+                    if self._match_value(chapter, condition)
+                ]
+                field_rows = np.sort(np.concatenate(matched)) if matched else np.zeros(0, dtype=np.int64)
+            elif field == 'characters' and isinstance(condition, dict) and list(condition) == ['$contains']:
+                field_rows = self.postings['characters'].get(condition['$contains'],
+                                                             np.zeros(0, dtype=np.int64))
+            else:
+                field_rows = np.array([
+                    row for row in range(self._size)
+                    if self._match_value((self._metadatas[row] or {}).get(field), condition)
+                ], dtype=np.int64)
+            rows = np.intersect1d(rows, field_rows, assume_unique=True)
+        return rows
+
+    def _filter_document(self, where_document: Dict[str, Any]) -> np.ndarray:
+        """按文档内容筛选行号（逐行子串匹配，与Chroma的where_document一致；人物倒排表只用于where条件）"""
+        if '$and' in where_document:
+            rows = np.arange(self._size)
+            for clause in where_document['$and']:
+                rows = np.intersect1d(rows, self._filter_document(clause), assume_unique=True)
+            return rows
+        if '$or' in where_document:
+            parts = [self._filter_document(clause) for clause in where_document['$or']]
+            return np.unique(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.int64)
+
+        term = where_document['$contains']
+        return np.array([
+            row for row, document in enumerate(self._documents)
+            if document and term in document
+        ], dtype=np.int64)
+
+    def filter_rows(self, where: Optional[Dict[str, Any]] = None,
+                    where_document: Optional[Dict[str, Any]] = None) -> Optional[np.ndarray]:
+        """
+        计算满足过滤条件的候选行号
+
+        Returns:
+            升序行号数组；没有任何过滤条件时返回None（表示全部行）
+        """
+        if not where and not where_document:
+            return None
+        rows = np.arange(self._size)
+        if where:
+            rows = np.intersect1d(rows, self._filter_where(where), assume_unique=True)
+        if where_document:
+            rows = np.intersect1d(rows, self._filter_document(where_document), assume_unique=True)
+        return rows
+
+    def _exact_search(self, queries: np.ndarray, k: int,
+                      candidates: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        """对全部行（或候选行）精确打分，返回按分数降序的top-k行号和内积分数"""
+        vectors = self.vectors if candidates is None else self.vectors[candidates]
+        scores = queries @ vectors.T
+        top_rows = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top_rows, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+        top_rows = np.take_along_axis(top_rows, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        if candidates is not None:
+            top_rows = candidates[top_rows]
+        return top_rows, top_scores
+
+    @_synchronized
+    def query(self, query_embeddings, n_results: int = 10,
+              where: Optional[Dict[str, Any]] = None,
+              where_document: Optional[Dict[str, Any]] = None,
+              include: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        精确检索（过滤条件在打分之前生效，只对候选行打分）
+
+        Args:
+            query_embeddings: 查询向量 (n_queries, dimension)，应已归一化
+            n_results: 每个查询返回的结果数量
+            where: Chroma风格的元数据过滤条件
+            where_document: Chroma风格的文档内容过滤条件（$contains）
+            include: 返回字段
+
+        Returns:
+            与Chroma相同格式的结果，distances为平方L2距离（与Chroma默认的l2空间一致）；
+            启用量化时先在量化编码上粗筛，再对候选用float向量精确重排；
+            启用IVF时只对最近的nprobe个单元打分，过滤后结果不足的查询退回精确检索
+        """
+        self.refresh()
+        include = include if include is not None else ['metadatas', 'documents', 'distances']
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        candidates = self.filter_rows(where, where_document)
+        n_candidates = self._size if candidates is None else len(candidates)
+        k = min(n_results, n_candidates)
+
+        results = {'ids': [], 'documents': [], 'metadatas': [], 'distances': [], 'embeddings': []}
+        if k == 0:
+            top_rows = np.zeros((len(queries), 0), dtype=np.int64)
+            top_scores = np.zeros((len(queries), 0), dtype=np.float32)
+        elif self.quantized is not None:
+            top_rows, top_scores = self.quantized.search(queries, n_results=k, candidate_rows=candidates)
+        elif self.ivf is not None and n_candidates >= IVF_MIN_SIZE:
+            candidate_mask = None
+            if candidates is not None:
+                candidate_mask = np.zeros(self._size, dtype=bool)
+                candidate_mask[candidates] = True
+            top_rows, top_scores = self.ivf.search(queries, n_results=k, candidate_mask=candidate_mask)
+            short = [i for i, rows in enumerate(top_rows) if len(rows) < k]
+            if short:
+                exact_rows, exact_scores = self._exact_search(queries[short], k, candidates)
+                for i, rows, row_scores in zip(short, exact_rows, exact_scores):
+                    top_rows[i], top_scores[i] = rows, row_scores
+        else:
+            top_rows, top_scores = self._exact_search(queries, k, candidates)
+
+        for rows, row_scores in zip(top_rows, top_scores):
+            row_result = self._rows_result(rows, include)
+            for key in ('ids', 'documents', 'metadatas', 'embeddings'):
+                results[key].append(row_result[key])
+            # 归一化向量: ||q - v||^2 = 2 - 2 * q·v
+            results['distances'].append(np.maximum(2.0 - 2.0 * row_scores, 0.0).tolist())
+
+        for key in ('documents', 'metadatas', 'distances', 'embeddings'):
+            if key not in include:
+                results[key] = None
+        return results
+
+
+class NumpyIndexClient:
+    """NumPy索引客户端，接口对齐chromadb.PersistentClient"""
+
+    def __init__(self, path: str, quantization: Optional[str] = None,
+                 ann_index: Optional[str] = None, nprobe: int = 8):
+        """
+        Args:
+            path: 索引根目录，每个集合一个子目录
+            quantization: 集合检索使用的量化编码（见 NumpyCollection）
+            ann_index: 集合使用的近似检索结构（见 NumpyCollection）
+            nprobe: IVF每个查询探查的单元数
+        """
+        self.path = path
+        self.quantization = quantization
+        self.ann_index = ann_index
+        self.nprobe = nprobe
+        os.makedirs(path, exist_ok=True)
+
+    def get_or_create_collection(self, name: str, metadata: Optional[Dict[str, Any]] = None,
+                                 embedding_function=None) -> NumpyCollection:
+        """创建或获取集合（embedding_function参数仅为兼容Chroma接口）"""
+        return NumpyCollection(os.path.join(self.path, name), name, metadata,
+                               quantization=self.quantization,
+                               ann_index=self.ann_index, nprobe=self.nprobe)
+
+    def delete_collection(self, name: str):
+        """删除集合"""
+        collection_path = os.path.join(self.path, name)
+        if not os.path.isdir(collection_path):
+            raise ValueError(f"集合不存在: {name}")
+        shutil.rmtree(collection_path)
+
+    def list_collections(self) -> List[str]:
+        """列出所有集合名称"""
+        return sorted(
+            name for name in os.listdir(self.path)
+            if os.path.exists(os.path.join(self.path, name, 'meta.json'))
+        )
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ONNX编码器模块
+把BGE模型导出为ONNX格式（可选动态int8量化），用ONNX Runtime在CPU上推理；
+encode接口与SentenceTransformer一致，输出同样是CLS池化后归一化的向量，可与已有索引混用
+"""
+
+import os
+import re
+import json
+import logging
+from typing import List, Dict, Any, Optional
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def _model_dir(onnx_dir: str, model_name: str) -> str:
+    """每个模型一个导出目录"""
+    return os.path.join(onnx_dir, re.sub(r'[^A-Za-z0-9_.-]', '_', model_name))
+
+
+def check_parity(encoder, reference, texts: List[str], min_cosine: float = 0.99) -> Dict[str, Any]:
+    """
+    比较两个编码器的输出
+
+    Args:
+        encoder: 待检查的编码器（如OnnxEncoder）
+        reference: 参照编码器（如SentenceTransformer）
+        texts: 检查用的文本
+        min_cosine: 每个文本的余弦相似度下限
+
+    Returns:
+        包含最小/平均余弦相似度和是否通过的字典
+    """
+    ours = encoder.encode(texts, normalize_embeddings=True, show_progress_bar=False)
+    theirs = reference.encode(texts, normalize_embeddings=True, show_progress_bar=False)
+    cosines = np.sum(np.asarray(ours) * np.asarray(theirs), axis=1)
+    report = {
+        'n_texts': len(texts),
+        'min_cosine': float(cosines.min()),
+        'mean_cosine': float(cosines.mean()),
+        'passed': bool(cosines.min() >= min_cosine)
+    }
+    logger.info(f"编码器一致性检查: {report}")
+    return report
+
+
+def _parity_marker_path(model_path: str) -> str:
+    return model_path + '.parity.json'
+
+
+def parity_verified(model_path: str, min_cosine: float) -> bool:
+    """模型文件是否已通过一致性检查（标记文件中记录的文件大小一致，且最小余弦相似度不低于下限）"""
+    try:
+        with open(_parity_marker_path(model_path), 'r', encoding='utf-8') as f:
+            marker = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return (marker.get('model_bytes') == os.path.getsize(model_path)
+            and marker.get('min_cosine', -1.0) >= min_cosine)
+
+
+def write_parity_marker(model_path: str, report: Dict[str, Any]):
+    """记录模型文件已通过一致性检查"""
+    marker = dict(report, model_bytes=os.path.getsize(model_path))
+    with open(_parity_marker_path(model_path), 'w', encoding='utf-8') as f:
+        json.dump(marker, f, ensure_ascii=False)
+
+
+def export_onnx(model_name: str, output_dir: str, opset_version: int = 14) -> str:
+    """
+    把Hugging Face模型导出为ONNX（输出last_hidden_state，批大小和序列长度可变）
+
+    Args:
+        model_name: 模型名称或路径
+        output_dir: 导出目录（同时保存分词器）
+        opset_version: ONNX算子集版本
+
+    Returns:
+        model.onnx 的路径
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name)
+    model.eval()
+
+    dummy = tokenizer(["骆驼祥子"], return_tensors='pt')
+    # 按BertModel.forward的参数顺序传入
+    input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in dummy]
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+    dynamic_axes['last_hidden_state'] = {0: 'batch', 1: 'sequence'}
+
+    onnx_path = os.path.join(output_dir, 'model.onnx')
+    with torch.no_grad():
+        torch.onnx.export(
+            model, tuple(dummy[name] for name in input_names), onnx_path,
+            input_names=input_names, output_names=['last_hidden_state'],
+            dynamic_axes=dynamic_axes, opset_version=opset_version
+        )
+    tokenizer.save_pretrained(output_dir)
+    logger.info(f"已导出ONNX模型: {onnx_path}")
+    return onnx_path
+
+
+def quantize_onnx(onnx_path: str, output_path: str) -> str:
+    """对ONNX模型做动态int8量化（权重int8，激活在推理时量化）"""
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    quantize_dynamic(onnx_path, output_path, weight_type=QuantType.QInt8)
+    logger.info(f"已生成int8量化模型: {output_path}")
+    return output_path
+
+
+class OnnxEncoder:
+    """基于ONNX Runtime的BGE编码器，接口与SentenceTransformer.encode兼容"""
+
+    def __init__(self, model_name: str = "BAAI/bge-small-zh-v1.5", onnx_dir: str = "./onnx_models",
+                 quantize: bool = True, intra_op_threads: Optional[int] = None,
+                 max_seq_length: int = 512, pooling: str = "cls",
+                 parity_texts: Optional[List[str]] = None, min_cosine: float = 0.99):
+        """
+        加载（首次使用时导出）ONNX模型
+
+        Args:
+            model_name: 模型名称
+            onnx_dir: 导出模型的保存目录
+            quantize: 是否使用动态int8量化的模型
+            intra_op_threads: 单个算子使用的线程数，默认由ONNX Runtime决定
+            max_seq_length: 最大序列长度
+            pooling: 池化方式，"cls"（BGE使用）或 "mean"
+            parity_texts: 与PyTorch模型比对输出所用的文本（模型文件没有通过检查的标记时比对）
+            min_cosine: 一致性检查的余弦相似度下限，未通过时删除该模型文件并抛出ValueError
+        """
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        if pooling not in ("cls", "mean"):
+            raise ValueError(f"不支持的池化方式: {pooling}")
+        self.model_name = model_name
+        self.max_seq_length = max_seq_length
+        self.pooling = pooling
+        self.quantize = quantize
+
+        model_dir = _model_dir(onnx_dir, model_name)
+        onnx_path = os.path.join(model_dir, 'model.onnx')
+        quantized_path = os.path.join(model_dir, 'model_int8.onnx')
+        if not os.path.exists(onnx_path):
+            export_onnx(model_name, model_dir)
+        if quantize and not os.path.exists(quantized_path):
+            quantize_onnx(onnx_path, quantized_path)
+        self.model_path = quantized_path if quantize else onnx_path
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        self.session = ort.InferenceSession(self.model_path, options, providers=['CPUExecutionProvider'])
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+        self._dimension = self.session.get_outputs()[0].shape[-1]
+        logger.info(f"已加载ONNX编码器: {self.model_path}")
+
+        if not parity_verified(self.model_path, min_cosine):
+            # 没有通过检查标记的模型（刚导出、量化或上次检查失败）先与PyTorch模型比对，确认向量与已有索引兼容
+            from sentence_transformers import SentenceTransformer
+            texts = parity_texts or ["祥子拉着洋车在北平的街上跑。", "虎妞是刘四爷的女儿。",
+                                     "骆驼", "他想买一辆自己的车，三年的工夫他终于攒够了钱。"]
+            report = check_parity(self, SentenceTransformer(model_name), texts, min_cosine)
+            if not report['passed']:
+                # 删除不合格的模型，下次启动时重新导出，而不是直接加载
+                self.session = None
+                stale = [self.model_path] + ([] if quantize else [quantized_path])
+                for path in stale:
+                    for artifact in (path, _parity_marker_path(path)):
+                        if os.path.exists(artifact):
+                            os.remove(artifact)
+                raise ValueError(f"ONNX编码器与PyTorch输出不一致: 最小余弦相似度 {report['min_cosine']:.4f}，"
+                                 f"已删除 {self.model_path}")
+            write_parity_marker(self.model_path, report)
+
+    def get_sentence_embedding_dimension(self) -> int:
+        """向量维度"""
+        if not isinstance(self._dimension, int):
+            self._dimension = int(self.encode(["维度"]).shape[1])
+        return self._dimension
+
+    def encode(self, sentences, batch_size: int = 32, normalize_embeddings: bool = True,
+               show_progress_bar: bool = False, **kwargs) -> np.ndarray:
+        """
+        生成向量（参数与SentenceTransformer.encode一致，show_progress_bar等参数被忽略）
+
+        Args:
+            sentences: 文本或文本列表
+            batch_size: 批处理大小
+            normalize_embeddings: 是否归一化
+
+        Returns:
+            向量数组 (n_texts, dimension)；输入为单个字符串时返回一维向量
+        """
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+
+        embeddings = []
+        for start in range(0, len(texts), batch_size):
+            encoded = self.tokenizer(texts[start:start + batch_size], padding=True, truncation=True,
+                                     max_length=self.max_seq_length, return_tensors='np')
+            feed = {name: encoded[name].astype(np.int64) for name in self.input_names}
+            hidden = self.session.run(None, feed)[0]
+            if self.pooling == "cls":
+                pooled = hidden[:, 0]
+            else:
+                mask = encoded['attention_mask'][..., None].astype(np.float32)
+                pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+            embeddings.append(pooled.astype(np.float32))
+
+        result = np.vstack(embeddings) if embeddings else np.zeros((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+        if normalize_embeddings and len(result):
+            result /= np.maximum(np.linalg.norm(result, axis=1, keepdims=True), 1e-12)
+        return result[0] if single else result
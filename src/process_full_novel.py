@@ -10,6 +10,9 @@ import os
 import logging
 from typing import List, Dict, Any
 from vector_processor import VectorProcessor
+from character_extractor import get_default_matcher
+from chunker import OffsetChunker
+from chunk_store import ChunkStore
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -37,55 +40,31 @@ def convert_novel_to_chunks(json_file_path: str, output_file_path: str,
         logger.info(f"总章节数: {novel_data['book_info']['total_chapters']}")
         logger.info(f"总字数: {novel_data['book_info']['total_words']}")
         
-        chunks = []
-        chunk_id = 0
+        # 所有章节一次分块，得到共享文本缓冲区中的偏移量
+        chunker = OffsetChunker(chunk_size=chunk_size, overlap=overlap)
+        index = chunker.chunk_chapters(novel_data['chapters'])
         
-        # 处理每个章节
-        for chapter in novel_data['chapters']:
-            content = chapter['content']
-            chapter_num = chapter['chapter_num']
+        chunks = []
+        ordinals: Dict[int, int] = {}
+        for position, (chapter_index, start, end) in enumerate(index):
+            chapter = novel_data['chapters'][chapter_index]
             chapter_title = chapter['chapter_title']
+            chunk_content = index.text(position)
             
-            # 将章节内容分块
-            start = 0
-            while start < len(content):
-                end = start + chunk_size
-                
-                # 如果不是最后一块，尝试在句号处断开
-                if end < len(content):
-                    # 寻找最近的句号
-                    for i in range(end, max(start + chunk_size // 2, end - 100), -1):
-                        if content[i] in '。！？':
-                            end = i + 1
-                            break
-                
-                chunk_content = content[start:end].strip()
-                
-                if len(chunk_content) > 50:  # 只保留有意义的文本块
-                    chunk_id += 1
-                    
-                    # 提取人物名称（简单版本）
-                    characters = extract_characters_simple(chunk_content)
-                    
-                    chunk_metadata = {
-                        'chunk_id': f"chunk_{chunk_id:04d}",
-                        'chapter_num': chapter_num,
-                        'chapter_title': chapter_title[:100] + "..." if len(chapter_title) > 100 else chapter_title,
-                        'book_title': novel_data['book_info']['title'],
-                        'book_author': novel_data['book_info'].get('author', '老舍'),
-                        'word_count': len(chunk_content),
-                        'characters': characters,
-                        'content': chunk_content,
-                        'start_position': start,
-                        'end_position': end
-                    }
-                    
-                    chunks.append(chunk_metadata)
-                
-                # 移动到下一个位置，考虑重叠
-                start = max(start + chunk_size - overlap, end)
-                if start >= len(content):
-                    break
+            # ID = 章节号 + 章内序号：某一章增删文本块不会改变其他章节的ID
+            ordinals[chapter_index] = ordinals.get(chapter_index, 0) + 1
+            chunks.append({
+                'chunk_id': f"chunk_{chapter['chapter_num']:03d}_{ordinals[chapter_index]:03d}",
+                'chapter_num': chapter['chapter_num'],
+                'chapter_title': chapter_title[:100] + "..." if len(chapter_title) > 100 else chapter_title,
+                'book_title': novel_data['book_info']['title'],
+                'book_author': novel_data['book_info'].get('author', '老舍'),
+                'word_count': len(chunk_content),
+                'characters': extract_characters_simple(chunk_content),
+                'content': chunk_content,
+                'start_position': start,
+                'end_position': end
+            })
         
         # 保存处理后的chunks
         os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
@@ -103,27 +82,16 @@ def convert_novel_to_chunks(json_file_path: str, output_file_path: str,
 
 def extract_characters_simple(text: str) -> List[str]:
     """
-    简单的人物名称提取
+    简单的人物名称提取（基于共享的人物词典，别名归并到标准名）
     """
-    # 《骆驼祥子》主要人物
-    main_characters = [
-        '祥子', '虎妞', '小福子', '刘四爷', '老马', '小马', 
-        '曹先生', '高妈', '阮明', '夏太太', '杨太太', '张妈',
-        '二强子', '小文', '老程', '丁四', '孙排长'
-    ]
-    
-    found_characters = []
-    for char in main_characters:
-        if char in text:
-            found_characters.append(char)
-    
-    return list(set(found_characters))  # 去重
+    return get_default_matcher().names(text)
 
 def main():
     """主函数"""
     # 文件路径
     input_file = "processed_luotuoxiangzi.json"
     output_file = "data/processed/luotuoxiangzi_chunks.json"
+    store_dir = "data/processed/luotuoxiangzi_chunks.store"
     
     # 检查输入文件是否存在
     if not os.path.exists(input_file):
@@ -134,16 +102,19 @@ def main():
     logger.info("开始处理小说文件...")
     chunks = convert_novel_to_chunks(input_file, output_file, chunk_size=400, overlap=80)
     
+    # 同时写入列式存储（内存映射读取，可按chunk_id随机访问）
+    ChunkStore.write(store_dir, chunks)
+    
     # 初始化向量处理器
     logger.info("初始化向量处理器...")
-    processor = VectorProcessor()
+    processor = VectorProcessor(embedding_cache_dir="./embedding_cache")
     
-    # 创建新的集合（重置之前的数据）
-    processor.create_collection(reset=True)
+    # 获取已有集合（增量模式下只处理变化的文本块）
+    processor.create_collection(reset=False)
     
     # 处理文本块并生成向量
     logger.info("开始生成向量并存储到数据库...")
-    result = processor.process_json_chunks(output_file)
+    result = processor.process_json_chunks(store_dir, incremental=True)
     
     # 显示结果
     print("\n" + "="*50)
@@ -153,11 +124,14 @@ def main():
     print(f"向量维度: {result['vector_dimension']}")
     print(f"数据库中的向量数: {result['collection_count']}")
     print(f"使用的模型: {result['model_name']}")
+    print(f"新增/变化/未变/删除: {result['added']}/{result['updated']}/"
+          f"{result['unchanged']}/{result['deleted']}")
+    print(f"生成向量/沿用已有向量: {result['embedded']}/{result['reused']}")
     
     # 获取统计信息
     stats = processor.get_collection_stats()
     print(f"集合名称: {stats['collection_name']}")
-    print(f"数据库路径: {stats['chroma_persist_directory']}")
+    print(f"数据库路径: {stats['persist_directory']}")
     
     # 测试搜索功能
     print("\n" + "="*50)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+向量量化模块
+int8标量量化（每个向量一个缩放系数）和二值符号编码（按汉明距离检索），
+先在紧凑编码上粗筛候选，再用原始float32向量对候选精确重排
+"""
+
+import logging
+from typing import Optional, Tuple
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+QUANTIZATION_MODES = ("int8", "binary")
+
+# 0-255每个字节中1的个数，用于计算汉明距离
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    对称int8标量量化
+
+    Args:
+        vectors: float向量 (n, dimension)
+
+    Returns:
+        (int8编码 (n, dimension), 每个向量的缩放系数 (n,))
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def binary_codes(vectors: np.ndarray) -> np.ndarray:
+    """按符号位编码并打包为字节 (n, ceil(dimension / 8))"""
+    return np.packbits(np.asarray(vectors) > 0, axis=1)
+
+
+def hamming_distances(query_codes: np.ndarray, codes: np.ndarray) -> np.ndarray:
+    """
+    计算汉明距离
+
+    Args:
+        query_codes: 查询的二值编码 (n_queries, n_bytes)
+        codes: 库中的二值编码 (n, n_bytes)
+
+    Returns:
+        距离矩阵 (n_queries, n)
+    """
+    distances = np.empty((len(query_codes), len(codes)), dtype=np.int32)
+    for i, query_code in enumerate(query_codes):
+        distances[i] = _POPCOUNT[np.bitwise_xor(codes, query_code)].sum(axis=1, dtype=np.int32)
+    return distances
+
+
+class QuantizedIndex:
+    """量化粗筛 + float精确重排的检索结构"""
+
+    def __init__(self, vectors: np.ndarray, mode: str = "int8", block_size: int = 65536):
+        """
+        由float向量构建量化编码
+
+        Args:
+            vectors: float32向量 (n, dimension)，通常是内存映射数组，只在重排时按行读取
+            mode: 量化方式，"int8" 或 "binary"
+            block_size: 构建和粗筛时每块处理的行数（限制临时内存）
+        """
+        if mode not in QUANTIZATION_MODES:
+            raise ValueError(f"不支持的量化方式: {mode}")
+        self.mode = mode
+        self.vectors = vectors
+        self.block_size = block_size
+
+        n, dimension = vectors.shape
+        if mode == "int8":
+            self.codes = np.empty((n, dimension), dtype=np.int8)
+            self.scales = np.empty(n, dtype=np.float32)
+        else:
+            self.codes = np.empty((n, (dimension + 7) // 8), dtype=np.uint8)
+            self.scales = None
+
+        for start in range(0, n, block_size):
+            block = np.asarray(vectors[start:start + block_size], dtype=np.float32)
+            if mode == "int8":
+                self.codes[start:start + len(block)], self.scales[start:start + len(block)] = quantize_int8(block)
+            else:
+                self.codes[start:start + len(block)] = binary_codes(block)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def bytes_per_vector(self) -> float:
+        """每个向量在内存中的编码大小（字节）"""
+        size = self.codes.shape[1] * self.codes.itemsize
+        if self.scales is not None:
+            size += self.scales.itemsize
+        return float(size)
+
+    def compression_ratio(self) -> float:
+        """相对float32存储的压缩比"""
+        return self.vectors.shape[1] * 4 / self.bytes_per_vector()
+
+    def _coarse_scores(self, queries: np.ndarray, rows: Optional[np.ndarray]) -> np.ndarray:
+        """在量化编码上计算近似分数（越大越相似）"""
+        codes = self.codes if rows is None else self.codes[rows]
+        if self.mode == "binary":
+            return -hamming_distances(binary_codes(queries), codes).astype(np.float32)
+
+        scales = self.scales if rows is None else self.scales[rows]
+        scores = np.empty((len(queries), len(codes)), dtype=np.float32)
+        for start in range(0, len(codes), self.block_size):
+            block = codes[start:start + self.block_size].astype(np.float32)
+            scores[:, start:start + len(block)] = (queries @ block.T) * scales[start:start + len(block)]
+        return scores
+
+    def search(self, queries: np.ndarray, n_results: int = 10, rescore: Optional[int] = None,
+               candidate_rows: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        两阶段检索：量化编码粗筛，float向量精确重排
+
+        Args:
+            queries: 归一化查询向量 (n_queries, dimension)
+            n_results: 返回结果数量
+            rescore: 粗筛保留的候选数量，默认int8为 max(4 * n_results, 50)，
+                二值编码精度较低，默认为 max(20 * n_results, 200)
+            candidate_rows: 只在这些行中检索，默认全部
+
+        Returns:
+            (行号 (n_queries, k), 精确内积分数 (n_queries, k))，按分数降序
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        n_rows = len(self) if candidate_rows is None else len(candidate_rows)
+        k = min(n_results, n_rows)
+        if k == 0:
+            return np.zeros((len(queries), 0), dtype=np.int64), np.zeros((len(queries), 0), dtype=np.float32)
+
+        if rescore is None:
+            rescore = max(4 * n_results, 50) if self.mode == "int8" else max(20 * n_results, 200)
+        n_rescore = min(max(rescore, k), n_rows)
+        coarse = self._coarse_scores(queries, candidate_rows)
+        shortlist = np.argpartition(-coarse, n_rescore - 1, axis=1)[:, :n_rescore]
+        if candidate_rows is not None:
+            shortlist = candidate_rows[shortlist]
+
+        top_rows = np.empty((len(queries), k), dtype=np.int64)
+        top_scores = np.empty((len(queries), k), dtype=np.float32)
+        for i, (query, rows) in enumerate(zip(queries, shortlist)):
+            rows = np.sort(rows)  # 按行号顺序读取内存映射文件
+            exact = np.asarray(self.vectors[rows], dtype=np.float32) @ query
+            best = np.argsort(-exact, kind='stable')[:k]
+            top_rows[i], top_scores[i] = rows[best], exact[best]
+        return top_rows, top_scores
+
+    def recall_at_k(self, queries: np.ndarray, k: int = 10, rescore: Optional[int] = None) -> float:
+        """
+        相对精确检索的召回率
+
+        Args:
+            queries: 归一化查询向量 (n_queries, dimension)
+            k: top-k
+            rescore: 粗筛候选数量
+
+        Returns:
+            recall@k
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        k = min(k, len(self))
+        if k == 0:
+            return 1.0
+        exact = np.asarray(self.vectors, dtype=np.float32) @ queries.T
+        truth = np.argpartition(-exact, k - 1, axis=0)[:k].T
+        approx, _ = self.search(queries, n_results=k, rescore=rescore)
+        hits = sum(len(np.intersect1d(t, a)) for t, a in zip(truth, approx))
+        return hits / (k * len(queries))
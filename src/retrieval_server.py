@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+常驻检索服务
+在本地HTTP端口上提供检索接口，模型和索引常驻内存；并发到达的查询在很短的等待窗口内
+合并为一个微批次，一次编码、一次检索，并统计吞吐量和p50/p99延迟
+
+用法:
+    python3 src/retrieval_server.py [端口]            # 启动服务，默认 127.0.0.1:8765
+    RETRIEVAL_SERVER_URL=http://127.0.0.1:8765 python3 analyze_xiangzi_actions.py
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import logging
+import threading
+import urllib.request
+from collections import deque
+from concurrent.futures import Future
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import List, Dict, Any, Optional, Tuple, Union
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def _normalize_filters(filters: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """JSON中的章节范围是列表，转换为search_many使用的元组"""
+    filters = dict(filters or {})
+    if isinstance(filters.get('chapter_range'), list):
+        filters['chapter_range'] = tuple(filters['chapter_range'])
+    return filters
+
+
+def _truncate_results(results: Dict[str, Any], n_results: int) -> Dict[str, Any]:
+    """把按批次最大n_results检索的结果截断为单个请求需要的数量"""
+    return {
+        key: [value[0][:n_results]] if value is not None else None
+        for key, value in results.items()
+    }
+
+
+class MicroBatcher:
+    """把并发到达的查询合并为微批次，由单个工作线程调用 search_many"""
+
+    def __init__(self, processor, max_batch_size: int = 64, max_wait_ms: float = 5.0,
+                 latency_window: int = 10000):
+        """
+        Args:
+            processor: 已打开集合的 VectorProcessor
+            max_batch_size: 每个批次最多的查询数
+            max_wait_ms: 收到第一个查询后最多等待多久凑批次（毫秒）
+            latency_window: 计算延迟分位数时保留的最近请求数
+        """
+        self.processor = processor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+
+        self._queue: "queue.Queue[Tuple[str, int, Dict[str, Any], float, Future]]" = queue.Queue()
+        self._latencies = deque(maxlen=latency_window)
+        self._lock = threading.Lock()
+        self._started_at = time.time()
+        self._total_queries = 0
+        self._total_batches = 0
+        self._failed_queries = 0
+
+        self._worker = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, query: str, n_results: int = 5,
+               filters: Optional[Dict[str, Any]] = None) -> Future:
+        """提交一个查询，返回结果的Future"""
+        future: Future = Future()
+        self._queue.put((query, n_results, _normalize_filters(filters), time.perf_counter(), future))
+        return future
+
+    def search_many(self, queries: List[str], n_results: int = 5,
+                    filters: Optional[Union[Dict[str, Any], List[Dict[str, Any]]]] = None
+                    ) -> List[Dict[str, Any]]:
+        """提交多个查询并等待全部结果（与其他请求的查询一起组批）"""
+        if filters is None or isinstance(filters, dict):
+            filters = [filters] * len(queries)
+        futures = [self.submit(query, n_results, query_filter)
+                   for query, query_filter in zip(queries, filters)]
+        return [future.result() for future in futures]
+
+    def _collect_batch(self) -> list:
+        """阻塞等待第一个查询，再在等待窗口内尽量凑满批次"""
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        """工作线程：循环取批次并检索"""
+        while True:
+            batch = self._collect_batch()
+            queries = [item[0] for item in batch]
+            n_results = max(item[1] for item in batch)
+            filters = [item[2] for item in batch]
+            try:
+                results = self.processor.search_many(queries, n_results=n_results, filters=filters)
+            except Exception as e:
+                if len(batch) == 1:
+                    self._fail(batch[0], e)
+                    continue
+                # 批次中可能只有一个查询有问题（如过滤条件不合法），逐个重试，错误只返回给出错的请求
+                logger.warning(f"批次检索失败，逐个重试 {len(batch)} 个查询: {e}")
+                for item in batch:
+                    try:
+                        result = self.processor.search_many([item[0]], n_results=item[1],
+                                                            filters=[item[2]])[0]
+                    except Exception as item_error:
+                        self._fail(item, item_error)
+                        continue
+                    self._finish([item], [result])
+                continue
+
+            self._finish(batch, results)
+
+    def _finish(self, batch: list, results: List[Dict[str, Any]]):
+        """记录一个（子）批次的延迟并返回结果"""
+        finished = time.perf_counter()
+        with self._lock:
+            self._total_queries += len(batch)
+            self._total_batches += 1
+            for item in batch:
+                self._latencies.append(finished - item[3])
+        for item, result in zip(batch, results):
+            item[4].set_result(_truncate_results(result, item[1]))
+
+    def _fail(self, item, error: Exception):
+        """单个查询检索失败，把错误返回给提交它的请求"""
+        logger.error(f"检索失败 '{item[0]}': {error}")
+        with self._lock:
+            self._failed_queries += 1
+        item[4].set_exception(error)
+
+    def metrics(self) -> Dict[str, Any]:
+        """吞吐量和延迟统计"""
+        with self._lock:
+            latencies = np.array(self._latencies, dtype=np.float64) * 1000
+            uptime = time.time() - self._started_at
+            total_queries = self._total_queries
+            total_batches = self._total_batches
+            failed_queries = self._failed_queries
+
+        return {
+            'uptime_seconds': round(uptime, 1),
+            'total_queries': total_queries,
+            'total_batches': total_batches,
+            'failed_queries': failed_queries,
+            'avg_batch_size': round(total_queries / total_batches, 2) if total_batches else 0.0,
+            'queries_per_second': round(total_queries / uptime, 2) if uptime > 0 else 0.0,
+            'latency_ms_p50': round(float(np.percentile(latencies, 50)), 2) if len(latencies) else None,
+            'latency_ms_p99': round(float(np.percentile(latencies, 99)), 2) if len(latencies) else None,
+            'queue_size': self._queue.qsize()
+        }
+
+
+class RetrievalHTTPServer(ThreadingHTTPServer):
+    """每个连接一个线程；加大监听队列，避免并发客户端较多时连接被拒绝"""
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def make_handler(batcher: MicroBatcher):
+    """生成绑定到batcher的HTTP请求处理类"""
+
+    class RetrievalHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status: int, payload: Dict[str, Any]):
+            body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/metrics':
+                self._send_json(200, batcher.metrics())
+            elif self.path == '/health':
+                self._send_json(200, {'status': 'ok'})
+            else:
+                self._send_json(404, {'error': f'未知路径: {self.path}'})
+
+        def do_POST(self):
+            if self.path != '/search':
+                self._send_json(404, {'error': f'未知路径: {self.path}'})
+                return
+            try:
+                request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                results = batcher.search_many(
+                    request['queries'],
+                    n_results=request.get('n_results', 5),
+                    filters=request.get('filters')
+                )
+                self._send_json(200, {'results': results})
+            except Exception as e:
+                self._send_json(500, {'error': str(e)})
+
+        def log_message(self, *args):
+            pass
+
+    return RetrievalHandler
+
+
+def serve(processor, host: str = "127.0.0.1", port: int = 8765,
+          max_batch_size: int = 64, max_wait_ms: float = 5.0) -> RetrievalHTTPServer:
+    """
+    创建检索服务（调用方负责 serve_forever / shutdown）
+
+    Args:
+        processor: 已打开集合的 VectorProcessor
+        host: 监听地址
+        port: 监听端口，0表示随机端口
+        max_batch_size: 微批次最大查询数
+        max_wait_ms: 微批次最大等待时间（毫秒）
+
+    Returns:
+        HTTP服务对象，server.batcher 为其微批处理器
+    """
+    batcher = MicroBatcher(processor, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+    server = RetrievalHTTPServer((host, port), make_handler(batcher))
+    server.batcher = batcher
+    return server
+
+
+class RetrievalClient:
+    """检索服务的轻量客户端，search_similar / search_many 与 VectorProcessor 接口一致"""
+
+    def __init__(self, base_url: str, timeout: float = 60.0):
+        """
+        Args:
+            base_url: 服务地址，例如 http://127.0.0.1:8765
+            timeout: 请求超时时间（秒）
+        """
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def _request(self, path: str, payload: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8') if payload is not None else None
+        request = urllib.request.Request(
+            self.base_url + path, data=data,
+            headers={'Content-Type': 'application/json'} if data is not None else {}
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    def search_many(self, queries: List[str], n_results: int = 5,
+                    filters: Optional[Union[Dict[str, Any], List[Dict[str, Any]]]] = None
+                    ) -> List[Dict[str, Any]]:
+        """批量搜索（参数同 VectorProcessor.search_many）"""
+        if not queries:
+            return []
+        return self._request('/search', {
+            'queries': queries, 'n_results': n_results, 'filters': filters
+        })['results']
+
+    def search_similar(self, query: str, n_results: int = 5,
+                       chapter_range=None, characters: Optional[List[str]] = None) -> Dict[str, Any]:
+        """搜索相似文本（参数同 VectorProcessor.search_similar）"""
+        filters = {}
+        if chapter_range is not None:
+            filters['chapter_range'] = chapter_range
+        if characters:
+            filters['characters'] = characters
+        return self.search_many([query], n_results=n_results, filters=filters)[0]
+
+    def metrics(self) -> Dict[str, Any]:
+        """服务端的吞吐量和延迟统计"""
+        return self._request('/metrics')
+
+
+def main():
+    """主函数"""
+    from vector_processor import VectorProcessor
+
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else int(os.getenv('RETRIEVAL_PORT', '8765'))
+    host = os.getenv('RETRIEVAL_HOST', '127.0.0.1')
+
+    processor = VectorProcessor()
+    processor.create_collection(reset=False)
+    # 预热：启动时就加载模型，第一个请求不再等待
+    processor.encode_queries(["祥子"])
+    logger.info(f"启动耗时: {processor.startup_report()}")
+
+    server = serve(processor, host=host, port=port)
+    logger.info(f"检索服务已启动: http://{host}:{port} （集合 {processor.collection_name}，"
+                f"{processor.collection.count()} 个文本块）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info(f"检索服务已停止: {server.batcher.metrics()}")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+检索结果缓存模块
+以 查询文本 + n_results + 过滤条件 + 集合版本 的哈希为键缓存检索结果：
+进程内是按最近最少使用淘汰的LRU，可选的磁盘层保存在本地SQLite数据库中，跨进程复用；
+集合每次写入或删除都会改变版本，写入后旧结果不会再被命中
+"""
+
+import copy
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+import metrics
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def _json_default(value):
+    """把numpy标量/数组转换为JSON可序列化的类型"""
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError(f"无法序列化的类型: {type(value)}")
+
+
+class SearchCache:
+    """两级检索结果缓存：进程内LRU + 可选的SQLite磁盘层"""
+
+    def __init__(self, max_entries: int = 1024, db_path: Optional[str] = None,
+                 max_disk_entries: int = 100000):
+        """
+        Args:
+            max_entries: 进程内最多缓存的结果数
+            db_path: 磁盘层SQLite数据库路径，为None时只使用进程内缓存
+            max_disk_entries: 磁盘层最多保存的结果数，超出时淘汰最久未使用的记录
+        """
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self.max_disk_entries = max_disk_entries
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # 每个集合最近一次见到的版本，版本变化时清理磁盘上该集合的旧结果
+        self._versions: Dict[str, str] = {}
+
+        self._conn = None
+        if db_path:
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS results (
+                    key TEXT PRIMARY KEY,
+                    collection TEXT NOT NULL,
+                    version TEXT NOT NULL,
+                    result TEXT NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_results_accessed_at ON results (accessed_at)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_results_collection ON results (collection)")
+            self._conn.commit()
+
+    @staticmethod
+    def make_key(collection: str, version: str, model: str, query: str, n_results: int,
+                 filters: Optional[Dict[str, Any]] = None) -> str:
+        """计算缓存键"""
+        payload = json.dumps({
+            'collection': collection,
+            'version': version,
+            'model': model,
+            'query': query,
+            'n_results': n_results,
+            'filters': filters or {}
+        }, ensure_ascii=False, sort_keys=True, default=_json_default)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def observe_version(self, collection: str, version: str):
+        """记录集合的当前版本；版本变化时丢弃该集合在磁盘上的旧结果（进程内的旧结果随LRU淘汰）"""
+        if self._versions.get(collection) == version:
+            return
+        self._versions[collection] = version
+        if self._conn is None:
+            return
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM results WHERE collection = ? AND version != ?", (collection, version)
+            )
+            self._conn.commit()
+        if cursor.rowcount:
+            logger.info(f"集合 {collection} 已更新，清除了 {cursor.rowcount} 条过期的检索缓存")
+
+    def get_many(self, keys: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """批量读取缓存结果（未命中为None），先查进程内缓存再查磁盘层"""
+        results: List[Optional[Dict[str, Any]]] = [None] * len(keys)
+        missing = []
+        with self._lock:
+            for i, key in enumerate(keys):
+                entry = self._entries.get(key)
+                if entry is None:
+                    missing.append(i)
+                else:
+                    self._entries.move_to_end(key)
+                    results[i] = copy.deepcopy(entry)
+            self.hits += len(keys) - len(missing)
+
+            if missing and self._conn is not None:
+                now = time.time()
+                for i in list(missing):
+                    row = self._conn.execute(
+                        "SELECT result FROM results WHERE key = ?", (keys[i],)
+                    ).fetchone()
+                    if row is None:
+                        continue
+                    entry = json.loads(row[0])
+                    self._remember(keys[i], entry)
+                    results[i] = copy.deepcopy(entry)
+                    missing.remove(i)
+                    self.disk_hits += 1
+                    self._conn.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, keys[i]))
+                self._conn.commit()
+            self.misses += len(missing)
+
+        metrics.inc('rag_search_cache_lookups', len(keys) - len(missing), result='hit')
+        metrics.inc('rag_search_cache_lookups', len(missing), result='miss')
+        return results
+
+    def put_many(self, items: List[Tuple[str, Dict[str, Any]]], collection: str, version: str):
+        """批量写入结果（键, 结果），磁盘层超出容量时淘汰最久未使用的记录"""
+        if not items:
+            return
+        with self._lock:
+            for key, result in items:
+                self._remember(key, copy.deepcopy(result))
+
+            if self._conn is not None:
+                now = time.time()
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO results (key, collection, version, result, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [(key, collection, version,
+                      json.dumps(result, ensure_ascii=False, default=_json_default), now)
+                     for key, result in items]
+                )
+                count = self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+                if count > self.max_disk_entries:
+                    self._conn.execute(
+                        "DELETE FROM results WHERE key IN "
+                        "(SELECT key FROM results ORDER BY accessed_at LIMIT ?)",
+                        (count - self.max_disk_entries,)
+                    )
+                self._conn.commit()
+
+    def _remember(self, key: str, result: Dict[str, Any]):
+        """写入进程内LRU（调用方持有锁）"""
+        self._entries[key] = result
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """清空进程内缓存和磁盘层"""
+        with self._lock:
+            self._entries.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM results")
+                self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计信息"""
+        with self._lock:
+            disk_entries = (self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+                            if self._conn is not None else None)
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'disk_entries': disk_entries,
+                'db_path': self.db_path,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses
+            }
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
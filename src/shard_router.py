@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+分片检索模块
+书库按书（或每N本书）拆分为多个分片集合，查询路由器并行检索选定的分片，
+再用堆合并各分片的top-k结果；新书写入新分片，不影响已有分片
+"""
+
+import os
+import re
+import json
+import heapq
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Iterable
+from vector_processor import VectorProcessor
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Chroma集合名称规则：3-63个字符，首尾为字母或数字（不使用"."，避免连续句点等额外限制）
+COLLECTION_NAME_PATTERN = re.compile(r'[A-Za-z0-9][A-Za-z0-9_-]{1,61}[A-Za-z0-9]')
+
+class ShardRouter:
+    """分片集合管理与查询路由"""
+
+    def __init__(self, processor: VectorProcessor, shard_prefix: str = "shard_",
+                 books_per_shard: int = 1, max_workers: int = 8,
+                 manifest_path: Optional[str] = None):
+        """
+        初始化分片路由器
+
+        Args:
+            processor: 向量处理器（共享模型和索引客户端）
+            shard_prefix: 分片集合名称前缀
+            books_per_shard: 每个分片最多容纳的书数
+            max_workers: 并行检索分片的线程数
+            manifest_path: 书 -> 分片映射文件路径，默认放在索引目录下
+        """
+        if not COLLECTION_NAME_PATTERN.fullmatch(f"{shard_prefix}{'0' * 12}"):
+            raise ValueError(f"分片前缀无法生成合法的集合名称: {shard_prefix!r}")
+        self.processor = processor
+        self.shard_prefix = shard_prefix
+        self.books_per_shard = books_per_shard
+        self.max_workers = max_workers
+
+        if manifest_path is None:
+            index_dir = (processor.numpy_persist_directory if processor.index_backend == "numpy"
+                         else processor.chroma_persist_directory)
+            manifest_path = os.path.join(index_dir, f"{shard_prefix}manifest.json")
+        self.manifest_path = manifest_path
+
+        self._lock = threading.Lock()
+        self._shards: Dict[str, Any] = {}
+        self._book_to_shard: Dict[str, str] = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                self._book_to_shard = json.load(f)
+
+    def _save_manifest(self):
+        """保存书 -> 分片映射"""
+        os.makedirs(os.path.dirname(self.manifest_path) or '.', exist_ok=True)
+        with open(self.manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(self._book_to_shard, f, ensure_ascii=False, indent=2)
+
+    def list_shards(self) -> List[str]:
+        """列出所有分片ID"""
+        return sorted(
+            name[len(self.shard_prefix):] for name in self.processor.list_collections()
+            if name.startswith(self.shard_prefix)
+        )
+
+    def get_shard(self, shard_id: str):
+        """获取（必要时创建）分片集合（写入路径使用；检索只打开已存在的分片）"""
+        with self._lock:
+            if shard_id not in self._shards:
+                self._shards[shard_id] = self.processor.open_collection(
+                    f"{self.shard_prefix}{shard_id}", description=f"书库分片 {shard_id}"
+                )
+            return self._shards[shard_id]
+
+    def _safe_shard_id(self, book_id: str) -> str:
+        """生成分片ID，保证 前缀 + 分片ID 是合法的集合名称（否则取书籍ID的哈希）"""
+        if COLLECTION_NAME_PATTERN.fullmatch(f"{self.shard_prefix}{book_id}"):
+            return book_id
+        return hashlib.sha1(book_id.encode('utf-8')).hexdigest()[:12]
+
+    def assign_shard(self, book_id: str) -> str:
+        """
+        为书分配分片：已分配的书沿用原分片，新书放入未满的最后一个分片或新建分片
+
+        Args:
+            book_id: 书籍ID
+
+        Returns:
+            分片ID
+        """
+        with self._lock:
+            if book_id in self._book_to_shard:
+                return self._book_to_shard[book_id]
+
+            if self.books_per_shard == 1:
+                shard_id = self._safe_shard_id(book_id)
+            else:
+                counts: Dict[str, int] = {}
+                for assigned in self._book_to_shard.values():
+                    counts[assigned] = counts.get(assigned, 0) + 1
+                # 编号分片按数值比较（字符串比较时"9"大于"10"）
+                numbered = [assigned for assigned in counts if assigned.isdigit()]
+                last = max(numbered, key=int) if numbered else None
+                if last is not None and counts[last] < self.books_per_shard:
+                    shard_id = last
+                else:
+                    shard_id = f"{int(last) + 1 if last is not None else 0:04d}"
+
+            self._book_to_shard[book_id] = shard_id
+            self._save_manifest()
+            return shard_id
+
+    def add_book(self, book_id: str, chunks: Iterable[Dict[str, Any]],
+                 batch_size: int = 64) -> Dict[str, Any]:
+        """
+        将一本书的文本块写入其分片
+
+        Args:
+            book_id: 书籍ID
+            chunks: 文本块可迭代对象
+            batch_size: 向量化批处理大小
+
+        Returns:
+            处理结果统计（附带分片ID）
+        """
+        shard_id = self.assign_shard(book_id)
+        result = self.processor.ingest_stream(chunks, batch_size=batch_size,
+                                              collection=self.get_shard(shard_id))
+        result['shard_id'] = shard_id
+        return result
+
+    def search(self, query: str, n_results: int = 5, shards: Optional[List[str]] = None,
+               filters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        跨分片搜索相似文本
+
+        Args:
+            query: 查询文本
+            n_results: 返回结果数量
+            shards: 参与检索的分片ID列表，默认全部分片
+            filters: 过滤条件（同 VectorProcessor.search_many）
+
+        Returns:
+            与 search_similar 相同格式的结果，另附 'shards' 字段标明每条结果来自哪个分片
+        """
+        return self.search_many([query], n_results=n_results, shards=shards, filters=filters)[0]
+
+    def search_many(self, queries: List[str], n_results: int = 5,
+                    shards: Optional[List[str]] = None,
+                    filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        跨分片批量搜索：查询只编码一次，各分片并行检索，再按距离用堆合并top-k
+
+        Args:
+            queries: 查询文本列表
+            n_results: 每个查询返回的结果数量
+            shards: 参与检索的分片ID列表，默认全部分片
+            filters: 作用于所有查询的过滤条件
+
+        Returns:
+            与queries一一对应的结果列表
+
+        Raises:
+            ValueError: shards中有既不存在、也未分配给任何书的分片ID
+        """
+        if not queries:
+            return []
+
+        # 检索不创建集合：未知的分片ID报错，已分配但尚未写入的分片没有结果
+        existing = set(self.list_shards())
+        if shards is None:
+            shard_ids = sorted(existing)
+        else:
+            assigned = set(self._book_to_shard.values())
+            unknown = [shard_id for shard_id in shards
+                       if shard_id not in existing and shard_id not in assigned]
+            if unknown:
+                raise ValueError(f"未知的分片: {', '.join(unknown)}")
+            shard_ids = list(shards)
+        query_embeddings = self.processor.to_index_embeddings(
+            self.processor.encode_queries(queries)
+        )
+        where, where_document = self.processor.build_where(**(filters or {}))
+
+        def query_shard(shard_id: str) -> Optional[Dict[str, Any]]:
+            if shard_id not in existing:
+                return None
+            shard = self.get_shard(shard_id)
+            if shard.count() == 0:
+                return None
+            return shard.query(
+                query_embeddings=query_embeddings,
+                n_results=n_results,
+                where=where,
+                where_document=where_document,
+                include=['documents', 'metadatas', 'distances']
+            )
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            shard_results = list(pool.map(query_shard, shard_ids))
+
+        merged = []
+        for i in range(len(queries)):
+            candidates = (
+                (distance, shard_index, rank)
+                for shard_index, results in enumerate(shard_results) if results is not None
+                for rank, distance in enumerate(results['distances'][i])
+            )
+            top = heapq.nsmallest(n_results, candidates)
+            merged.append({
+                'ids': [[shard_results[s]['ids'][i][r] for _, s, r in top]],
+                'documents': [[shard_results[s]['documents'][i][r] for _, s, r in top]],
+                'metadatas': [[shard_results[s]['metadatas'][i][r] for _, s, r in top]],
+                'distances': [[distance for distance, _, _ in top]],
+                'shards': [[shard_ids[s] for _, s, _ in top]]
+            })
+        return merged
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流式处理脚本
+EPUB → 章节 → 文本块 → 向量 → 索引，各阶段都是按批次的生成器，
+峰值内存与书的大小无关，前面的文本块在整本书处理完之前即可被检索
+"""
+
+import sys
+import logging
+from epub_processor import EPUBProcessor
+from vector_processor import VectorProcessor
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 流式处理的文本块边界和ID（chunk_XXXX）与 process_full_novel 不同，写入单独的集合，避免互相覆盖
+STREAM_COLLECTION_NAME = "luotuo_xiangzi_stream"
+
+def stream_epub_to_index(epub_path: str, processor: VectorProcessor,
+                         chunk_size: int = 400, overlap: int = 80,
+                         batch_size: int = 64):
+    """
+    以流式方式将EPUB文件写入向量索引
+    
+    Args:
+        epub_path: EPUB文件路径
+        processor: 已创建集合的向量处理器（应使用单独的集合，见 STREAM_COLLECTION_NAME）
+        chunk_size: 分块大小
+        overlap: 重叠字符数
+        batch_size: 每批生成向量并写入的文本块数量
+        
+    Returns:
+        处理结果统计
+    """
+    epub_processor = EPUBProcessor()
+    chapters = epub_processor.iter_chapters(epub_path)
+    chunks = epub_processor.iter_chunks(chapters, chunk_size=chunk_size, overlap=overlap)
+    return processor.ingest_stream(chunks, batch_size=batch_size)
+
+def main():
+    """主函数"""
+    epub_file = sys.argv[1] if len(sys.argv) > 1 else "骆驼祥子（作家榜经典文库）.epub"
+    
+    processor = VectorProcessor(embedding_cache_dir="./embedding_cache",
+                                collection_name=STREAM_COLLECTION_NAME)
+    processor.create_collection(reset=False)
+    
+    logger.info(f"开始流式处理: {epub_file}")
+    result = stream_epub_to_index(epub_file, processor)
+    
+    print("\n" + "="*50)
+    print("流式处理完成！")
+    print("="*50)
+    print(f"总文本块数: {result['total_chunks']}")
+    print(f"数据库中的向量数: {result['collection_count']}")
+
+if __name__ == "__main__":
+    main()
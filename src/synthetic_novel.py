@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+合成中文小说生成模块
+按固定随机种子拼句生成任意长度的中文小说（人物取自默认人物词典），
+输出与 processed_luotuoxiangzi.json 相同的结构，也可以写成EPUB文件，
+用于在离线环境下把性能测试扩展到远大于一本书的规模
+"""
+
+import random
+import logging
+from typing import List, Dict, Any, Optional
+from character_extractor import DEFAULT_CHARACTER_ALIASES
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PLACES = ["西安门大街", "人和车厂", "天桥", "海淀", "西直门", "前门", "大杂院", "茶馆",
+          "曹宅", "德胜门", "北长街", "护国寺", "毛家湾", "城外的小庙", "胡同口"]
+ACTIONS = ["拉着车跑了一整天", "蹲在墙根下歇着", "数着攒下来的铜子儿", "低着头想心事",
+           "喝了一碗热茶", "擦了擦车上的灰", "在雨里等座儿", "把钱塞进闷葫芦罐",
+           "慢慢地往回走", "跟人讲了半天价钱", "买了两个烧饼", "望着街上的行人发呆"]
+FEELINGS = ["心里很踏实", "觉得有些委屈", "憋着一肚子气", "忽然高兴起来",
+            "说不出的难受", "有点害怕", "又生出了希望", "感到浑身都是劲"]
+WEATHERS = ["天热得发了狂", "北风卷着黄沙", "雨下得正紧", "太阳刚刚落下去",
+            "街上的灯都亮了", "天还没亮", "雪下了一夜"]
+SAYINGS = ["今天的买卖不错", "你这是何苦呢", "明儿个早点来", "车是自己的才好",
+           "别跟我来这一套", "钱得省着点花", "这世道谁也靠不住"]
+
+
+class SyntheticNovelGenerator:
+    """可复现的合成小说生成器"""
+
+    def __init__(self, seed: int = 0, characters: Optional[List[str]] = None):
+        """
+        Args:
+            seed: 随机种子，相同种子生成相同的文本
+            characters: 人物名列表，默认使用默认人物词典中的标准名
+        """
+        self.random = random.Random(seed)
+        self.characters = characters or list(DEFAULT_CHARACTER_ALIASES)
+
+    def sentence(self) -> str:
+        """生成一个句子"""
+        choice = self.random.random
+        pick = self.random.choice
+        name = pick(self.characters)
+        roll = choice()
+        if roll < 0.35:
+            return f"{name}在{pick(PLACES)}{pick(ACTIONS)}，{pick(FEELINGS)}。"
+        if roll < 0.6:
+            return f"{pick(WEATHERS)}，{name}{pick(ACTIONS)}。"
+        if roll < 0.8:
+            return f"“{pick(SAYINGS)}！”{name}对{pick(self.characters)}说。"
+        if roll < 0.9:
+            return f"{name}问：“{pick(SAYINGS)}？”"
+        return f"{name}和{pick(self.characters)}在{pick(PLACES)}碰了面，谁也没有说话。"
+
+    def chapter(self, chapter_num: int, chars_per_chapter: int) -> Dict[str, Any]:
+        """生成一个章节（段落之间用换行分隔）"""
+        title = f"第{chapter_num}章 {self.random.choice(PLACES)}"
+        paragraphs, length = [], 0
+        while length < chars_per_chapter:
+            paragraph = "".join(self.sentence() for _ in range(self.random.randint(3, 8)))
+            paragraphs.append(paragraph)
+            length += len(paragraph)
+        content = title + " " + "\n".join(paragraphs)
+        return {
+            'chapter_num': chapter_num,
+            'chapter_title': title,
+            'content': content,
+            'word_count': len(content)
+        }
+
+    def novel(self, n_chapters: int = 26, chars_per_chapter: int = 5000,
+              title: str = "合成小说", author: str = "佚名") -> Dict[str, Any]:
+        """
+        生成一部小说
+
+        Args:
+            n_chapters: 章节数
+            chars_per_chapter: 每章大约的字数
+            title: 书名
+            author: 作者
+
+        Returns:
+            与 processed_luotuoxiangzi.json 结构相同的字典（book_info + chapters）
+        """
+        chapters = []
+        for chapter_num in range(1, n_chapters + 1):
+            chapter = self.chapter(chapter_num, chars_per_chapter)
+            chapter.update({
+                'file_name': f"chapter_{chapter_num:04d}.xhtml",
+                'book_title': title,
+                'book_author': author
+            })
+            chapters.append(chapter)
+
+        return {
+            'book_info': {
+                'title': title,
+                'author': author,
+                'total_chapters': n_chapters,
+                'total_chunks': n_chapters,
+                'total_words': sum(chapter['word_count'] for chapter in chapters)
+            },
+            'chapters': chapters
+        }
+
+
+def generate_novel(n_chapters: int = 26, chars_per_chapter: int = 5000, seed: int = 0,
+                   title: str = "合成小说", author: str = "佚名") -> Dict[str, Any]:
+    """生成一部合成小说（参数见 SyntheticNovelGenerator.novel）"""
+    return SyntheticNovelGenerator(seed=seed).novel(n_chapters, chars_per_chapter, title, author)
+
+
+def write_epub(novel: Dict[str, Any], epub_path: str) -> str:
+    """
+    把合成小说写成EPUB文件（每章一个XHTML文档），供EPUB解析测试使用
+
+    Args:
+        novel: generate_novel 的返回值
+        epub_path: 输出路径
+
+    Returns:
+        EPUB文件路径
+    """
+    from ebooklib import epub
+
+    book = epub.EpubBook()
+    book.set_identifier(f"synthetic-{novel['book_info']['title']}")
+    book.set_title(novel['book_info']['title'])
+    book.set_language('zh')
+    book.add_author(novel['book_info']['author'])
+
+    items = []
+    for chapter in novel['chapters']:
+        item = epub.EpubHtml(title=chapter['chapter_title'], file_name=chapter['file_name'], lang='zh')
+        paragraphs = chapter['content'].split("\n")
+        body = "".join(f"<p>{paragraph}</p>" for paragraph in paragraphs)
+        item.content = f"<html><body>{body}</body></html>"
+        book.add_item(item)
+        items.append(item)
+
+    book.toc = items
+    book.spine = items
+    book.add_item(epub.EpubNcx())
+    epub.write_epub(epub_path, book)
+    logger.info(f"已写入合成EPUB: {epub_path} ({len(items)} 章)")
+    return epub_path
@@ -2,91 +2,306 @@
 # -*- coding: utf-8 -*-
 """
 向量处理模块
-将处理后的JSON文档转换为向量并存储到Chroma向量数据库
+将处理后的JSON文档转换为向量并存储到向量索引（Chroma或NumPy精确索引）
 使用BGE 1.5 small模型 (512维向量)
+sentence_transformers和chromadb在首次使用时才导入，模型在首次编码时才加载
 """
 
 import json
 import os
+import time
+import queue
+import hashlib
 import logging
-from typing import List, Dict, Any
+import threading
+from typing import List, Dict, Any, Tuple, Optional, Union, Iterable, Iterator
 import numpy as np
-from sentence_transformers import SentenceTransformer
-import chromadb
-from chromadb.config import Settings
 import uuid
 from datetime import datetime
+from embedding_cache import EmbeddingCache
+from numpy_index import NumpyIndexClient, file_stamp
+from character_extractor import get_default_matcher
+from lexical_index import BM25Index
+from chunk_store import load_chunks
+from search_cache import SearchCache
+import metrics
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 单次写入索引的最大条数（Chroma客户端提供max_batch_size时取两者较小值）
+DEFAULT_INSERT_BATCH_SIZE = 1000
+
+# 不参与元数据指纹的字段（写入时间、指纹本身、写入时才确定的向量维度）
+VOLATILE_METADATA_KEYS = ('created_at', 'content_hash', 'metadata_hash', 'vector_dimension')
+
+def iter_batches(items: Iterable[Any], batch_size: int) -> Iterator[List[Any]]:
+    """将可迭代对象按固定大小切分为批次，不预先物化整个序列"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
 class VectorProcessor:
-    """向量处理器，专门处理BGE模型和Chroma数据库的集成"""
+    """向量处理器，专门处理BGE模型和向量索引（Chroma / NumPy）的集成"""
     
     def __init__(self, model_name: str = "BAAI/bge-small-zh-v1.5", 
-                 chroma_persist_directory: str = "./chroma_db"):
+                 chroma_persist_directory: str = "./chroma_db",
+                 embedding_cache_dir: Optional[str] = None,
+                 embedding_cache_size: int = 200000,
+                 index_backend: str = "chroma",
+                 numpy_persist_directory: str = "./numpy_index",
+                 collection_name: str = "luotuo_xiangzi_collection",
+                 quantization: Optional[str] = None,
+                 ann_index: Optional[str] = None,
+                 nprobe: int = 8,
+                 encoder: str = "torch",
+                 encoder_options: Optional[Dict[str, Any]] = None,
+                 search_cache_size: int = 1024,
+                 search_cache_path: Optional[str] = None):
         """
         初始化向量处理器
         
         Args:
             model_name: BGE模型名称
             chroma_persist_directory: Chroma数据库持久化目录
+            embedding_cache_dir: 向量缓存目录，为None时不使用缓存
+            embedding_cache_size: 向量缓存最多保存的条数
+            index_backend: 索引后端，"chroma" 或 "numpy"（内存映射的精确索引）
+            numpy_persist_directory: NumPy索引持久化目录
+            collection_name: 集合名称
+            quantization: NumPy索引的量化检索方式，"int8" 或 "binary"（粗筛后用float向量重排）
+            ann_index: NumPy索引的近似检索结构，"ivf"（k-means倒排单元）或 None
+            nprobe: IVF每个查询探查的单元数，越大召回越高、检索越慢
+            encoder: 编码器后端，"torch"（SentenceTransformer）或 "onnx"（ONNX Runtime CPU推理）
+            encoder_options: 传给 OnnxEncoder 的参数，如 quantize、intra_op_threads、onnx_dir
+            search_cache_size: 进程内缓存的检索结果数，为0时不缓存检索结果
+            search_cache_path: 检索结果缓存的磁盘层（SQLite）路径，为None时只缓存在进程内
         """
-        self.model_name = model_name
-        self.chroma_persist_directory = chroma_persist_directory
+        if index_backend not in ("chroma", "numpy"):
+            raise ValueError(f"不支持的索引后端: {index_backend}")
+        if quantization is not None and index_backend != "numpy":
+            raise ValueError("量化检索只支持numpy索引后端")
+        if ann_index is not None and index_backend != "numpy":
+            raise ValueError("IVF索引只支持numpy索引后端")
+        if encoder not in ("torch", "onnx"):
+            raise ValueError(f"不支持的编码器后端: {encoder}")
         
-        # 初始化BGE模型
-        logger.info(f"正在加载BGE模型: {model_name}")
-        self.embedding_model = SentenceTransformer(model_name)
+        # 启动耗时统计（秒）：导入依赖、加载模型、打开索引
+        self.startup_timings = {'import': 0.0, 'model_load': 0.0, 'db_open': 0.0}
+        self._lazy_lock = threading.RLock()
+        # Chroma集合版本号的缓存及读取时的文件状态（文件未变化时不重复读取）
+        self._versions: Dict[str, int] = {}
+        self._versions_stamp = None
         
-        # 获取模型向量维度
-        self.vector_dimension = self.embedding_model.get_sentence_embedding_dimension()
-        logger.info(f"模型向量维度: {self.vector_dimension}")
+        self.model_name = model_name
+        self.chroma_persist_directory = chroma_persist_directory
+        self.numpy_persist_directory = numpy_persist_directory
+        self.index_backend = index_backend
+        self.quantization = quantization
+        self.ann_index = ann_index
+        self.nprobe = nprobe
+        self.encoder = encoder
+        self.encoder_options = dict(encoder_options or {})
         
-        # 初始化Chroma客户端
-        self.chroma_client = chromadb.PersistentClient(
-            path=chroma_persist_directory,
-            settings=Settings(
-                anonymized_telemetry=False,
-                allow_reset=True
-            )
-        )
+        # BGE模型、向量缓存和索引客户端都在首次使用时创建
+        self._embedding_model = None
+        self._vector_dimension = None
+        self.embedding_cache_dir = embedding_cache_dir
+        self.embedding_cache_size = embedding_cache_size
+        self._embedding_cache = None
+        self._index_client = None
         
         # 创建或获取集合
-        self.collection_name = "luotuo_xiangzi_collection"
+        self.collection_name = collection_name
         self.collection = None
         
+        # 多线程写入同一集合时串行化写操作
+        self._write_lock = threading.Lock()
+        
+        # BM25词法索引（按需加载或构建）
+        self.lexical_index = None
+        
+        # 检索结果缓存（键中包含集合版本，写入后自动失效）
+        self.search_cache = (SearchCache(search_cache_size, db_path=search_cache_path)
+                             if search_cache_size > 0 else None)
+        
+    @property
+    def embedding_model(self):
+        """BGE模型（首次访问时导入sentence_transformers并加载模型）"""
+        if self._embedding_model is None:
+            with self._lazy_lock:
+                if self._embedding_model is None:
+                    start = time.perf_counter()
+                    if self.encoder == "onnx":
+                        from onnx_encoder import OnnxEncoder
+                    else:
+                        from sentence_transformers import SentenceTransformer
+                    self.startup_timings['import'] += time.perf_counter() - start
+                    
+                    logger.info(f"正在加载BGE模型: {self.model_name} ({self.encoder})")
+                    start = time.perf_counter()
+                    if self.encoder == "onnx":
+                        model = OnnxEncoder(self.model_name, **self.encoder_options)
+                    else:
+                        model = SentenceTransformer(self.model_name)
+                    load_seconds = time.perf_counter() - start
+                    self.startup_timings['model_load'] += load_seconds
+                    metrics.observe('rag_model_load_seconds', load_seconds, encoder=self.encoder)
+                    
+                    self._vector_dimension = model.get_sentence_embedding_dimension()
+                    logger.info(f"模型向量维度: {self._vector_dimension}")
+                    self._embedding_model = model
+        return self._embedding_model
+    
+    @property
+    def vector_dimension(self) -> int:
+        """模型向量维度（需要加载模型）"""
+        if self._vector_dimension is None:
+            self.embedding_model
+        return self._vector_dimension
+    
+    @property
+    def encoder_id(self) -> str:
+        """编码器标识：ONNX（尤其是int8量化）的输出与PyTorch有细微差别，向量缓存分开存放"""
+        if self.encoder == "onnx":
+            suffix = "-int8" if self.encoder_options.get('quantize', True) else ""
+            return f"{self.model_name}@onnx{suffix}"
+        return self.model_name
+    
+    def check_encoder_parity(self, texts: List[str], min_cosine: float = 0.99) -> Dict[str, Any]:
+        """
+        检查当前编码器与PyTorch SentenceTransformer输出的一致性
+        
+        Args:
+            texts: 检查用的文本
+            min_cosine: 每个文本的余弦相似度下限
+            
+        Returns:
+            包含最小/平均余弦相似度和是否通过的字典
+        """
+        from sentence_transformers import SentenceTransformer
+        from onnx_encoder import check_parity
+        return check_parity(self.embedding_model, SentenceTransformer(self.model_name), texts, min_cosine)
+    
+    @property
+    def embedding_cache(self) -> Optional[EmbeddingCache]:
+        """向量缓存，未配置缓存目录时为None"""
+        if self._embedding_cache is None and self.embedding_cache_dir:
+            with self._lazy_lock:
+                if self._embedding_cache is None:
+                    self._embedding_cache = EmbeddingCache(
+                        self.embedding_cache_dir, self.encoder_id, self.vector_dimension,
+                        max_entries=self.embedding_cache_size
+                    )
+        return self._embedding_cache
+    
+    @property
+    def index_client(self):
+        """索引客户端（使用Chroma时首次访问才导入chromadb）"""
+        if self._index_client is None:
+            with self._lazy_lock:
+                if self._index_client is None:
+                    if self.index_backend == "numpy":
+                        start = time.perf_counter()
+                        client = NumpyIndexClient(self.numpy_persist_directory,
+                                                  quantization=self.quantization,
+                                                  ann_index=self.ann_index, nprobe=self.nprobe)
+                    else:
+                        start = time.perf_counter()
+                        import chromadb
+                        from chromadb.config import Settings
+                        self.startup_timings['import'] += time.perf_counter() - start
+                        
+                        start = time.perf_counter()
+                        client = chromadb.PersistentClient(
+                            path=self.chroma_persist_directory,
+                            settings=Settings(
+                                anonymized_telemetry=False,
+                                allow_reset=True
+                            )
+                        )
+                    self.startup_timings['db_open'] += time.perf_counter() - start
+                    self._index_client = client
+        return self._index_client
+    
+    def startup_report(self) -> Dict[str, Any]:
+        """
+        启动耗时报告
+        
+        Returns:
+            各阶段耗时（秒）以及模型/索引是否已加载
+        """
+        report = {key: round(value, 3) for key, value in self.startup_timings.items()}
+        report['total'] = round(sum(self.startup_timings.values()), 3)
+        report['model_loaded'] = self._embedding_model is not None
+        report['index_opened'] = self._index_client is not None
+        logger.info(f"启动耗时: 导入 {report['import']:.3f}s，加载模型 {report['model_load']:.3f}s，"
+                    f"打开索引 {report['db_open']:.3f}s")
+        return report
+    
     def create_collection(self, reset: bool = False):
         """
-        创建或重置Chroma集合
+        创建或重置向量集合
         
         Args:
             reset: 是否重置现有集合
         """
         try:
-            if reset:
-                try:
-                    self.chroma_client.delete_collection(self.collection_name)
-                    logger.info(f"已删除现有集合: {self.collection_name}")
-                except:
-                    pass
-            
-            # 创建集合，指定embedding函数
-            self.collection = self.chroma_client.get_or_create_collection(
-                name=self.collection_name,
-                metadata={"description": "骆驼祥子小说文本向量集合"},
-                embedding_function=None  # 我们手动提供embeddings
+            self.collection = self.open_collection(
+                self.collection_name, reset=reset,
+                description="骆驼祥子小说文本向量集合"
             )
             
-            logger.info(f"成功创建/获取集合: {self.collection_name}")
-            
         except Exception as e:
             logger.error(f"创建集合时出错: {e}")
             raise
     
+    def open_collection(self, name: str, reset: bool = False, description: str = ""):
+        """
+        创建或获取指定名称的集合（不改变 self.collection）
+        
+        Args:
+            name: 集合名称
+            reset: 是否重置现有集合
+            description: 集合描述
+            
+        Returns:
+            集合对象
+        """
+        if reset:
+            try:
+                self.index_client.delete_collection(name)
+                logger.info(f"已删除现有集合: {name}")
+            except:
+                pass
+            self._bump_collection_version(name)
+        
+        # 创建集合，指定embedding函数
+        client = self.index_client
+        start = time.perf_counter()
+        collection = client.get_or_create_collection(
+            name=name,
+            metadata={"description": description or name},
+            embedding_function=None  # 我们手动提供embeddings
+        )
+        self.startup_timings['db_open'] += time.perf_counter() - start
+        
+        logger.info(f"成功创建/获取集合: {name}")
+        return collection
+    
+    def list_collections(self) -> List[str]:
+        """列出索引中的所有集合名称"""
+        return [getattr(collection, 'name', collection)
+                for collection in self.index_client.list_collections()]
+    
     def generate_embeddings(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
         """
-        生成文本向量
+        生成文本向量（启用缓存时只为未命中的文本调用模型）
         
         Args:
             texts: 文本列表
@@ -95,125 +310,765 @@ class VectorProcessor:
         Returns:
             向量数组 (n_texts, vector_dimension)
         """
-        logger.info(f"正在为 {len(texts)} 个文本生成向量...")
+        if self.embedding_cache is None:
+            return self._encode_batches(texts, batch_size)
+        
+        all_embeddings, found = self.embedding_cache.get_many(texts)
+        missing = np.flatnonzero(~found)
+        logger.info(f"向量缓存命中 {len(texts) - len(missing)}/{len(texts)} 个文本")
+        
+        if len(missing):
+            missing_texts = [texts[i] for i in missing]
+            new_embeddings = self._encode_batches(missing_texts, batch_size)
+            all_embeddings[missing] = new_embeddings
+            self.embedding_cache.put_many(missing_texts, new_embeddings)
+            self.embedding_cache.flush()
+        
+        return all_embeddings
+    
+    def _token_lengths(self, texts: List[str]) -> np.ndarray:
+        """计算每个文本截断后的token数（模型没有分词器时按字符数估计）"""
+        tokenizer = getattr(self.embedding_model, 'tokenizer', None)
+        max_length = getattr(self.embedding_model, 'max_seq_length', None) or 512
+        if tokenizer is None:
+            return np.minimum([len(text) + 2 for text in texts], max_length)
+        encoded = tokenizer(texts, add_special_tokens=True, truncation=True, max_length=max_length)
+        return np.array([len(ids) for ids in encoded['input_ids']], dtype=np.int64)
+    
+    def _encode_batches(self, texts: List[str], batch_size: int,
+                        max_batch_tokens: Optional[int] = None) -> np.ndarray:
+        """
+        按长度分桶批量调用BGE模型生成归一化向量
+        
+        文本按token数从长到短排序，长度相近的文本放在同一批，减少补齐的padding；
+        每批的文本数按token预算自适应（短文本的批次更大），编码后按原顺序还原
+        
+        Args:
+            texts: 文本列表
+            batch_size: 基准批大小，默认token预算为 batch_size * 256
+            max_batch_tokens: 每批补齐后的token预算（文本数 × 批内最长token数）
+        """
+        if not texts:
+            return np.zeros((0, self.vector_dimension), dtype=np.float32)
+        
+        start_time = time.perf_counter()
+        max_batch_tokens = max_batch_tokens or batch_size * 256
+        lengths = self._token_lengths(texts)
+        order = np.argsort(-lengths, kind='stable')
         
-        embeddings = []
-        for i in range(0, len(texts), batch_size):
-            batch_texts = texts[i:i + batch_size]
-            batch_embeddings = self.embedding_model.encode(
-                batch_texts,
+        all_embeddings = np.empty((len(texts), self.vector_dimension), dtype=np.float32)
+        n_batches = 0
+        padded_tokens = 0
+        i = 0
+        while i < len(order):
+            # 排序后批内第一个文本最长，按它计算这一批能容纳的文本数
+            longest = int(lengths[order[i]])
+            size = max(1, max_batch_tokens // max(longest, 1))
+            batch = order[i:i + size]
+            all_embeddings[batch] = self.embedding_model.encode(
+                [texts[j] for j in batch],
+                batch_size=len(batch),
                 normalize_embeddings=True,  # 归一化向量
-                show_progress_bar=True
+                show_progress_bar=False
             )
-            embeddings.append(batch_embeddings)
-            
-            logger.info(f"已处理 {min(i + batch_size, len(texts))}/{len(texts)} 个文本")
+            n_batches += 1
+            padded_tokens += longest * len(batch)
+            i += len(batch)
         
-        all_embeddings = np.vstack(embeddings)
-        logger.info(f"生成向量形状: {all_embeddings.shape}")
+        elapsed = time.perf_counter() - start_time
+        total_tokens = int(lengths.sum())
+        metrics.observe('rag_encode_seconds', elapsed, kind='documents')
+        metrics.inc('rag_encoded_texts', len(texts), kind='documents')
+        metrics.inc('rag_encoded_tokens', total_tokens, kind='documents')
+        logger.info(f"已为 {len(texts)} 个文本生成向量: {n_batches} 个批次，"
+                    f"{total_tokens} tokens（padding {padded_tokens - total_tokens}），"
+                    f"{total_tokens / max(elapsed, 1e-9):.0f} tokens/秒")
         
         return all_embeddings
     
-    def process_json_chunks(self, json_file_path: str) -> Dict[str, Any]:
+    def to_index_embeddings(self, embeddings: np.ndarray):
+        """转换为索引后端接受的向量格式（Chroma需要Python列表，NumPy索引直接使用数组）"""
+        if self.index_backend == "numpy":
+            return np.asarray(embeddings, dtype=np.float32)
+        return embeddings.tolist()
+    
+    def _content_hash(self, content: str) -> str:
+        """
+        计算文本块正文的指纹（正文 + 编码器），只有它变化时才需要重新生成向量
+
+        Args:
+            content: 文本块正文
+
+        Returns:
+            sha256十六进制摘要
+        """
+        raw = f"{self.encoder_id}\n{content}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _metadata_hash(metadata: Dict[str, Any]) -> str:
+        """计算元数据指纹（不含写入时间、向量维度和指纹字段）"""
+        payload = {k: v for k, v in metadata.items() if k not in VOLATILE_METADATA_KEYS}
+        raw = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _build_record(self, chunk: Dict[str, Any], index: int) -> Tuple[str, Dict[str, Any], str]:
+        """
+        将文本块转换为 (id, metadata, document) 三元组（不加载模型，向量维度在写入时填入）
+
+        Args:
+            chunk: 文本块字典
+            index: 文本块序号（缺少chunk_id时用于生成ID）
+        """
+        # 生成唯一ID
+        chunk_id = chunk.get('chunk_id', f"chunk_{index:04d}")
+
+        # 准备元数据（移除content字段，因为它会作为document存储）
+        metadata = {k: v for k, v in chunk.items() if k != 'content'}
+        metadata['vector_model'] = self.model_name
+
+        # 处理列表类型的元数据（Chroma不支持复杂类型）
+        if 'characters' in metadata and isinstance(metadata['characters'], list):
+            metadata['characters'] = ','.join(metadata['characters'])
+
+        metadata['metadata_hash'] = self._metadata_hash(metadata)
+        metadata['content_hash'] = self._content_hash(chunk['content'])
+        metadata['created_at'] = datetime.now().isoformat()
+
+        return chunk_id, metadata, chunk['content']
+
+    def _get_existing_metadatas(self) -> Dict[str, Dict[str, Any]]:
+        """读取集合中已有的 chunk_id -> 元数据 映射"""
+        existing = self.collection.get(include=['metadatas'])
+        return {
+            chunk_id: metadata or {}
+            for chunk_id, metadata in zip(existing['ids'], existing['metadatas'])
+        }
+
+    @staticmethod
+    def _diff_records(records: List[Tuple[str, Dict[str, Any], str]],
+                      existing: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        将文本块记录与集合中已有的数据比对
+
+        正文指纹相同的文本块不重新生成向量：同一ID只有元数据变化时只更新元数据，
+        正文移到了别的ID（例如前面的章节增删了文本块）时沿用已存储的向量
+
+        Returns:
+            包含 unchanged、metadata_only、reuse（记录, 来源ID）、embed、stale_ids 的字典
         """
-        处理JSON文件中的文本块
+        donors: Dict[str, str] = {}
+        for chunk_id, metadata in existing.items():
+            donors.setdefault(metadata.get('content_hash', ''), chunk_id)
+        donors.pop('', None)
+
+        diff = {'unchanged': [], 'metadata_only': [], 'reuse': [], 'embed': []}
+        for record in records:
+            chunk_id, metadata, _ = record
+            stored = existing.get(chunk_id)
+            if stored is not None and stored.get('content_hash') == metadata['content_hash']:
+                if stored.get('metadata_hash') == metadata['metadata_hash']:
+                    diff['unchanged'].append(record)
+                else:
+                    diff['metadata_only'].append(record)
+            elif metadata['content_hash'] in donors:
+                diff['reuse'].append((record, donors[metadata['content_hash']]))
+            else:
+                diff['embed'].append(record)
+
+        current_ids = {record[0] for record in records}
+        diff['stale_ids'] = [chunk_id for chunk_id in existing if chunk_id not in current_ids]
+        return diff
+
+    def _insert_batch_size(self) -> int:
+        """单次写入的最大条数，不超过索引后端的批量上限"""
+        limit = getattr(self.index_client, 'max_batch_size', None)
+        if limit is None and hasattr(self.index_client, 'get_max_batch_size'):
+            limit = self.index_client.get_max_batch_size()
+        return min(limit or DEFAULT_INSERT_BATCH_SIZE, DEFAULT_INSERT_BATCH_SIZE)
+    
+    def _write_records(self, write, records: List[Tuple[str, Dict[str, Any], str]],
+                       embeddings: np.ndarray, insert_batch_size: Optional[int] = None):
+        """
+        按批写入记录和对应的向量（元数据中填入向量维度），写入后更新集合版本
+        
+        Args:
+            write: 写入函数（collection.add / collection.upsert）
+            records: (id, metadata, document) 记录
+            embeddings: 与records对齐的向量
+            insert_batch_size: 单次写入的最大条数，默认由索引后端决定
+        """
+        insert_batch_size = insert_batch_size or self._insert_batch_size()
+        collection = getattr(write, '__self__', None)
+        dimension = int(np.shape(embeddings)[1])
+        for start in range(0, len(records), insert_batch_size):
+            part = records[start:start + insert_batch_size]
+            with self._write_lock, metrics.timer('rag_index_write_seconds',
+                                                 backend=self.index_backend):
+                write(
+                    ids=[record[0] for record in part],
+                    embeddings=self.to_index_embeddings(embeddings[start:start + len(part)]),
+                    metadatas=[dict(record[1], vector_dimension=dimension) for record in part],
+                    documents=[record[2] for record in part]
+                )
+            metrics.inc('rag_index_written_rows', len(part), backend=self.index_backend)
+            if collection is not None:
+                self._bump_collection_version(collection.name)
+    
+    def _write_pipeline(self, record_batches: Iterable[List[Tuple[str, Dict[str, Any], str]]],
+                        write, queue_size: int = 4,
+                        insert_batch_size: Optional[int] = None) -> int:
+        """
+        流水线写入：当前线程逐批生成向量，写入线程从有界队列取出后按批写入索引
+        
+        编码与写入相互重叠；队列满时编码等待写入，内存中最多有 queue_size 批尚未写入的向量
         
         Args:
-            json_file_path: JSON文件路径
+            record_batches: (id, metadata, document) 记录的批次
+            write: 写入函数（collection.add / collection.upsert）
+            queue_size: 队列中最多等待写入的批次数
+            insert_batch_size: 单次写入的最大条数，默认由索引后端决定
+            
+        Returns:
+            写入的记录数
+        """
+        insert_batch_size = insert_batch_size or self._insert_batch_size()
+        pending: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        errors: List[Exception] = []
+        
+        def writer():
+            while True:
+                item = pending.get()
+                if item is None:
+                    return
+                if errors:
+                    continue  # 已出错，只清空队列让生产者退出
+                records, embeddings = item
+                try:
+                    self._write_records(write, records, embeddings, insert_batch_size)
+                except Exception as e:
+                    errors.append(e)
+        
+        writer_thread = threading.Thread(target=writer, name="index-writer", daemon=True)
+        writer_thread.start()
+        
+        written = 0
+        try:
+            for batch_index, records in enumerate(record_batches):
+                if errors:
+                    break
+                embeddings = self.generate_embeddings([record[2] for record in records])
+                pending.put((records, embeddings))
+                written += len(records)
+                logger.info(f"第 {batch_index + 1} 批已生成向量，累计 {written} 个文本块")
+        finally:
+            pending.put(None)
+            writer_thread.join()
+        
+        if errors:
+            raise errors[0]
+        return written
+    
+    def process_json_chunks(self, json_file_path: str, incremental: bool = False,
+                            embed_batch_size: int = 256) -> Dict[str, Any]:
+        """
+        处理JSON文件（或列式文本块存储）中的文本块
+        
+        Args:
+            json_file_path: 文本块JSON文件路径，或 ChunkStore 存储目录
+            incremental: 是否增量处理。开启后按指纹与集合中已有数据比对：只为正文变化的
+                文本块生成向量，只有元数据变化的文本块只更新元数据，正文未变但ID变化的
+                文本块沿用已存储的向量，同时删除已不存在的文本块
+            embed_batch_size: 每批生成向量的文本块数（生成后交给写入线程）
             
         Returns:
             处理结果统计
         """
         try:
-            # 读取JSON文件
-            with open(json_file_path, 'r', encoding='utf-8') as f:
-                chunks_data = json.load(f)
+            # 读取文本块（JSON文件或列式存储）
+            chunks_data = load_chunks(json_file_path)
             
             logger.info(f"从 {json_file_path} 读取了 {len(chunks_data)} 个文本块")
             
-            # 提取文本内容
-            texts = [chunk['content'] for chunk in chunks_data]
+            records = [self._build_record(chunk, i) for i, chunk in enumerate(chunks_data)]
             
-            # 生成向量
-            embeddings = self.generate_embeddings(texts)
+            existing = self._get_existing_metadatas() if incremental else {}
+            diff = self._diff_records(records, existing)
+            stale_ids = diff['stale_ids']
             
-            # 准备存储到Chroma的数据
-            ids = []
-            metadatas = []
-            documents = []
-            embeddings_list = []
+            written = ([record for record, _ in diff['reuse']] + diff['metadata_only'] + diff['embed'])
+            added = sum(1 for record in written if record[0] not in existing)
+            updated = len(written) - added
+            unchanged = len(diff['unchanged'])
+            if incremental:
+                logger.info(f"增量比对: 新增 {added}，变化 {updated}，未变 {unchanged}，"
+                            f"删除 {len(stale_ids)}；需要生成向量 {len(diff['embed'])}，"
+                            f"沿用已有向量 {len(diff['reuse']) + len(diff['metadata_only'])}")
             
-            for i, (chunk, embedding) in enumerate(zip(chunks_data, embeddings)):
-                # 生成唯一ID
-                chunk_id = chunk.get('chunk_id', f"chunk_{i:04d}")
-                ids.append(chunk_id)
-                
-                # 准备元数据（移除content字段，因为它会作为document存储）
-                metadata = {k: v for k, v in chunk.items() if k != 'content'}
-                metadata['created_at'] = datetime.now().isoformat()
-                metadata['vector_model'] = self.model_name
-                metadata['vector_dimension'] = self.vector_dimension
-                
-                # 处理列表类型的元数据（Chroma不支持复杂类型）
-                if 'characters' in metadata and isinstance(metadata['characters'], list):
-                    metadata['characters'] = ','.join(metadata['characters'])
-                
-                metadatas.append(metadata)
-                documents.append(chunk['content'])
-                embeddings_list.append(embedding.tolist())
-            
-            # 存储到Chroma
-            logger.info("正在存储向量到Chroma数据库...")
-            self.collection.add(
-                ids=ids,
-                embeddings=embeddings_list,
-                metadatas=metadatas,
-                documents=documents
-            )
+            write = self.collection.upsert if incremental else self.collection.add
+            
+            if diff['reuse']:
+                # 先读出来源向量再写入，来源ID可能随后被覆盖或删除
+                donor_ids = list(dict.fromkeys(donor for _, donor in diff['reuse']))
+                stored = self.collection.get(ids=donor_ids, include=['embeddings'])
+                donor_embeddings = dict(zip(stored['ids'], stored['embeddings']))
+                reuse_records = [record for record, _ in diff['reuse']]
+                embeddings = np.array([donor_embeddings[donor] for _, donor in diff['reuse']],
+                                      dtype=np.float32)
+                self._write_records(write, reuse_records, embeddings)
+            
+            if diff['metadata_only']:
+                # 正文未变，只更新元数据（沿用已存储的向量和写入时记录的向量维度）
+                metadatas = []
+                for chunk_id, metadata, _ in diff['metadata_only']:
+                    metadata = dict(metadata)
+                    if existing[chunk_id].get('vector_dimension') is not None:
+                        metadata['vector_dimension'] = existing[chunk_id]['vector_dimension']
+                    metadatas.append(metadata)
+                with self._write_lock:
+                    self.collection.update(ids=[record[0] for record in diff['metadata_only']],
+                                           metadatas=metadatas)
+                self._bump_collection_version(self.collection.name)
+            
+            if diff['embed']:
+                # 生成向量并流水线写入向量索引
+                logger.info(f"正在生成向量并存储到{self.index_backend}索引...")
+                self._write_pipeline(iter_batches(diff['embed'], embed_batch_size), write)
+            
+            if stale_ids:
+                logger.info(f"正在删除 {len(stale_ids)} 个已不存在的文本块...")
+                self.collection.delete(ids=stale_ids)
+                self._bump_collection_version(self.collection.name)
             
             # 验证存储
             collection_count = self.collection.count()
             logger.info(f"成功存储 {collection_count} 个向量到数据库")
             
+            # 没有需要生成向量的文本块时不加载模型，向量维度取自已存储的元数据
+            vector_dimension = self._vector_dimension or next(
+                (metadata['vector_dimension'] for metadata in existing.values()
+                 if metadata.get('vector_dimension')), None)
+            
             return {
                 'total_chunks': len(chunks_data),
+                'vector_dimension': vector_dimension,
+                'collection_count': collection_count,
+                'model_name': self.model_name,
+                'added': added,
+                'updated': updated,
+                'unchanged': unchanged,
+                'deleted': len(stale_ids),
+                'embedded': len(diff['embed']),
+                'reused': len(diff['reuse']) + len(diff['metadata_only'])
+            }
+            
+        except Exception as e:
+            logger.error(f"处理JSON文件时出错: {e}")
+            raise
+    
+    def ingest_stream(self, chunks: Iterable[Dict[str, Any]], batch_size: int = 64,
+                      collection=None) -> Dict[str, Any]:
+        """
+        流式处理文本块：每攒够一批就生成向量，交给写入线程写入索引
+        
+        内存占用只与batch_size有关，与书的大小无关；
+        每批写入后即可被检索，不必等待全部处理完成
+        
+        Args:
+            chunks: 文本块可迭代对象（如 EPUBProcessor.iter_chunks 的输出）
+            batch_size: 每批文本块数量
+            collection: 写入的目标集合，默认为 self.collection
+            
+        Returns:
+            处理结果统计
+        """
+        collection = collection if collection is not None else self.collection
+        try:
+            records = (self._build_record(chunk, i) for i, chunk in enumerate(chunks))
+            total_chunks = self._write_pipeline(iter_batches(records, batch_size), collection.upsert)
+            
+            collection_count = collection.count()
+            logger.info(f"流式处理完成，数据库中共有 {collection_count} 个向量")
+            
+            return {
+                'total_chunks': total_chunks,
                 'vector_dimension': self.vector_dimension,
                 'collection_count': collection_count,
                 'model_name': self.model_name
             }
             
         except Exception as e:
-            logger.error(f"处理JSON文件时出错: {e}")
+            logger.error(f"流式处理文本块时出错: {e}")
             raise
     
-    def search_similar(self, query: str, n_results: int = 5) -> Dict[str, Any]:
+    def _versions_path(self) -> str:
+        """Chroma集合版本号的保存路径（NumPy集合的版本保存在集合自己的元数据中）"""
+        return os.path.join(self.chroma_persist_directory, 'collection_versions.json')
+    
+    def _load_versions(self) -> Dict[str, int]:
+        """读取Chroma集合版本号，只在文件被（本进程或其他进程）改写后重新读取"""
+        path = self._versions_path()
+        stamp = file_stamp(path)
+        if stamp != self._versions_stamp:
+            if stamp is None:
+                self._versions = {}
+            else:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self._versions = json.load(f)
+            self._versions_stamp = stamp
+        return self._versions
+    
+    def _bump_collection_version(self, name: str):
+        """集合写入或删除后版本加一（NumPy集合在写入时自行更新版本）"""
+        if self.index_backend == "numpy":
+            return
+        with self._lazy_lock:
+            versions = dict(self._load_versions())
+            versions[name] = versions.get(name, 0) + 1
+            os.makedirs(self.chroma_persist_directory, exist_ok=True)
+            tmp_path = self._versions_path() + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(versions, f, ensure_ascii=False)
+            os.replace(tmp_path, self._versions_path())
+            self._versions = versions
+            self._versions_stamp = file_stamp(self._versions_path())
+    
+    def collection_version(self, collection=None) -> str:
+        """
+        集合版本：集合标识 + 写入次数，任何写入或删除之后都会改变
+        
+        版本号保存在索引文件旁边（NumPy集合在meta.json中，Chroma集合在collection_versions.json中），
+        这里只比较文件状态，文件被其他进程改写后才重新读取。
+        
+        Args:
+            collection: 集合对象，默认为 self.collection
+        """
+        collection = collection if collection is not None else self.collection
+        if self.index_backend == "numpy":
+            collection.refresh()
+            return f"{collection.uid}:{collection.version}"
+        version = self._load_versions().get(collection.name, 0)
+        return f"{getattr(collection, 'id', '')}:{version}"
+    
+    def search_similar(self, query: str, n_results: int = 5,
+                       chapter_range: Optional[Union[int, Tuple[int, int]]] = None,
+                       characters: Optional[List[str]] = None) -> Dict[str, Any]:
         """
         搜索相似文本
         
         Args:
             query: 查询文本
             n_results: 返回结果数量
+            chapter_range: 章节过滤，单个章节号或闭区间 (起始章节, 结束章节)
+            characters: 人物过滤，结果必须包含列表中的所有人物
             
         Returns:
             搜索结果
         """
+        filters = {'chapter_range': chapter_range, 'characters': characters}
+        return self.search_many([query], n_results=n_results, filters=filters)[0]
+    
+    def search_many(self, queries: List[str], n_results: int = 5,
+                    batch_size: int = 64,
+                    filters: Optional[Union[Dict[str, Any], List[Dict[str, Any]]]] = None
+                    ) -> List[Dict[str, Any]]:
+        """
+        批量搜索相似文本：一次批量编码所有查询，过滤条件相同的查询合并为一次检索
+        
+        Args:
+            queries: 查询文本列表
+            n_results: 每个查询返回的结果数量
+            batch_size: 查询编码的批处理大小
+            filters: 过滤条件（键为chapter_range/characters，含义同search_similar），
+                可以是作用于所有查询的一个字典，也可以是与queries对齐的字典列表
+            
+        Returns:
+            与queries一一对应的搜索结果列表，每项与search_similar的返回格式相同
+        """
+        if not queries:
+            return []
+        
+        if filters is None or isinstance(filters, dict):
+            filters = [filters or {}] * len(queries)
+        
         try:
-            # 生成查询向量
-            query_embedding = self.embedding_model.encode([query], normalize_embeddings=True)
-            
-            # 搜索
-            results = self.collection.query(
-                query_embeddings=query_embedding.tolist(),
-                n_results=n_results,
-                include=['documents', 'metadatas', 'distances']
-            )
+            # 先查检索结果缓存，只为未命中的查询编码和检索
+            all_results: List[Dict[str, Any]] = [None] * len(queries)
+            cache_keys = None
+            if self.search_cache is not None:
+                version = self.collection_version()
+                self.search_cache.observe_version(self.collection.name, version)
+                cache_keys = [
+                    SearchCache.make_key(self.collection.name, version, self.encoder_id,
+                                         query, n_results, query_filter)
+                    for query, query_filter in zip(queries, filters)
+                ]
+                all_results = self.search_cache.get_many(cache_keys)
+            pending = [i for i, result in enumerate(all_results) if result is None]
+            if not pending:
+                return all_results
             
-            return results
+            # 批量生成查询向量
+            query_embeddings = self.encode_queries([queries[i] for i in pending], batch_size=batch_size)
+            
+            # 按过滤条件分组，每组一次检索
+            groups: Dict[str, List[int]] = {}
+            for position, i in enumerate(pending):
+                key = json.dumps(filters[i] or {}, sort_keys=True, ensure_ascii=False)
+                groups.setdefault(key, []).append(position)
+            
+            for positions in groups.values():
+                where, where_document = self.build_where(**(filters[pending[positions[0]]] or {}))
+                with metrics.timer('rag_index_query_seconds', backend=self.index_backend):
+                    results = self.collection.query(
+                        query_embeddings=self.to_index_embeddings(query_embeddings[positions]),
+                        n_results=n_results,
+                        where=where,
+                        where_document=where_document,
+                        include=['documents', 'metadatas', 'distances']
+                    )
+                metrics.inc('rag_index_queries', len(positions), backend=self.index_backend)
+                for position, result in zip(positions, self.split_results(results, len(positions))):
+                    all_results[pending[position]] = result
+            
+            if cache_keys is not None:
+                self.search_cache.put_many([(cache_keys[i], all_results[i]) for i in pending],
+                                           self.collection.name, version)
+            return all_results
             
         except Exception as e:
             logger.error(f"搜索时出错: {e}")
             raise
     
+    def _lexical_index_path(self) -> str:
+        """BM25索引的保存路径（不含扩展名），与向量索引放在同一目录"""
+        index_dir = (self.numpy_persist_directory if self.index_backend == "numpy"
+                     else self.chroma_persist_directory)
+        return os.path.join(index_dir, f"{self.collection_name}_bm25")
+    
+    def build_lexical_index(self) -> BM25Index:
+        """从当前集合的全部文档构建BM25索引并保存（记录构建时的集合版本）"""
+        version = self.collection_version()
+        data = self.collection.get(include=['documents'])
+        self.lexical_index = BM25Index.build(data['ids'], data['documents'], source_version=version)
+        self.lexical_index.save(self._lexical_index_path())
+        return self.lexical_index
+    
+    def get_lexical_index(self) -> BM25Index:
+        """获取BM25索引：优先使用内存或磁盘上的索引，构建后集合有过写入或删除（版本不同）时重建"""
+        version = self.collection_version()
+        if self.lexical_index is not None and self.lexical_index.source_version == version:
+            return self.lexical_index
+        
+        path = self._lexical_index_path()
+        if os.path.exists(path + '.npz'):
+            self.lexical_index = BM25Index.load(path)
+            if self.lexical_index.source_version == version:
+                return self.lexical_index
+        
+        logger.info("BM25索引不存在或已过期，正在重建...")
+        return self.build_lexical_index()
+    
+    def search_hybrid(self, query: str, n_results: int = 5, alpha: float = 0.5,
+                      candidate_pool: int = 50, narrow: bool = False) -> Dict[str, Any]:
+        """
+        BM25 + 向量混合检索
+        
+        Args:
+            query: 查询文本
+            n_results: 返回结果数量
+            alpha: 向量分数权重，0表示只用BM25（不编码查询），1表示只用向量分数
+            candidate_pool: 每路召回的候选数量
+            narrow: 为True时向量分数只在BM25候选集上计算，不做全库向量检索
+            
+        Returns:
+            与search_similar相同格式的结果；distances为 1 - 融合分数，另附 'scores' 字段
+        """
+        try:
+            lexical = self.get_lexical_index()
+            lexical_rows, lexical_scores = lexical.search(query, n_results=candidate_pool)
+            lexical_hits = {lexical.ids[row]: float(score)
+                            for row, score in zip(lexical_rows, lexical_scores)}
+            
+            dense_hits: Dict[str, float] = {}
+            if alpha > 0:
+                query_embedding = self.encode_queries([query])[0]
+                if not narrow:
+                    results = self.collection.query(
+                        query_embeddings=self.to_index_embeddings(query_embedding[None, :]),
+                        n_results=candidate_pool,
+                        include=['distances']
+                    )
+                    # 归一化向量的平方L2距离换算为余弦相似度
+                    for chunk_id, distance in zip(results['ids'][0], results['distances'][0]):
+                        dense_hits[chunk_id] = 1.0 - distance / 2.0
+                
+                missing = [chunk_id for chunk_id in lexical_hits if chunk_id not in dense_hits]
+                if missing:
+                    stored = self.collection.get(ids=missing, include=['embeddings'])
+                    for chunk_id, embedding in zip(stored['ids'], stored['embeddings']):
+                        dense_hits[chunk_id] = float(np.dot(query_embedding, np.asarray(embedding)))
+            
+            candidates = list(dict.fromkeys(list(lexical_hits) + list(dense_hits)))
+            if not candidates:
+                return {'ids': [[]], 'documents': [[]], 'metadatas': [[]],
+                        'distances': [[]], 'scores': [[]]}
+            
+            # 两路分数分别做min-max归一化后加权融合
+            def normalize(hits: Dict[str, float]) -> np.ndarray:
+                values = np.array([hits.get(chunk_id, 0.0) for chunk_id in candidates])
+                low, high = values.min(), values.max()
+                return (values - low) / (high - low) if high > low else np.zeros_like(values)
+            
+            fused = alpha * normalize(dense_hits) + (1 - alpha) * normalize(lexical_hits)
+            top = np.argsort(-fused, kind='stable')[:n_results]
+            
+            stored = self.collection.get(ids=[candidates[i] for i in top],
+                                         include=['documents', 'metadatas'])
+            by_id = {chunk_id: (document, metadata) for chunk_id, document, metadata
+                     in zip(stored['ids'], stored['documents'], stored['metadatas'])}
+            # 检索期间集合可能被其他进程改写，跳过已不在集合中的文本块
+            top = [i for i in top if candidates[i] in by_id]
+            top_ids = [candidates[i] for i in top]
+            
+            return {
+                'ids': [top_ids],
+                'documents': [[by_id[chunk_id][0] for chunk_id in top_ids]],
+                'metadatas': [[by_id[chunk_id][1] for chunk_id in top_ids]],
+                'distances': [[float(1.0 - fused[i]) for i in top]],
+                'scores': [[float(fused[i]) for i in top]]
+            }
+            
+        except Exception as e:
+            logger.error(f"混合检索时出错: {e}")
+            raise
+    
+    @metrics.timed('rag_encode_seconds', kind='queries')
+    def encode_queries(self, queries: List[str], batch_size: int = 64) -> np.ndarray:
+        """
+        批量生成归一化的查询向量
+        
+        Args:
+            queries: 查询文本列表
+            batch_size: 批处理大小
+            
+        Returns:
+            向量数组 (n_queries, vector_dimension)
+        """
+        return self.embedding_model.encode(
+            queries,
+            batch_size=batch_size,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        )
+    
+    def build_where(self, chapter_range: Optional[Union[int, Tuple[int, int]]] = None,
+                    characters: Optional[List[str]] = None
+                    ) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """
+        将结构化过滤条件转换为索引端的 where / where_document 条件
+        
+        人物名（含别名）先归并为标准名：NumPy索引按 characters 元数据过滤，走人物倒排表；
+        Chroma的元数据条件不支持子串匹配，按文档内容匹配标准名及其别名
+        
+        Returns:
+            (元数据条件, 文档内容条件)，无条件时为None
+        """
+        clauses = []
+        if isinstance(chapter_range, int):
+            clauses.append({'chapter_num': chapter_range})
+        elif chapter_range is not None:
+            start, end = chapter_range
+            clauses.append({'chapter_num': {'$gte': start}})
+            clauses.append({'chapter_num': {'$lte': end}})
+        
+        where_document = None
+        if characters:
+            matcher = get_default_matcher()
+            names = list(dict.fromkeys(matcher.patterns.get(name, name) for name in characters))
+            if self.index_backend == "numpy":
+                clauses.extend({'characters': {'$contains': name}} for name in names)
+            else:
+                # 人物列表由名字（含别名）在文本中的出现确定，因此按文档内容过滤与人物字段等价
+                document_clauses = []
+                for name in names:
+                    aliases = matcher.aliases_of(name)
+                    if len(aliases) == 1:
+                        document_clauses.append({'$contains': aliases[0]})
+                    else:
+                        document_clauses.append({'$or': [{'$contains': alias} for alias in aliases]})
+                where_document = (document_clauses[0] if len(document_clauses) == 1
+                                  else {'$and': document_clauses})
+        
+        where = None
+        if clauses:
+            where = clauses[0] if len(clauses) == 1 else {'$and': clauses}
+        return where, where_document
+    
+    @staticmethod
+    def split_results(results: Dict[str, Any], n_queries: int) -> List[Dict[str, Any]]:
+        """将批量检索结果拆分为单查询格式（每个字段是只含一个元素的列表）"""
+        keys = ('ids', 'documents', 'metadatas', 'distances', 'embeddings')
+        split = []
+        for i in range(n_queries):
+            split.append({
+                key: [results[key][i]] if results.get(key) is not None else None
+                for key in keys
+            })
+        return split
+    
+    def evaluate_quantization_recall(self, queries: List[str], k: int = 10) -> Dict[str, Any]:
+        """
+        评估量化检索相对float32精确检索的召回率
+        
+        Args:
+            queries: 评估用的查询文本
+            k: top-k
+            
+        Returns:
+            包含recall@k、每个向量字节数和压缩比的字典
+        """
+        quantized = getattr(self.collection, 'quantized', None)
+        if quantized is None:
+            raise ValueError("当前集合未启用量化检索")
+        
+        recall = quantized.recall_at_k(self.encode_queries(queries), k=k)
+        report = {
+            'quantization': self.quantization,
+            f'recall@{k}': recall,
+            'bytes_per_vector': quantized.bytes_per_vector(),
+            'compression_ratio': quantized.compression_ratio()
+        }
+        logger.info(f"量化检索评估: {report}")
+        return report
+    
+    def evaluate_ivf_recall(self, queries: List[str], k: int = 10,
+                            nprobe: Optional[int] = None) -> Dict[str, Any]:
+        """
+        评估IVF检索相对精确检索的召回率
+        
+        Args:
+            queries: 评估用的查询文本
+            k: top-k
+            nprobe: 探查的单元数，默认使用构造时的设置
+            
+        Returns:
+            包含recall@k、单元数和nprobe的字典
+        """
+        ivf = getattr(self.collection, 'ivf', None)
+        if ivf is None:
+            raise ValueError("当前集合未启用IVF索引（或向量数过少）")
+        
+        nprobe = nprobe or self.nprobe
+        report = {
+            'ann_index': self.ann_index,
+            f'recall@{k}': ivf.recall_at_k(self.encode_queries(queries), k=k, nprobe=nprobe),
+            'n_lists': ivf.n_lists,
+            'nprobe': nprobe
+        }
+        logger.info(f"IVF检索评估: {report}")
+        return report
+    
     def get_collection_stats(self) -> Dict[str, Any]:
         """获取集合统计信息"""
         try:
@@ -222,14 +1077,35 @@ class VectorProcessor:
             # 获取一个样本来检查数据结构
             sample = self.collection.peek(limit=1)
             
+            # 模型尚未加载时从已存储的元数据读取向量维度，不为统计信息加载模型
+            vector_dimension = self._vector_dimension
+            if vector_dimension is None and sample['metadatas']:
+                vector_dimension = sample['metadatas'][0].get('vector_dimension')
+            
             stats = {
                 'collection_name': self.collection_name,
                 'total_documents': count,
-                'vector_dimension': self.vector_dimension,
+                'vector_dimension': vector_dimension,
                 'model_name': self.model_name,
-                'chroma_persist_directory': self.chroma_persist_directory
+                'encoder': self.encoder,
+                'chroma_persist_directory': self.chroma_persist_directory,
+                'index_backend': self.index_backend,
+                'persist_directory': (self.numpy_persist_directory if self.index_backend == "numpy"
+                                      else self.chroma_persist_directory)
             }
             
+            if self._embedding_cache is not None:
+                stats['embedding_cache'] = self._embedding_cache.stats()
+            if self.search_cache is not None:
+                stats['search_cache'] = self.search_cache.stats()
+            
+            if self.quantization is not None:
+                stats['quantization'] = self.quantization
+            
+            if self.ann_index is not None:
+                stats['ann_index'] = self.ann_index
+                stats['nprobe'] = self.nprobe
+            
             if sample['metadatas']:
                 stats['sample_metadata_keys'] = list(sample['metadatas'][0].keys())
             
@@ -121,6 +121,9 @@ def test_vector_database():
             print(f"   - 文档数量: {count}")
             print(f"   - 集合名称: {processor.collection_name}")
             print(f"   - 模型名称: {processor.model_name}")
+            report = processor.startup_report()
+            print(f"   - 启动耗时: 导入 {report['import']:.2f}s，加载模型 {report['model_load']:.2f}s，"
+                  f"打开数据库 {report['db_open']:.2f}s（仅读取元数据时不加载模型）")
 
             if count > 0:
                 print("✅ 向量数据库包含数据")
@@ -210,6 +213,1330 @@ def test_api_connection():
         print(f"❌ API连接测试失败: {e}")
         return False
 
+def start_stub_llm_server():
+    """启动本地的OpenAI兼容桩服务，返回 (server, 统计信息)"""
+    import json
+    import time
+    import threading
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    stats = {'requests': 0, 'active': 0, 'max_active': 0, 'bodies': []}
+    lock = threading.Lock()
+
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            with lock:
+                stats['requests'] += 1
+                stats['bodies'].append(body)
+                stats['active'] += 1
+                stats['max_active'] = max(stats['max_active'], stats['active'])
+                n = stats['requests']
+            time.sleep(0.02)
+            with lock:
+                stats['active'] -= 1
+
+            payload = json.dumps({
+                'id': f'stub-{n}',
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': body['model'],
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': f'桩服务回复{n}'},
+                    'finish_reason': 'stop'
+                }],
+                'usage': {'prompt_tokens': 1, 'completion_tokens': 1, 'total_tokens': 2}
+            }).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, stats
+
+def test_map_reduce_analysis():
+    """测试并发map-reduce分析（使用本地桩服务，不调用真实API）"""
+    print("\n🗺️ 测试map-reduce分析...")
+
+    try:
+        import asyncio
+        from openai import AsyncOpenAI
+        from analyze_xiangzi_actions import map_reduce_analysis_async
+    except ImportError as e:
+        print(f"⚠️ 缺少依赖，跳过map-reduce测试: {e}")
+        return False
+
+    server, stats = start_stub_llm_server()
+    try:
+        client = AsyncOpenAI(base_url=f"http://127.0.0.1:{server.server_port}/v1", api_key="stub")
+        actions = [
+            {'chapter_num': i, 'chapter_title': f'第{i}章', 'context': f'祥子在第{i}章拉车'}
+            for i in range(1, 21)
+        ]
+        answer = asyncio.run(map_reduce_analysis_async(actions, client=client, max_concurrency=4, fan_in=4))
+
+        # 20个章节概括 + 第一层合并5次 + 第二层合并2次 + 最终分析1次
+        expected_requests = 20 + 5 + 2 + 1
+        if not answer or stats['requests'] != expected_requests:
+            print(f"❌ 请求次数不符: 期望 {expected_requests}，实际 {stats['requests']}")
+            return False
+        if stats['max_active'] > 4:
+            print(f"❌ 并发数超过上限: {stats['max_active']}")
+            return False
+
+        print(f"✅ map-reduce分析正常")
+        print(f"   - 请求次数: {stats['requests']}")
+        print(f"   - 最大并发: {stats['max_active']}")
+        return True
+
+    except Exception as e:
+        print(f"❌ map-reduce分析测试失败: {e}")
+        return False
+    finally:
+        server.shutdown()
+
+def test_llm_cache_namespace():
+    """测试响应缓存：相同请求发往不同服务地址时不共用缓存，未设置的采样参数不发送"""
+    print("\n🗃️ 测试响应缓存...")
+
+    import tempfile
+    try:
+        from openai import OpenAI
+        from llm_cache import LLMCache
+    except ImportError as e:
+        print(f"⚠️ 缺少依赖，跳过响应缓存测试: {e}")
+        return False
+
+    server, stats = start_stub_llm_server()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = LLMCache(os.path.join(tmp, "llm_cache.sqlite"))
+            base = f"http://127.0.0.1:{server.server_port}"
+            clients = [OpenAI(base_url=f"{base}/provider-a/v1", api_key="stub"),
+                       OpenAI(base_url=f"{base}/provider-b/v1", api_key="stub")]
+            request = {'model': 'same-model', 'messages': [{'role': 'user', 'content': '祥子是谁'}]}
+
+            answers = [cache.complete(client.chat.completions.create, **request) for client in clients]
+            repeated = cache.complete(clients[0].chat.completions.create, **request)
+            if stats['requests'] != 2 or answers[0] == answers[1] or repeated != answers[0]:
+                print(f"❌ 缓存命名空间不正确: 请求 {stats['requests']} 次，回复 {answers + [repeated]}")
+                return False
+
+            # 未设置的采样参数不出现在请求中；设置了的照常发送，并且参与缓存键
+            tuned = cache.complete(clients[0].chat.completions.create, temperature=0.2, **request)
+            cache.close()
+
+        sent = [{key: body.get(key) for key in ('temperature', 'max_tokens') if key in body}
+                for body in stats['bodies']]
+        if sent != [{}, {}, {'temperature': 0.2}] or tuned == answers[0]:
+            print(f"❌ 请求中的采样参数不正确: {sent}")
+            return False
+    finally:
+        server.shutdown()
+
+    print("✅ 响应缓存按服务地址区分，未设置的采样参数不发送")
+    return True
+
+def test_onnx_parity_marker():
+    """测试ONNX模型的一致性检查标记：模型文件变化或下限提高后需要重新检查"""
+    print("\n🔏 测试ONNX一致性标记...")
+
+    import tempfile
+    from onnx_encoder import parity_verified, write_parity_marker
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = os.path.join(tmp, "model_int8.onnx")
+        with open(model_path, 'wb') as f:
+            f.write(b"onnx" * 100)
+        if parity_verified(model_path, 0.99):
+            print("❌ 没有标记的模型不应视为已检查")
+            return False
+
+        write_parity_marker(model_path, {'min_cosine': 0.995, 'passed': True})
+        checks = [parity_verified(model_path, 0.99), not parity_verified(model_path, 0.999)]
+        with open(model_path, 'ab') as f:
+            f.write(b"changed")
+        checks.append(not parity_verified(model_path, 0.99))
+        if not all(checks):
+            print(f"❌ 一致性标记判断不正确: {checks}")
+            return False
+
+    print("✅ ONNX一致性标记正常")
+    return True
+
+def test_chunker_overlap():
+    """测试偏移量分块：相邻文本块按要求重叠，偏移量与文本一致"""
+    print("\n✂️ 测试文本分块...")
+
+    try:
+        from chunker import OffsetChunker, sentence_boundaries
+    except ImportError as e:
+        print(f"❌ chunker 导入失败: {e}")
+        return False
+
+    sentence = "祥子拉着车在街上跑了一整天，心里盘算着买车的钱。"
+    text = sentence * 60
+    chapters = [{'content': text}, {'content': "  虎妞说：“你回来了？”" + sentence * 30 + "  "}]
+
+    for chunk_size, overlap in ((400, 80), (200, 0), (300, 150)):
+        chunker = OffsetChunker(chunk_size=chunk_size, overlap=overlap, min_chars=0)
+        index = chunker.chunk_chapters(chapters)
+        previous = None
+        for chapter_index, start, end in index:
+            content = chapters[chapter_index]['content']
+            if content[start:end] != content[start:end].strip() or end - start > chunk_size:
+                print(f"❌ 文本块偏移量不正确: {(chapter_index, start, end)}")
+                return False
+            if previous and previous[0] == chapter_index:
+                if previous[2] - start != overlap:
+                    print(f"❌ 重叠长度不符: 期望 {overlap}，实际 {previous[2] - start}")
+                    return False
+            previous = (chapter_index, start, end)
+
+        # 每一章的最后一个文本块必须覆盖到章节末尾
+        for chapter_index, chapter in enumerate(chapters):
+            last_end = max(end for c, _, end in index if c == chapter_index)
+            if last_end != len(chapter['content'].rstrip()):
+                print(f"❌ 第{chapter_index}章末尾未被覆盖")
+                return False
+
+    # 非末尾的文本块在句子边界处结束（句末引号归入前一句）
+    boundaries = set(sentence_boundaries(chapters[1]['content']).tolist())
+    index = OffsetChunker(chunk_size=120, overlap=20, min_chars=0).chunk_chapters(chapters[1:])
+    if not all(end in boundaries for _, _, end in list(index)[:-1]):
+        print("❌ 文本块没有在句子边界处断开")
+        return False
+
+    # 重叠超过一半时拒绝；重叠为一半时块数仍与 文本长度 / (chunk_size - overlap) 同一量级
+    try:
+        OffsetChunker(chunk_size=300, overlap=151)
+        print("❌ 重叠超过 chunk_size 一半的配置应被拒绝")
+        return False
+    except ValueError:
+        pass
+    spans = OffsetChunker(chunk_size=300, overlap=150, min_chars=0).chunk_text(text)
+    if len(spans) > 2 * len(text) // (300 - 150) + 1:
+        print(f"❌ 文本块过多: {len(spans)} 个（文本 {len(text)} 字符）")
+        return False
+
+    print(f"✅ 文本分块正常")
+    print(f"   - 重叠设置 80/0/150 字符均被保留")
+    return True
+
+class StubEncoder:
+    """确定性的桩编码器（按文本哈希生成归一化向量），记录编码过的文本数，测试时不加载真实模型"""
+
+    def __init__(self, dimension=32):
+        self.dimension = dimension
+        self.encoded = 0
+
+    def get_sentence_embedding_dimension(self):
+        return self.dimension
+
+    def encode(self, texts, batch_size=32, normalize_embeddings=True, show_progress_bar=False):
+        import hashlib
+        import numpy as np
+        self.encoded += len(texts)
+        vectors = np.stack([
+            np.random.default_rng(int(hashlib.sha256(text.encode('utf-8')).hexdigest()[:16], 16))
+            .standard_normal(self.dimension)
+            for text in texts
+        ]).astype(np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def make_stub_processor(index_dir, **kwargs):
+    """创建使用NumPy索引和桩编码器的向量处理器"""
+    from vector_processor import VectorProcessor
+    processor = VectorProcessor(index_backend="numpy", numpy_persist_directory=index_dir,
+                                collection_name="test_collection", **kwargs)
+    processor._embedding_model = StubEncoder()
+    processor._vector_dimension = processor._embedding_model.dimension
+    processor.create_collection(reset=False)
+    return processor
+
+def make_test_chunks(chapters):
+    """按 章节 -> 正文列表 生成文本块（ID为章节号 + 章内序号）"""
+    return [
+        {'chunk_id': f"chunk_{chapter_num:03d}_{ordinal:03d}", 'chapter_num': chapter_num,
+         'characters': ['祥子'], 'content': content}
+        for chapter_num, contents in enumerate(chapters, 1)
+        for ordinal, content in enumerate(contents, 1)
+    ]
+
+def test_incremental_ingest():
+    """测试增量入库：未变、修改、插入、删除的文本块分别只做必要的工作"""
+    print("\n🔁 测试增量入库...")
+
+    import json
+    import tempfile
+    try:
+        from vector_processor import VectorProcessor
+    except ImportError as e:
+        print(f"❌ vector_processor 导入失败: {e}")
+        return False
+
+    chapters = [[f"第{c}章第{i}段，祥子拉着车。" for i in range(1, 4)] for c in range(1, 4)]
+    with tempfile.TemporaryDirectory() as tmp:
+        chunks_file = os.path.join(tmp, "chunks.json")
+        index_dir = os.path.join(tmp, "index")
+
+        def ingest(chunks, processor=None):
+            with open(chunks_file, 'w', encoding='utf-8') as f:
+                json.dump(chunks, f, ensure_ascii=False)
+            processor = processor or make_stub_processor(index_dir)
+            return processor, processor.process_json_chunks(chunks_file, incremental=True)
+
+        steps = []
+        processor, result = ingest(make_test_chunks(chapters))
+        steps.append(("首次入库", result, {'added': 9, 'embedded': 9}))
+
+        # 未变：新的处理器不加载模型
+        fresh = VectorProcessor(index_backend="numpy", numpy_persist_directory=index_dir,
+                                collection_name="test_collection")
+        fresh.create_collection(reset=False)
+        _, result = ingest(make_test_chunks(chapters), fresh)
+        if fresh._embedding_model is not None:
+            print("❌ 没有变化时不应加载模型")
+            return False
+        steps.append(("未变", result, {'unchanged': 9, 'embedded': 0, 'vector_dimension': 32}))
+
+        chapters[1][1] = "第2章第2段被改写了，虎妞来了。"
+        _, result = ingest(make_test_chunks(chapters))
+        steps.append(("修改", result, {'updated': 1, 'unchanged': 8, 'embedded': 1}))
+
+        # 在第1章开头插入一段：第1章其余文本块的ID后移，沿用已有向量，其他章节不受影响
+        chapters[0].insert(0, "新加的开头，祥子进了城。")
+        _, result = ingest(make_test_chunks(chapters))
+        steps.append(("插入", result, {'added': 1, 'updated': 3, 'unchanged': 6,
+                                       'embedded': 1, 'reused': 3}))
+
+        del chapters[2][2]
+        _, result = ingest(make_test_chunks(chapters))
+        steps.append(("删除", result, {'deleted': 1, 'unchanged': 9, 'embedded': 0}))
+
+        chunks = make_test_chunks(chapters)
+        chunks[0]['characters'] = ['祥子', '刘四爷']
+        processor, result = ingest(chunks)
+        steps.append(("只改元数据", result, {'updated': 1, 'embedded': 0, 'reused': 1}))
+
+        for name, result, expected in steps:
+            actual = {key: result[key] for key in expected}
+            if actual != expected:
+                print(f"❌ {name}: 期望 {expected}，实际 {actual}")
+                return False
+
+        stored = processor.collection.get(ids=['chunk_001_001', 'chunk_002_002'])
+        if (stored['documents'][1] != chapters[1][1]
+                or stored['metadatas'][0]['characters'] != '祥子,刘四爷'
+                or processor.collection.count() != 9):
+            print("❌ 集合内容与文本块不一致")
+            return False
+
+    print("✅ 增量入库正常")
+    print("   - 未变/修改/插入/删除/只改元数据均只为正文变化的文本块生成向量")
+    return True
+
+def test_character_filter():
+    """测试人物过滤：别名归并为标准名，NumPy索引按人物倒排表过滤而不是逐行匹配正文"""
+    print("\n👥 测试人物过滤...")
+
+    import tempfile
+    from process_full_novel import extract_characters_simple
+
+    contents = ["虎姑娘在车厂里等着。", "祥子拉车回来了。", "虎妞和祥子吵了一架。",
+                "刘四爷在院子里喝茶。", "骆驼祥子又上街了。", "小福子来找虎妞。"]
+    chunks = [{'chunk_id': f"chunk_001_{i:03d}", 'chapter_num': 1 + i % 2,
+               'characters': extract_characters_simple(content), 'content': content}
+              for i, content in enumerate(contents, 1)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        processor = make_stub_processor(tmp)
+        processor.ingest_stream(chunks)
+
+        where, where_document = processor.build_where(characters=['虎姑娘'])
+        if where != {'characters': {'$contains': '虎妞'}} or where_document is not None:
+            print(f"❌ 过滤条件不正确: {where}, {where_document}")
+            return False
+
+        # 不应回退到逐行扫描正文
+        collection = processor.collection
+        collection._documents = [None] * collection.count()
+
+        expected = {
+            ('虎妞',): {'chunk_001_001', 'chunk_001_003', 'chunk_001_006'},
+            ('祥子', '虎妞'): {'chunk_001_003'},
+            ('骆驼祥子',): {'chunk_001_002', 'chunk_001_003', 'chunk_001_005'}
+        }
+        for names, ids in expected.items():
+            result = processor.search_similar("车厂", n_results=10, characters=list(names))
+            if set(result['ids'][0]) != ids:
+                print(f"❌ 人物 {names} 的过滤结果不正确: {result['ids'][0]}")
+                return False
+
+        result = processor.search_similar("车厂", n_results=10, chapter_range=1, characters=['虎妞'])
+        if set(result['ids'][0]) != {'chunk_001_006'}:
+            print(f"❌ 章节 + 人物过滤结果不正确: {result['ids'][0]}")
+            return False
+
+    print("✅ 人物过滤正常")
+    print("   - 别名归并为标准名，按人物倒排表过滤")
+    return True
+
+def test_query_during_ingest():
+    """测试流式入库的同时检索：向量文件扩容期间的检索不出错"""
+    print("\n🌊 测试入库时检索...")
+
+    import tempfile
+    import threading
+
+    chunks = [{'chunk_id': f"chunk_{i:04d}", 'chapter_num': 1 + i // 100,
+               'characters': ['祥子'], 'content': f"祥子拉车的第{i}段路。"}
+              for i in range(3000)]
+    errors = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        processor = make_stub_processor(tmp, search_cache_size=0)
+        done = threading.Event()
+
+        def search_loop():
+            while not done.is_set():
+                try:
+                    result = processor.search_similar("祥子拉车", n_results=5)
+                    if any(document is None for document in result['documents'][0]):
+                        errors.append("检索结果缺少文档")
+                except Exception as e:
+                    errors.append(repr(e))
+
+        searcher = threading.Thread(target=search_loop)
+        searcher.start()
+        try:
+            result = processor.ingest_stream(chunks, batch_size=64)
+        finally:
+            done.set()
+            searcher.join()
+
+    if errors or result['collection_count'] != len(chunks):
+        print(f"❌ 入库时检索出错: {errors[:3]}")
+        return False
+
+    print("✅ 入库时检索正常")
+    print(f"   - 写入 {len(chunks)} 个文本块，期间检索未出错")
+    return True
+
+def test_search_cache_invalidation():
+    """测试检索结果缓存：重复检索命中缓存，其他进程写入集合后缓存失效，磁盘层跨实例命中"""
+    print("\n🗃️ 测试检索结果缓存...")
+
+    import json
+    import tempfile
+
+    query = "祥子拉着车"
+    with tempfile.TemporaryDirectory() as tmp:
+        index_dir = os.path.join(tmp, "index")
+        cache_path = os.path.join(tmp, "search_cache.db")
+        chunks_file = os.path.join(tmp, "chunks.json")
+        with open(chunks_file, 'w', encoding='utf-8') as f:
+            json.dump(make_test_chunks([[f"第{c}章第{i}段。" for i in range(1, 4)] for c in range(1, 3)]),
+                      f, ensure_ascii=False)
+
+        processor = make_stub_processor(index_dir, search_cache_path=cache_path)
+        processor.process_json_chunks(chunks_file)
+        before = processor.search_similar(query, n_results=3)
+        processor.search_similar(query, n_results=3)
+        if processor.search_cache.stats()['hits'] != 1:
+            print("❌ 重复检索没有命中缓存")
+            return False
+
+        # 另一个集合对象写入同一目录（相当于另一个进程入库），写入的向量与查询完全相同
+        writer = make_stub_processor(index_dir, search_cache_size=0)
+        embedding = writer._embedding_model.encode([query], normalize_embeddings=True)
+        writer.collection.upsert(ids=['chunk_new'], embeddings=embedding,
+                                 metadatas=[{'chapter_num': 3}], documents=["新写入的文本块"])
+
+        after = processor.search_similar(query, n_results=3)
+        if after['ids'][0][0] != 'chunk_new' or after == before:
+            print(f"❌ 写入之后仍返回旧的缓存结果: {after['ids'][0]}")
+            return False
+
+        other = make_stub_processor(index_dir, search_cache_path=cache_path)
+        if other.search_similar(query, n_results=3) != after or other.search_cache.stats()['disk_hits'] != 1:
+            print("❌ 新实例没有命中磁盘缓存")
+            return False
+
+    print("✅ 检索结果缓存正常")
+    print("   - 其他进程写入集合后缓存的结果失效，版本号从集合目录读取")
+    return True
+
+def test_lexical_index():
+    """测试BM25索引：打分与公式一致，集合内容变化（文档数不变）后索引重建"""
+    print("\n🔤 测试BM25索引...")
+
+    import json
+    import math
+    import tempfile
+    from lexical_index import BM25Index, tokenize
+
+    texts = ["祥子拉着车在街上跑", "虎妞在车厂里等祥子", "刘四爷坐在车厂门口", "天下着大雨"]
+    index = BM25Index.build([f"doc_{i}" for i in range(len(texts))], texts)
+    rows, scores = index.search("祥子", n_results=10)
+    if sorted(rows.tolist()) != [0, 1]:
+        print(f"❌ 检索结果应只包含含有'祥子'的文档: {rows.tolist()}")
+        return False
+
+    # 按BM25公式计算第一篇文档的分数
+    lengths = [len(tokenize(text)) for text in texts]
+    average = sum(lengths) / len(lengths)
+    tf = tokenize(texts[0]).count("祥子")
+    idf = math.log(1 + (len(texts) - 2 + 0.5) / (2 + 0.5))
+    expected = idf * tf * (index.k1 + 1) / (tf + index.k1 * (1 - index.b + index.b * lengths[0] / average))
+    if abs(float(scores[rows.tolist().index(0)]) - expected) > 1e-4:
+        print(f"❌ BM25分数不正确: {scores.tolist()} (期望 {expected:.4f})")
+        return False
+
+    with tempfile.TemporaryDirectory() as tmp:
+        chunks_file = os.path.join(tmp, "chunks.json")
+        chapters = [["祥子拉着车。", "虎妞在车厂。"], ["刘四爷生气了。", "下起了大雨。"]]
+
+        def ingest(processor):
+            with open(chunks_file, 'w', encoding='utf-8') as f:
+                json.dump(make_test_chunks(chapters), f, ensure_ascii=False)
+            processor.process_json_chunks(chunks_file, incremental=True)
+
+        processor = make_stub_processor(tmp)
+        ingest(processor)
+        processor.search_hybrid("骆驼", alpha=0)
+
+        # 改写一段正文，文档数不变：新实例从磁盘加载旧索引后应发现版本不同并重建
+        chapters[1][1] = "祥子买了一匹骆驼。"
+        ingest(make_stub_processor(tmp))
+        result = make_stub_processor(tmp).search_hybrid("骆驼", n_results=2, alpha=0)
+        if result['ids'][0] != ['chunk_002_002']:
+            print(f"❌ 正文修改后BM25索引没有重建: {result['ids'][0]}")
+            return False
+
+        # 索引中残留已删除的ID时跳过，而不是抛出KeyError
+        processor.lexical_index = BM25Index.build(
+            ['chunk_deleted', 'chunk_002_002'], ["骆驼", "祥子买了一匹骆驼。"],
+            source_version=processor.collection_version())
+        result = processor.search_hybrid("骆驼", n_results=2, alpha=0.5)
+        if result['ids'][0] != ['chunk_002_002'] or len(result['documents'][0]) != 1:
+            print(f"❌ 没有跳过已删除的文本块: {result['ids'][0]}")
+            return False
+
+    print("✅ BM25索引正常")
+    print("   - 分数与公式一致，集合版本变化后重建，已删除的文本块被跳过")
+    return True
+
+def test_shard_assignment():
+    """测试分片分配：集合名称合法，编号分片按数值顺序续写，检索不创建分片集合"""
+    print("\n🧩 测试分片分配...")
+
+    import json
+    import tempfile
+    from vector_processor import VectorProcessor
+    from shard_router import ShardRouter, COLLECTION_NAME_PATTERN
+
+    with tempfile.TemporaryDirectory() as tmp:
+        processor = VectorProcessor(index_backend="numpy", numpy_persist_directory=tmp)
+        router = ShardRouter(processor)
+        for book_id in ["laoshe-xiangzi", "book_", "-book", "a", "骆驼祥子", "x" * 80]:
+            name = f"{router.shard_prefix}{router.assign_shard(book_id)}"
+            if not COLLECTION_NAME_PATTERN.fullmatch(name):
+                print(f"❌ 集合名称不合法: {name}")
+                return False
+
+        manifest_path = os.path.join(tmp, "grouped_manifest.json")
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump({'b1': '0009', 'b2': '0009', 'b3': '10'}, f)
+        router = ShardRouter(processor, books_per_shard=2, manifest_path=manifest_path)
+        assigned = [router.assign_shard(book_id) for book_id in ("b4", "b5")]
+        if assigned != ['10', '0011']:
+            print(f"❌ 分片编号不正确: {assigned}")
+            return False
+
+        # 检索不创建集合：未知的分片报错，已分配但尚未写入的分片没有结果
+        processor = make_stub_processor(os.path.join(tmp, "library"))
+        router = ShardRouter(processor)
+        router.add_book("book-a", make_test_chunks([["祥子拉着车。", "虎妞来了。"]]))
+        router.assign_shard("book-b")
+        collections = processor.list_collections()
+        try:
+            router.search("祥子", shards=["book-a", "book-typo"])
+        except ValueError:
+            pass
+        else:
+            print("❌ 未知的分片ID没有报错")
+            return False
+        result = router.search("祥子", n_results=5, shards=["book-a", "book-b"])
+        if processor.list_collections() != collections or result['shards'][0] != ["book-a"] * 2:
+            print(f"❌ 检索时创建了分片集合: {processor.list_collections()}")
+            return False
+
+    print("✅ 分片分配正常")
+    return True
+
+def test_ivf_growth():
+    """测试IVF索引：库增长后重新打开集合时单元数随之增加，召回率和扫描量与精确检索对比"""
+    print("\n🧭 测试IVF索引增长...")
+
+    import time
+    import tempfile
+    import numpy as np
+    from numpy_index import NumpyCollection
+    from ivf_index import default_n_lists
+
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((200, 16))
+
+    def sample(n):
+        vectors = centers[rng.integers(0, len(centers), n)] + 0.3 * rng.standard_normal((n, 16))
+        return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "ivf")
+        collection = NumpyCollection(path, "ivf", ann_index="ivf", nprobe=16)
+        collection.upsert([f"a{i}" for i in range(4096)], sample(4096))
+        initial_lists = collection.ivf.n_lists
+
+        # 另一个集合对象（相当于之后的一次运行）写入大量新向量
+        grown = NumpyCollection(path, "ivf", ann_index="ivf", nprobe=16)
+        grown.upsert([f"b{i}" for i in range(12000)], sample(12000))
+
+        collection = NumpyCollection(path, "ivf", ann_index="ivf", nprobe=16)
+        ivf = collection.ivf
+        size = collection.count()
+        if ivf.n_lists != default_n_lists(size) or ivf.n_lists <= initial_lists:
+            print(f"❌ 单元数未随库增长: {initial_lists} -> {ivf.n_lists}（期望 {default_n_lists(size)}）")
+            return False
+
+        queries = sample(50)
+        recall = ivf.recall_at_k(queries, k=10)
+        probes = np.argsort(-(queries @ ivf.centroids.T), axis=1)[:, :ivf.nprobe]
+        scanned = float(ivf.cell_sizes[probes].sum(axis=1).mean()) / size
+
+        start = time.perf_counter()
+        approx = collection.query(queries, n_results=10, include=[])
+        ivf_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        exact_rows, _ = collection._exact_search(queries, 10, None)
+        exact_seconds = time.perf_counter() - start
+        exact_ids = [[collection._ids[row] for row in rows] for rows in exact_rows]
+        overlap = np.mean([len(set(a) & set(e)) / 10 for a, e in zip(approx['ids'], exact_ids)])
+
+        if recall < 0.9 or overlap < 0.9 or scanned > 2 * ivf.nprobe / ivf.n_lists:
+            print(f"❌ IVF检索质量不符: recall@10={recall:.3f}，扫描比例 {scanned:.3f}")
+            return False
+
+    print("✅ IVF索引增长正常")
+    print(f"   - 单元数 {initial_lists} -> {ivf.n_lists}，recall@10={recall:.3f}，"
+          f"每个查询扫描 {scanned:.1%} 的向量")
+    print(f"   - 50个查询耗时: IVF {ivf_seconds * 1000:.1f}ms，精确检索 {exact_seconds * 1000:.1f}ms")
+    return True
+
+def test_embedding_cache():
+    """测试向量缓存：重新打开缓存后相同文本（空白不同也算）不再调用模型，超出容量时淘汰，修改容量时保留"""
+    print("\n💾 测试向量缓存...")
+
+    import tempfile
+    import numpy as np
+
+    texts = [f"祥子拉着车跑了第{i}趟。" for i in range(20)]
+    with tempfile.TemporaryDirectory() as tmp:
+        cache_dir = os.path.join(tmp, "embedding_cache")
+        first = make_stub_processor(tmp, embedding_cache_dir=cache_dir)
+        expected = first.generate_embeddings(texts)
+
+        second = make_stub_processor(tmp, embedding_cache_dir=cache_dir)
+        cached = second.generate_embeddings([f"  {text}\n" for text in texts])
+        if second._embedding_model.encoded != 0 or not np.allclose(cached, expected):
+            print(f"❌ 缓存命中时仍调用了模型（{second._embedding_model.encoded} 个文本）")
+            return False
+
+        small = make_stub_processor(tmp, embedding_cache_dir=os.path.join(tmp, "small"),
+                                    embedding_cache_size=8)
+        small.generate_embeddings(texts[:8])
+        small.generate_embeddings(texts[:2])
+        small.generate_embeddings(texts[8:12])
+        _, found = small.embedding_cache.get_many(texts[:12])
+        stats = small.embedding_cache.stats()
+        if stats['evictions'] != 4 or not (found[:2].all() and found[8:].all()) or found.sum() != 8:
+            print(f"❌ 缓存容量或淘汰数不正确: {stats}")
+            return False
+
+        # 修改容量不丢弃已缓存的向量；容量变小时保留最近使用的条目
+        larger = make_stub_processor(tmp, embedding_cache_dir=cache_dir, embedding_cache_size=50)
+        if not np.allclose(larger.generate_embeddings(texts), expected) or larger._embedding_model.encoded:
+            print("❌ 扩大容量后已缓存的向量丢失")
+            return False
+        larger.embedding_cache.get_many(texts[15:])
+        larger.embedding_cache.flush()
+        smaller = make_stub_processor(tmp, embedding_cache_dir=cache_dir, embedding_cache_size=5)
+        cached, found = smaller.embedding_cache.get_many(texts)
+        if (smaller.embedding_cache.capacity != 5 or found.tolist() != [False] * 15 + [True] * 5
+                or not np.allclose(cached[15:], expected[15:])):
+            print(f"❌ 缩小容量后保留的条目不正确: {found.tolist()}")
+            return False
+
+    print("✅ 向量缓存正常")
+    print(f"   - 重新打开后 {len(texts)} 个文本全部命中，容量不足时淘汰最近最少使用的条目，修改容量时保留已缓存的向量")
+    return True
+
+def test_search_many():
+    """测试批量检索：结果与逐条search_similar一致，所有查询只编码一次"""
+    print("\n🔎 测试批量检索...")
+
+    import json
+    import tempfile
+
+    chapters = [[f"第{c}章第{i}段，祥子拉着车。" for i in range(1, 6)] for c in range(1, 5)]
+    queries = ["祥子拉车", "第2章", "虎妞", "下雨天"]
+    filters = [{}, {'chapter_range': 2}, {'chapter_range': (3, 4)}, {}]
+    with tempfile.TemporaryDirectory() as tmp:
+        chunks_file = os.path.join(tmp, "chunks.json")
+        with open(chunks_file, 'w', encoding='utf-8') as f:
+            json.dump(make_test_chunks(chapters), f, ensure_ascii=False)
+        processor = make_stub_processor(tmp, search_cache_size=0)
+        processor.process_json_chunks(chunks_file)
+
+        encoded = processor._embedding_model.encoded
+        batched = processor.search_many(queries, n_results=3, filters=filters)
+        if processor._embedding_model.encoded - encoded != len(queries):
+            print("❌ 批量检索重复编码了查询")
+            return False
+
+        for query, query_filter, result in zip(queries, filters, batched):
+            single = processor.search_similar(query, n_results=3, **query_filter)
+            if result['ids'] != single['ids'] or result['documents'] != single['documents']:
+                print(f"❌ 查询 '{query}' 的批量结果与逐条检索不一致")
+                return False
+            chapter_range = query_filter.get('chapter_range')
+            if isinstance(chapter_range, int):
+                chapter_range = (chapter_range, chapter_range)
+            if chapter_range and any(not chapter_range[0] <= metadata['chapter_num'] <= chapter_range[1]
+                                     for metadata in result['metadatas'][0]):
+                print(f"❌ 查询 '{query}' 的结果不满足章节过滤")
+                return False
+
+        if processor.search_many([]) != []:
+            print("❌ 空查询列表应返回空列表")
+            return False
+
+    print("✅ 批量检索正常")
+    print(f"   - {len(queries)} 个查询（不同过滤条件）一次编码，结果与逐条检索一致")
+    return True
+
+def test_numpy_index():
+    """测试NumPy索引：精确检索与暴力计算一致，删除后压缩，重新打开后内容不变"""
+    print("\n🧮 测试NumPy索引...")
+
+    import tempfile
+    import numpy as np
+    from numpy_index import NumpyIndexClient
+
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((500, 24)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    queries = vectors[:5] + 0.1 * rng.standard_normal((5, 24)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    ids = [f"v{i:03d}" for i in range(len(vectors))]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        client = NumpyIndexClient(tmp)
+        collection = client.get_or_create_collection("vectors")
+        # 分两批写入，第二批触发向量文件扩容
+        for start, end in ((0, 100), (100, 500)):
+            collection.add(ids=ids[start:end], embeddings=vectors[start:end],
+                           metadatas=[{'row': i} for i in range(start, end)],
+                           documents=[f"doc {i}" for i in range(start, end)])
+        collection.add(ids=ids[:3], embeddings=vectors[:3])
+
+        def brute_force(keep):
+            scores = queries @ vectors[keep].T
+            return [[ids[keep[j]] for j in np.argsort(-row, kind='stable')[:10]] for row in scores]
+
+        results = collection.query(query_embeddings=queries, n_results=10)
+        if collection.count() != 500 or results['ids'] != brute_force(np.arange(500)):
+            print("❌ 精确检索结果与暴力计算不一致")
+            return False
+        expected = 2 - 2 * float(queries[0] @ vectors[int(results['ids'][0][0][1:])])
+        if abs(results['distances'][0][0] - expected) > 1e-5:
+            print("❌ 距离不是平方L2距离")
+            return False
+
+        deleted = ids[:250:2]
+        collection.delete(ids=deleted)
+        keep = np.array([i for i in range(500) if ids[i] not in set(deleted)])
+        reopened = NumpyIndexClient(tmp).get_or_create_collection("vectors")
+        results = reopened.query(query_embeddings=queries, n_results=10)
+        stored = reopened.get(ids=['v001', 'v000'])
+        if (reopened.count() != len(keep) or results['ids'] != brute_force(keep)
+                or stored['ids'] != ['v001'] or stored['metadatas'] != [{'row': 1}]):
+            print("❌ 删除或重新打开后集合内容不正确")
+            return False
+        if client.list_collections() != ["vectors"]:
+            print("❌ 集合列表不正确")
+            return False
+
+    print("✅ NumPy索引正常")
+    print("   - 检索结果与暴力计算一致，删除和重新打开后保持一致")
+    return True
+
+def test_filter_pushdown():
+    """测试过滤下推：章节区间、人物和其他字段的过滤结果与逐行判断一致，只在候选行中检索"""
+    print("\n🎯 测试过滤下推...")
+
+    import tempfile
+    import numpy as np
+    from numpy_index import NumpyIndexClient
+
+    rng = np.random.default_rng(1)
+    names = ['祥子', '虎妞', '刘四爷', '小福子']
+    n_rows = 400
+    vectors = rng.standard_normal((n_rows, 16)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    metadatas = [{'chapter_num': 1 + i % 24, 'length': i % 7,
+                  'characters': ','.join(name for j, name in enumerate(names) if (i >> j) & 1)}
+                 for i in range(n_rows)]
+    query = vectors[:1]
+
+    def matches(metadata, where):
+        if '$and' in where:
+            return all(matches(metadata, clause) for clause in where['$and'])
+        if '$or' in where:
+            return any(matches(metadata, clause) for clause in where['$or'])
+        field, condition = next(iter(where.items()))
+        value = metadata[field]
+        op, operand = next(iter(condition.items())) if isinstance(condition, dict) else ('$eq', condition)
+        return {'$eq': lambda: value == operand, '$gte': lambda: value >= operand,
+                '$lte': lambda: value <= operand, '$in': lambda: value in operand,
+                '$contains': lambda: operand in value.split(',')}[op]()
+
+    wheres = [
+        {'chapter_num': 3},
+        {'$and': [{'chapter_num': {'$gte': 5}}, {'chapter_num': {'$lte': 9}}]},
+        {'$and': [{'characters': {'$contains': '虎妞'}}, {'characters': {'$contains': '祥子'}}]},
+        {'$or': [{'chapter_num': {'$in': [1, 24]}}, {'length': {'$gte': 6}}]},
+        {'$and': [{'chapter_num': {'$lte': 12}}, {'characters': {'$contains': '小福子'}}, {'length': 2}]},
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        collection = NumpyIndexClient(tmp).get_or_create_collection("filtered")
+        collection.add(ids=[f"r{i:03d}" for i in range(n_rows)], embeddings=vectors, metadatas=metadatas)
+
+        for where in wheres:
+            expected = np.array([i for i in range(n_rows) if matches(metadatas[i], where)])
+            rows = collection.filter_rows(where=where)
+            if rows.tolist() != expected.tolist():
+                print(f"❌ 过滤结果与逐行判断不一致: {where}")
+                return False
+            results = collection.query(query_embeddings=query, n_results=10, where=where)
+            scores = vectors[expected] @ query[0]
+            top = [f"r{expected[j]:03d}" for j in np.argsort(-scores, kind='stable')[:10]]
+            if results['ids'][0] != top:
+                print(f"❌ 过滤后的检索结果不正确: {where}")
+                return False
+
+        # 正文与人物元数据不一致时：where_document 只看正文，where 的人物条件只看元数据
+        mixed = NumpyIndexClient(tmp).get_or_create_collection("mixed")
+        mixed.add(ids=['m0', 'm1', 'm2'], embeddings=vectors[:3],
+                  metadatas=[{'characters': '虎妞'}, {'characters': ''}, {'characters': '祥子'}],
+                  documents=["虎姑娘来了", "虎妞来了", "祥子和虎妞"])
+        by_document = mixed.filter_rows(where_document={'$contains': '虎妞'}).tolist()
+        by_metadata = mixed.filter_rows(where={'characters': {'$contains': '虎妞'}}).tolist()
+        combined = mixed.filter_rows(where_document={'$or': [{'$contains': '虎姑娘'},
+                                                             {'$contains': '祥子'}]}).tolist()
+        if by_document != [1, 2] or by_metadata != [0] or combined != [0, 2]:
+            print(f"❌ 正文过滤使用了人物元数据: {by_document}, {by_metadata}, {combined}")
+            return False
+
+    print("✅ 过滤下推正常")
+    print(f"   - {len(wheres)} 种过滤条件的候选行和检索结果与逐行判断一致，正文过滤只匹配正文")
+    return True
+
+def test_library_ingest():
+    """测试多书并行处理：每本书的文本块ID带书籍前缀并全部入库，单本书解析失败不影响其他书"""
+    print("\n📚 测试多书并行处理...")
+
+    import tempfile
+    try:
+        from ebooklib import epub
+        from library_ingest import ingest_library
+    except ImportError as e:
+        print(f"❌ library_ingest 导入失败: {e}")
+        return False
+
+    def write_book(path, title, n_chapters):
+        book = epub.EpubBook()
+        book.set_identifier(title)
+        book.set_title(title)
+        book.set_language('zh')
+        book.add_author('测试作者')
+        items = []
+        for c in range(1, n_chapters + 1):
+            item = epub.EpubHtml(title=f"第{c}章", file_name=f"chapter_{c}.xhtml", lang='zh')
+            paragraphs = ''.join(f"<p>第{c}章第{i}段，祥子拉着车穿过北平的街道，天气很热。</p>"
+                                 for i in range(30))
+            item.content = f"<html><body><h1>第{c}章</h1>{paragraphs}</body></html>"
+            book.add_item(item)
+            items.append(item)
+        book.toc = items
+        book.add_item(epub.EpubNcx())
+        book.add_item(epub.EpubNav())
+        book.spine = items
+        epub.write_epub(path, book)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = [os.path.join(tmp, "book_a.epub"), os.path.join(tmp, "book_b.epub"),
+                 os.path.join(tmp, "broken.epub")]
+        write_book(paths[0], "书甲", 2)
+        write_book(paths[1], "书乙", 3)
+        with open(paths[2], 'wb') as f:
+            f.write(b"not an epub")
+
+        processor = make_stub_processor(os.path.join(tmp, "index"), search_cache_size=0)
+        reports = ingest_library(paths, processor, parse_workers=2, embed_workers=2, batch_size=16)
+
+        statuses = [(report['book_id'], report['status']) for report in reports]
+        if statuses != [('book_a', 'ok'), ('book_b', 'ok'), ('broken', 'failed')]:
+            print(f"❌ 处理状态不正确: {statuses}")
+            return False
+        if reports[2].get('stage') != 'parse':
+            print("❌ 损坏的文件应在解析阶段失败")
+            return False
+
+        stored = processor.collection.get(include=['metadatas'])
+        prefixes = sorted({chunk_id.split('/')[0] for chunk_id in stored['ids']})
+        total = reports[0]['total_chunks'] + reports[1]['total_chunks']
+        if processor.collection.count() != total or prefixes != ['book_a', 'book_b']:
+            print(f"❌ 入库的文本块不正确: {processor.collection.count()} / {total}, {prefixes}")
+            return False
+
+    print("✅ 多书并行处理正常")
+    print(f"   - 2 本书共 {total} 个文本块入库，损坏的文件单独报告失败")
+    return True
+
+def test_quantized_search():
+    """测试量化检索：int8和二值编码粗筛 + float重排的recall@10与精确检索对比，过滤条件生效"""
+    print("\n🗜️ 测试量化检索...")
+
+    import tempfile
+    import numpy as np
+    from numpy_index import NumpyCollection
+
+    rng = np.random.default_rng(2)
+    centers = rng.standard_normal((100, 64))
+    vectors = centers[rng.integers(0, len(centers), 5000)] + 0.5 * rng.standard_normal((5000, 64))
+    vectors = (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+    queries = vectors[rng.choice(len(vectors), 50, replace=False)] + 0.05 * rng.standard_normal((50, 64))
+    queries = (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+    ids = [f"q{i:04d}" for i in range(len(vectors))]
+    metadatas = [{'chapter_num': 1 + i % 10} for i in range(len(vectors))]
+
+    exact = np.argsort(-(queries @ vectors.T), axis=1, kind='stable')[:, :10]
+    exact_ids = [[ids[row] for row in rows] for rows in exact]
+    report = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode, min_recall, min_ratio in (("int8", 0.95, 3.5), ("binary", 0.85, 30)):
+            collection = NumpyCollection(os.path.join(tmp, mode), mode, quantization=mode)
+            collection.upsert(ids, vectors, metadatas=metadatas)
+            results = collection.query(queries, n_results=10, include=['metadatas', 'distances'])
+            recall = np.mean([len(set(a) & set(e)) / 10 for a, e in zip(results['ids'], exact_ids)])
+            ratio = collection.quantized.compression_ratio()
+            if recall < min_recall or ratio < min_ratio:
+                print(f"❌ {mode}: recall@10={recall:.3f}，压缩 {ratio:.1f}x")
+                return False
+            # 返回的距离是float向量重排后的精确距离
+            top = int(results['ids'][0][0][1:])
+            if abs(results['distances'][0][0] - (2 - 2 * float(queries[0] @ vectors[top]))) > 1e-5:
+                print(f"❌ {mode}: 返回的距离不是重排后的精确距离")
+                return False
+
+            filtered = collection.query(queries[:5], n_results=10, where={'chapter_num': 3})
+            if any(metadata['chapter_num'] != 3 for row in filtered['metadatas'] for metadata in row):
+                print(f"❌ {mode}: 过滤条件没有生效")
+                return False
+            report.append(f"{mode} recall@10={recall:.3f}（压缩 {ratio:.1f}x）")
+
+    print("✅ 量化检索正常")
+    print(f"   - {'，'.join(report)}")
+    return True
+
+def test_context_packer():
+    """测试上下文组装：跨查询去重，相邻重叠的文本块还原为原文，token预算内优先保留高相似度"""
+    print("\n🧷 测试上下文组装...")
+
+    from context_packer import collect_hits, pack_passages, format_context, estimate_tokens
+
+    text = ''.join(f"祥子第{i}次拉车出门，" for i in range(40))
+    spans = [(0, 60), (50, 110), (100, 160), (200, 260)]
+
+    def results(items):
+        return {
+            'ids': [[f"c{start}" for start, _, _ in items]],
+            'documents': [[text[start:end] for start, end, _ in items]],
+            'metadatas': [[{'chapter_num': 2, 'chapter_title': '第二章',
+                            'start_position': start, 'end_position': end} for start, end, _ in items]],
+            'distances': [[1 - similarity for _, _, similarity in items]]
+        }
+
+    first = results([(0, 60, 0.9), (50, 110, 0.6), (200, 260, 0.5)])
+    second = results([(50, 110, 0.8), (100, 160, 0.7), (0, 60, 0.2)])
+    extra = {'ids': [['x1']], 'documents': [['第一章的内容']], 'metadatas': [[{'chapter_num': 1}]],
+             'distances': [[0.6]]}
+    hits = collect_hits([first, second, extra], min_similarity=0.3)
+    similarity = {hit['chunk_id']: round(hit['similarity'], 3) for hit in hits}
+    if similarity != {'c0': 0.9, 'c50': 0.8, 'c100': 0.7, 'c200': 0.5, 'x1': 0.4}:
+        print(f"❌ 去重后的相似度不正确: {similarity}")
+        return False
+
+    passages = pack_passages(hits, token_budget=10000)
+    if ([passage['text'] for passage in passages]
+            != ['第一章的内容', text[0:160], text[200:260]]
+            or passages[1]['chunk_ids'] != ['c0', 'c50', 'c100'] or passages[1]['similarity'] != 0.9):
+        print("❌ 相邻重叠的文本块没有正确合并")
+        return False
+
+    # 预算只够两个文本块：保留相似度最高的c0和c50
+    budget = estimate_tokens(text[0:60]) + estimate_tokens(text[50:110])
+    passages = pack_passages(hits, token_budget=budget)
+    if [passage['chunk_ids'] for passage in passages] != [['c0', 'c50']] or passages[0]['text'] != text[0:110]:
+        print(f"❌ 预算内选择的文本块不正确: {[passage['chunk_ids'] for passage in passages]}")
+        return False
+    if sum(passage['tokens'] for passage in passages) > budget:
+        print("❌ 段落超出token预算")
+        return False
+
+    context = format_context(pack_passages(hits))
+    if context.count("=== 第2章: 第二章 ===") != 1 or context.index("第1章") > context.index("第2章"):
+        print("❌ 上下文的章节标题或顺序不正确")
+        return False
+
+    print("✅ 上下文组装正常")
+    print("   - 重复的文本块只保留一次，重叠部分不重复输出，超出预算时保留相似度高的文本块")
+    return True
+
+def test_retrieval_server():
+    """测试常驻检索服务：并发请求合并为微批次，结果与直接检索一致"""
+    print("\n🛰️ 测试常驻检索服务...")
+
+    import json
+    import tempfile
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from retrieval_server import serve, RetrievalClient
+
+    chapters = [[f"第{c}章第{i}段，祥子拉着车。" for i in range(1, 6)] for c in range(1, 5)]
+    cases = [(f"查询{i}", 1 + i % 5, (1 + i % 4, 4) if i % 3 else None) for i in range(24)]
+    with tempfile.TemporaryDirectory() as tmp:
+        chunks_file = os.path.join(tmp, "chunks.json")
+        with open(chunks_file, 'w', encoding='utf-8') as f:
+            json.dump(make_test_chunks(chapters), f, ensure_ascii=False)
+        processor = make_stub_processor(tmp, search_cache_size=0)
+        processor.process_json_chunks(chunks_file)
+
+        server = serve(processor, port=0, max_batch_size=8, max_wait_ms=50)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            client = RetrievalClient(f"http://127.0.0.1:{server.server_address[1]}")
+            with ThreadPoolExecutor(max_workers=len(cases)) as pool:
+                served = list(pool.map(
+                    lambda case: client.search_similar(case[0], n_results=case[1], chapter_range=case[2]),
+                    cases))
+            metrics = client.metrics()
+
+            # 同一批次中一个请求的过滤条件不合法，只有它失败
+            bad = server.batcher.submit("查询", filters={'book': 'xiangzi'})
+            good = server.batcher.submit("祥子拉车", n_results=2, filters={'chapter_range': [2, 3]})
+            good_result = good.result(timeout=10)
+            bad_error = bad.exception(timeout=10)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        for (query, n_results, chapter_range), result in zip(cases, served):
+            direct = processor.search_similar(query, n_results=n_results, chapter_range=chapter_range)
+            if result['ids'] != direct['ids'] or result['documents'] != direct['documents']:
+                print(f"❌ 查询 '{query}' 的服务结果与直接检索不一致")
+                return False
+
+        if bad_error is None or good_result['ids'] != processor.search_similar(
+                "祥子拉车", n_results=2, chapter_range=(2, 3))['ids']:
+            print(f"❌ 批次中一个查询出错时影响了其他查询: {bad_error!r}")
+            return False
+
+    if metrics['total_queries'] != len(cases) or metrics['total_batches'] >= len(cases):
+        print(f"❌ 并发查询没有合并为批次: {metrics}")
+        return False
+
+    print("✅ 常驻检索服务正常")
+    print(f"   - {metrics['total_queries']} 个并发查询合并为 {metrics['total_batches']} 个批次，"
+          f"p50 {metrics['latency_ms_p50']}ms")
+    return True
+
+def test_length_bucketing():
+    """测试按长度分桶编码：每批补齐后的token数不超过预算，编码结果按原顺序还原"""
+    print("\n📏 测试按长度分桶编码...")
+
+    import tempfile
+    import numpy as np
+
+    class RecordingEncoder(StubEncoder):
+        """记录每批文本的桩编码器"""
+
+        def __init__(self):
+            super().__init__()
+            self.batches = []
+
+        def encode(self, texts, **kwargs):
+            self.batches.append(list(texts))
+            return super().encode(texts, **kwargs)
+
+    rng = np.random.default_rng(3)
+    texts = ["祥" * int(length) for length in rng.integers(1, 120, 200)]
+    texts = [f"{i}{text}" for i, text in enumerate(texts)]
+    with tempfile.TemporaryDirectory() as tmp:
+        processor = make_stub_processor(tmp)
+        encoder = RecordingEncoder()
+        processor._embedding_model = encoder
+        budget = 512
+        embeddings = processor._encode_batches(texts, batch_size=32, max_batch_tokens=budget)
+
+    if not np.allclose(embeddings, StubEncoder().encode(texts)):
+        print("❌ 分桶编码的结果没有按原顺序还原")
+        return False
+    lengths = [[len(text) + 2 for text in batch] for batch in encoder.batches]
+    if sorted(text for batch in encoder.batches for text in batch) != sorted(texts):
+        print("❌ 分桶后有文本被遗漏或重复编码")
+        return False
+    if any(len(batch) > 1 and len(batch) * max(batch) > budget for batch in lengths):
+        print("❌ 批次补齐后的token数超出预算")
+        return False
+    flat = [length for batch in lengths for length in batch]
+    if flat != sorted(flat, reverse=True):
+        print("❌ 文本没有按长度从长到短分批")
+        return False
+    padding = sum(len(batch) * max(batch) - sum(batch) for batch in lengths)
+
+    print("✅ 按长度分桶编码正常")
+    print(f"   - {len(texts)} 个文本分为 {len(lengths)} 批，padding {padding} tokens")
+    return True
+
+def test_write_pipeline():
+    """测试流水线写入：全部记录按批写入，队列有界，写入出错时停止编码并抛出错误"""
+    print("\n🚚 测试流水线写入...")
+
+    import time
+    import tempfile
+    from vector_processor import iter_batches
+
+    chunks = [{'chunk_id': f"chunk_{i:04d}", 'chapter_num': 1 + i // 50, 'characters': ['祥子'],
+               'content': f"祥子拉车的第{i}段路。"} for i in range(300)]
+    with tempfile.TemporaryDirectory() as tmp:
+        processor = make_stub_processor(tmp)
+        collection = processor.collection
+        records = [processor._build_record(chunk, i) for i, chunk in enumerate(chunks)]
+
+        written_sizes = []
+        backlog = []
+
+        def slow_write(**kwargs):
+            # 写入慢于编码：编码领先写入的文本数受队列长度限制
+            time.sleep(0.005)
+            backlog.append(processor._embedding_model.encoded - sum(written_sizes))
+            written_sizes.append(len(kwargs['ids']))
+            collection.upsert(**kwargs)
+
+        total = processor._write_pipeline(iter_batches(records, 20), slow_write,
+                                          queue_size=2, insert_batch_size=7)
+        stored = collection.get(ids=['chunk_0299'], include=['metadatas'])
+        if total != len(chunks) or collection.count() != len(chunks) or max(written_sizes) > 7:
+            print(f"❌ 写入的记录数不正确: {total}, {collection.count()}")
+            return False
+        if stored['metadatas'][0]['vector_dimension'] != 32:
+            print("❌ 写入的元数据缺少向量维度")
+            return False
+        # 队列中2批 + 写入线程手上1批 + 编码线程刚完成的1批
+        if max(backlog) > 4 * 20:
+            print(f"❌ 编码领先写入过多: {max(backlog)} 个文本")
+            return False
+
+        def failing_write(**kwargs):
+            raise RuntimeError("磁盘已满")
+
+        processor._embedding_model.encoded = 0
+        try:
+            processor._write_pipeline(iter_batches(records, 20), failing_write, queue_size=1)
+        except RuntimeError as e:
+            if str(e) != "磁盘已满":
+                raise
+        else:
+            print("❌ 写入错误没有抛出")
+            return False
+        if processor._embedding_model.encoded >= len(chunks):
+            print("❌ 写入出错后仍继续编码全部文本")
+            return False
+
+    print("✅ 流水线写入正常")
+    print(f"   - {len(chunks)} 个文本块全部写入，编码最多领先写入 {max(backlog)} 个文本，出错后提前停止")
+    return True
+
+def test_chunk_store():
+    """测试列式文本块存储：与JSON互相转换后内容和键顺序不变，按人物和字段筛选与逐行判断一致"""
+    print("\n🗄️ 测试列式文本块存储...")
+
+    import json
+    import tempfile
+    import numpy as np
+    from chunk_store import ChunkStore, load_chunks, is_chunk_store
+
+    names = ['祥子', '虎妞', '刘四爷', '小福子', '二强子', '老马', '小马', '曹先生', '高妈']
+    chunks = []
+    for i in range(60):
+        chunk = {'chunk_id': f"chunk_{i:04d}", 'chapter_num': 1 + i // 10,
+                 'chapter_title': f"第{1 + i // 10}章", 'word_count': 100 + i,
+                 'characters': [names[j] for j in range(len(names)) if (i * 7 >> j) % 3 == 0][::-1],
+                 'content': f"第{i}段：祥子拉着车。\n“下雨了！”🌧"}
+        if i % 4 == 0:
+            chunk['paragraph_range'] = f"{i}-{i + 2}"
+        if i % 5 == 4:
+            del chunk['word_count']
+        chunks.append(chunk)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, "chunks.json")
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(chunks, f, ensure_ascii=False, indent=2)
+        store_path = os.path.join(tmp, "chunks_store")
+        store = ChunkStore.from_json(json_path, store_path)
+
+        exported = os.path.join(tmp, "exported.json")
+        store.to_json(exported)
+        with open(json_path, 'r', encoding='utf-8') as f:
+            original = f.read()
+        with open(exported, 'r', encoding='utf-8') as f:
+            if f.read() != original:
+                print("❌ 导出的JSON与原文件不一致")
+                return False
+        if not is_chunk_store(store_path) or load_chunks(store_path) != load_chunks(json_path):
+            print("❌ load_chunks 读取列式存储与JSON结果不同")
+            return False
+
+        store = ChunkStore(store_path)
+        if store.get('chunk_0037') != chunks[37] or len(store) != len(chunks):
+            print("❌ 按chunk_id读取的文本块不正确")
+            return False
+        for name in names + ['不存在的人']:
+            expected = [i for i, chunk in enumerate(chunks) if name in chunk['characters']]
+            if store.rows_with_character(name).tolist() != expected:
+                print(f"❌ 按人物筛选结果不正确: {name}")
+                return False
+        checks = [('chapter_num', 3), ('chapter_title', '第5章'), ('word_count', 111),
+                  ('paragraph_range', '8-10'), ('chapter_title', '第99章')]
+        for field, value in checks:
+            expected = [i for i, chunk in enumerate(chunks) if chunk.get(field) == value]
+            if store.rows_where(field, value).tolist() != expected:
+                print(f"❌ 按字段筛选结果不正确: {field}={value}")
+                return False
+
+        empty = ChunkStore.write(os.path.join(tmp, "empty"), [])
+        if len(empty) != 0 or list(empty) != []:
+            print("❌ 空存储读取不正确")
+            return False
+
+    print("✅ 列式文本块存储正常")
+    print(f"   - {len(chunks)} 个文本块往返转换一致，人物和字段筛选与逐行判断相同")
+    return True
+
+def test_metrics():
+    """测试运行指标：Prometheus文本和JSON报告的内容，关闭时不记录，检索流程记录各阶段指标"""
+    print("\n📈 测试运行指标...")
+
+    import json
+    import tempfile
+    import metrics
+    from metrics import MetricsRegistry
+
+    registry = MetricsRegistry(enabled=True)
+    registry.inc('rag_queries', 3, backend='numpy')
+    registry.inc('rag_queries', backend='numpy')
+    registry.inc('rag_errors', stage='say "hi"\n')
+    for value in (0.002, 0.02, 0.2, 7.0):
+        registry.observe('rag_seconds', value)
+    try:
+        with registry.timer('rag_write_seconds', backend='numpy'):
+            raise RuntimeError("写入失败")
+    except RuntimeError:
+        pass
+
+    text = registry.to_prometheus()
+    expected_lines = [
+        '# TYPE rag_queries_total counter',
+        'rag_queries_total{backend="numpy"} 4',
+        'rag_errors_total{stage="say \\"hi\\"\\n"} 1',
+        '# TYPE rag_seconds histogram',
+        'rag_seconds_bucket{le="0.001"} 0',
+        'rag_seconds_bucket{le="0.0025"} 1',
+        'rag_seconds_bucket{le="0.25"} 3',
+        'rag_seconds_bucket{le="10"} 4',
+        'rag_seconds_bucket{le="+Inf"} 4',
+        'rag_seconds_sum 7.222000',
+        'rag_seconds_count 4',
+        'rag_write_seconds_count{backend="numpy",status="error"} 1',
+    ]
+    missing = [line for line in expected_lines if line not in text.splitlines()]
+    if missing:
+        print(f"❌ Prometheus文本缺少: {missing}")
+        return False
+
+    report = registry.report(extra={'run': 'test'})
+    summary = report['histograms'][0]
+    if (report['run'] != 'test' or summary['name'] != 'rag_seconds' or summary['count'] != 4
+            or summary['max'] != 7.0 or summary['p50'] != 0.11):
+        print(f"❌ JSON报告不正确: {summary}")
+        return False
+
+    disabled = MetricsRegistry()
+    disabled.inc('rag_queries')
+    with disabled.timer('rag_seconds'):
+        pass
+    if disabled.to_prometheus() != "\n" or disabled.report()['counters']:
+        print("❌ 关闭时不应记录指标")
+        return False
+
+    was_enabled = metrics.is_enabled()
+    metrics.get_registry().reset()
+    metrics.enable()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            chunks_file = os.path.join(tmp, "chunks.json")
+            with open(chunks_file, 'w', encoding='utf-8') as f:
+                json.dump(make_test_chunks([["祥子拉着车。", "虎妞来了。"]]), f, ensure_ascii=False)
+            processor = make_stub_processor(tmp, search_cache_size=0)
+            processor.process_json_chunks(chunks_file)
+            processor.search_many(["祥子", "虎妞"], n_results=1)
+        report = metrics.get_registry().report()
+    finally:
+        metrics.enable(was_enabled)
+        metrics.get_registry().reset()
+
+    counters = {counter['name']: counter['value'] for counter in report['counters']}
+    timers = {histogram['name'] for histogram in report['histograms']}
+    if (counters.get('rag_index_written_rows') != 2 or counters.get('rag_index_queries') != 2
+            or not {'rag_encode_seconds', 'rag_index_query_seconds', 'rag_index_write_seconds'} <= timers):
+        print(f"❌ 检索流程的指标不完整: {counters}, {sorted(timers)}")
+        return False
+
+    print("✅ 运行指标正常")
+    print(f"   - 检索流程记录了 {len(counters)} 个计数器和 {len(timers)} 个计时器")
+    return True
+
 def test_process_full_novel():
     """测试完整小说处理流程"""
     print("\n🔄 测试完整小说处理流程...")
@@ -240,6 +1567,29 @@ def main():
         ("数据文件", test_data_files),
         ("JSON处理", test_json_processing),
         ("API连接", test_api_connection),
+        ("map-reduce分析", test_map_reduce_analysis),
+        ("响应缓存", test_llm_cache_namespace),
+        ("ONNX一致性标记", test_onnx_parity_marker),
+        ("文本分块", test_chunker_overlap),
+        ("增量入库", test_incremental_ingest),
+        ("人物过滤", test_character_filter),
+        ("入库时检索", test_query_during_ingest),
+        ("检索结果缓存", test_search_cache_invalidation),
+        ("BM25索引", test_lexical_index),
+        ("分片分配", test_shard_assignment),
+        ("IVF索引增长", test_ivf_growth),
+        ("向量缓存", test_embedding_cache),
+        ("批量检索", test_search_many),
+        ("NumPy索引", test_numpy_index),
+        ("过滤下推", test_filter_pushdown),
+        ("多书并行处理", test_library_ingest),
+        ("量化检索", test_quantized_search),
+        ("上下文组装", test_context_packer),
+        ("常驻检索服务", test_retrieval_server),
+        ("按长度分桶编码", test_length_bucketing),
+        ("流水线写入", test_write_pipeline),
+        ("列式文本块存储", test_chunk_store),
+        ("运行指标", test_metrics),
         ("完整流程", test_process_full_novel),
         ("向量数据库", test_vector_database),
         ("搜索功能", test_search_functionality)